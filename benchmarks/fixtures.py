@@ -0,0 +1,52 @@
+import numpy as np
+
+from lib.AdjacencyMatrix import AdjacencyMatrix
+from lib.SpikeTrainSet import SpikeTrainSet
+
+def spike_fixture(n,spikes_per_neuron=20,duration=1000,seed=0):
+    '''
+    Synthetic spikes of n neurons: a Poisson number of spikes per neuron (mean spikes_per_neuron) at uniform random
+    times in [0,duration) ms on a 0.1 ms grid, in time order like a SpikeMonitor.
+    Returns a SpikeTrainSet
+    '''
+    rng = np.random.default_rng(seed)
+    counts = rng.poisson(spikes_per_neuron, n)
+    i = np.repeat(np.arange(n, dtype=np.int32), counts)
+    t = np.round(rng.uniform(0, duration, len(i)), 1)
+    order = np.argsort(t, kind='stable')
+    return SpikeTrainSet(t[order], i[order], n)
+
+def graph_fixture(n,k=10,p=0.1,seed=0):
+    # Small-world topology (AdjacencyMatrix.small_world_sparse), returns A (CSR) and its SparseGraph
+    am = AdjacencyMatrix.__new__(AdjacencyMatrix) # No figure clearing
+    return am.small_world_sparse(n,k,p,seed=seed)
+
+def sweep_config(n,t1=50,t2=100,k=4,p=0.5,seed=0):
+    '''
+    BatchSweep config of three small-world networks of n neurons with the N2_BatchSimModel constants.
+    Brian2 is imported here so the other fixtures work without it
+    '''
+    from brian2 import mV, um, um2, pi, psiemens, nsiemens, farad, cm2, pamp, ms
+    rng = np.random.default_rng(seed)
+    excit = int(0.8*n)
+    am = AdjacencyMatrix.__new__(AdjacencyMatrix)
+    topology = []
+    for net in range(3):
+        A, _ = am.small_world_sparse(n,k,p,seed=seed+net)
+        connect_A, _, rows, cols = am.adj_synapse_type_sparse(A,excit)
+        topology.append((rows, cols, connect_A*mV*100*0.2))
+    SA = 2*pi*(20*um/2)*(20*um) # Membrane surface area
+    namespace = dict(gL=1*psiemens/um2*SA, we=.5*nsiemens, wi=1.5*nsiemens, C_mem=10e-6*farad/cm2*SA,
+                     E_ex=0*mV, E_i=-80*mV, E_l=-90*mV, tau_ge=2*ms, v_th=-55*mV, v_r=-70*mV)
+    neuron_diffeqns = '''
+    dv/dt = (1/C_mem)*(ge*(v - E_ex) + gi*(v - E_i) + gL*(v - E_l) + I) : volt (unless refractory)
+    dge/dt = -ge/tau_ge : siemens
+    dgi/dt = -gi/tau_gi : siemens
+    I : ampere
+    tau_gi : second
+    '''
+    states = [{'tau_gi': rng.normal(6.8,1,n)*ms, 'I': rng.normal(10,1,n)*pamp} for _ in range(3)]
+    return dict(topology=topology, PInput=[0.1*mV]*3, states=states, N=n, excit=excit, inhib=n-excit,
+                connect_type='ee', neuron_diffeqns=neuron_diffeqns, integ_method='heun', v_c=-70*mV,
+                g_EE=4*psiemens/um2*SA, g_II=4*psiemens/um2*SA, bin_size=1, t1=t1, t2=t2, namespace=namespace,
+                codegen_target='numpy')
@@ -0,0 +1,182 @@
+'''
+Benchmarks of the topology, simulation and spike analysis hot paths at increasing network sizes
+
+Usage (from the repository root):
+    python -m benchmarks.run                                   # all benchmarks at n = 1e2, 1e3, 1e4, 1e5
+    python -m benchmarks.run --sizes 100 1000 --only spike_cc ISI_stats
+    python -m benchmarks.run --out new.json --baseline old.json   # exits with 1 if anything regressed
+
+Every benchmark is timed `repeat` times (min and median wall time) and run once more under tracemalloc for the
+peak of Python/NumPy allocations. Fixtures are built before timing. Benchmarks whose cost grows with n*n stop at
+their max_n and are recorded as skipped above it. Runs offline on a CPU: the sweep point uses the NumPy engine
+unless --engine brian2 is given (Brian2 runtime mode with the numpy code generation target, no compiler needed).
+'''
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+import numpy as np
+
+from .fixtures import spike_fixture, graph_fixture, sweep_config
+
+def bench_adj_synapse_type(n,args):
+    from lib.AdjacencyMatrix import AdjacencyMatrix
+    A, _ = graph_fixture(n,seed=args.seed)
+    am = AdjacencyMatrix.__new__(AdjacencyMatrix)
+    return lambda: am.adj_synapse_type(A,int(0.8*n))
+
+def bench_adj_synapse_type_sparse(n,args):
+    from lib.AdjacencyMatrix import AdjacencyMatrix
+    A, _ = graph_fixture(n,seed=args.seed)
+    am = AdjacencyMatrix.__new__(AdjacencyMatrix)
+    return lambda: am.adj_synapse_type(A,int(0.8*n),sparse=True)
+
+def bench_spk_extract(n,args):
+    # From a get_states() entry as in the sweep, so every call pays the SpikeTrainSet build and its time sort
+    from lib.Spike_Stats import Spike_Stats
+    t, i = spike_fixture(n,args.spikes_per_neuron,args.duration,args.seed).by_time()
+    states = {'t': t, 'i': i}
+    return lambda: Spike_Stats().spk_extract(states,args.duration/4,3*args.duration/4,N=n)
+
+def bench_spikebin_total(n,args):
+    from lib.Spike_Stats import Spike_Stats
+    t = spike_fixture(n,args.spikes_per_neuron,args.duration,args.seed).t
+    return lambda: Spike_Stats().spikebin_total(t,0,args.duration,1)
+
+def bench_spike_cc(n,args):
+    from lib.Spike_Stats import Spike_Stats
+    stats = Spike_Stats()
+    X, _ = stats.spikebin_matrix(spike_fixture(n,args.spikes_per_neuron,args.duration,args.seed),0,args.duration,5)
+    Y, _ = stats.spikebin_matrix(spike_fixture(n,args.spikes_per_neuron,args.duration,args.seed+1),0,args.duration,5)
+    return lambda: stats.spike_cc(X,Y)
+
+def bench_ISI_stats(n,args):
+    from lib.Spike_Stats import Spike_Stats
+    spikes = spike_fixture(n,args.spikes_per_neuron,args.duration,args.seed)
+    return lambda: Spike_Stats().ISI_stats(spikes)
+
+def bench_char_path_len(n,args):
+    from lib.Visualization import Visualization
+    A, _ = graph_fixture(n,seed=args.seed)
+    vis = Visualization.__new__(Visualization)
+    n_sources = None if n <= 1000 else 64 # Exact up to 1e3 nodes, sampled estimate above
+    return lambda: vis.char_path_len(A,n_sources,seed=args.seed)
+
+def bench_sweep_point(n,args):
+    from lib import BatchSweep
+    config = sweep_config(n,seed=args.seed)
+    task = BatchSweep.run_lif_point if args.engine == 'numpy' else BatchSweep.run_point
+    from brian2 import mV
+    return lambda: task(config,2*mV,0.5,args.seed,False)
+
+def bench_import_analysis(n,args):
+    # Cold import of the analysis and topology modules in a fresh interpreter (same for every n)
+    modules = 'lib.Spike_Stats, lib.AdjacencyMatrix, lib.Visualization, lib.SynchronicityCalculation'
+    command = [sys.executable, '-c', 'import %s' % modules]
+    return lambda: subprocess.check_call(command)
+
+# name: (setup, max_n), setup(n,args) builds the fixtures and returns the function to time
+BENCHMARKS = {
+    'adj_synapse_type': (bench_adj_synapse_type, 10**3), # dense path, O(n*n) memory
+    'adj_synapse_type_sparse': (bench_adj_synapse_type_sparse, 10**5),
+    'spk_extract': (bench_spk_extract, 10**5),
+    'spikebin_total': (bench_spikebin_total, 10**5),
+    'spike_cc': (bench_spike_cc, 10**3), # (n x n) result
+    'ISI_stats': (bench_ISI_stats, 10**5),
+    'char_path_len': (bench_char_path_len, 10**5),
+    'sweep_point': (bench_sweep_point, 10**4),
+    'import_analysis': (bench_import_analysis, 10**2), # does not depend on n
+}
+
+def measure(func,repeat=3):
+    '''
+    Wall times (s) of repeat calls and the tracemalloc peak (bytes) of one more call.
+    Returns time_min, time_median, peak_bytes
+    '''
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return min(times), float(np.median(times)), peak
+
+def run(args):
+    results = []
+    for name in args.only or list(BENCHMARKS):
+        setup, max_n = BENCHMARKS[name]
+        for n in args.sizes:
+            record = {'name': name, 'n': n, 'spikes_per_neuron': args.spikes_per_neuron}
+            if n > max_n:
+                record['status'] = 'skipped (n > %d)' % max_n
+            else:
+                func = setup(n,args)
+                func() # Warm up (imports, caches, code generation)
+                time_min, time_median, peak = measure(func,args.repeat)
+                record.update(status='ok', time_min=time_min, time_median=time_median, peak_bytes=peak)
+                print('%-24s n=%-7d %10.4f s %10.1f MB' % (name, n, time_min, peak/2.0**20))
+            results.append(record)
+    return results
+
+def compare(results,baseline,time_threshold=1.25,memory_threshold=1.25,min_time=1e-3):
+    '''
+    Regressions of results against baseline results: entries (matched by name and n) whose time_min or peak_bytes
+    grew by more than the threshold factor. Times below min_time are too noisy to compare.
+    Returns a list of (name, n, quantity, baseline value, new value)
+    '''
+    old = dict(((r['name'], r['n']), r) for r in baseline if r.get('status') == 'ok')
+    regressions = []
+    for r in results:
+        b = old.get((r['name'], r['n']))
+        if r.get('status') != 'ok' or b is None:
+            continue
+        if r['time_min'] > max(b['time_min'], min_time)*time_threshold:
+            regressions.append((r['name'], r['n'], 'time_min', b['time_min'], r['time_min']))
+        if r['peak_bytes'] > b['peak_bytes']*memory_threshold:
+            regressions.append((r['name'], r['n'], 'peak_bytes', b['peak_bytes'], r['peak_bytes']))
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmarks of the lib package hot paths')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10**2, 10**3, 10**4, 10**5])
+    parser.add_argument('--only', nargs='+', choices=sorted(BENCHMARKS), help='benchmarks to run (default: all)')
+    parser.add_argument('--spikes-per-neuron', type=float, default=20)
+    parser.add_argument('--duration', type=float, default=1000, help='spike fixture duration (ms)')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--engine', choices=['numpy', 'brian2'], default='numpy', help='sweep point engine')
+    parser.add_argument('--out', default='benchmark_results.json')
+    parser.add_argument('--baseline', help='results JSON of an earlier run to compare against')
+    parser.add_argument('--time-threshold', type=float, default=1.25, help='allowed slowdown factor')
+    parser.add_argument('--memory-threshold', type=float, default=1.25, help='allowed peak memory growth factor')
+    args = parser.parse_args(argv)
+
+    results = run(args)
+    meta = {'python': platform.python_version(), 'numpy': np.__version__, 'platform': platform.platform(),
+            'processor': platform.processor(), 'cpus': os.cpu_count(),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'args': vars(args)}
+    with open(args.out, 'w') as f:
+        json.dump({'meta': meta, 'results': results}, f, indent=1)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+        regressions = compare(results,baseline,args.time_threshold,args.memory_threshold)
+        for name, n, quantity, before, after in regressions:
+            print('REGRESSION %s n=%d %s: %.4g --> %.4g (x%.2f)' % (name, n, quantity, before, after, after/before))
+        if regressions:
+            return 1
+        print('No regressions against %s' % args.baseline)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,7 +1,76 @@
-import networkx as nx
-from brian2 import *
-import matplotlib.pyplot as plt
-import matplotlib.patches as mpatches
+import numpy as np
+import scipy.sparse as sp
+
+from .Profiler import profiled
+from .LazyImports import lazy, close_figures
+
+def geometric_indices(m,p,rng):
+    '''
+    Selects each of the m items 0..m-1 independently with probability p and returns the sorted indices
+    of the selected items. Uses geometric edge skipping (Batagelj & Brandes 2005): the gaps between
+    selected items are drawn from a geometric distribution, so the cost is O(m*p) instead of O(m).
+    rng: numpy Generator
+    '''
+    if m <= 0 or p <= 0:
+        return np.zeros(0, dtype=np.int64)
+    if p >= 1:
+        return np.arange(m, dtype=np.int64)
+    chosen = []
+    last = -1 # index of the last selected item
+    expected = m*p
+    chunk = int(expected + 6*np.sqrt(expected*(1-p))) + 16 # draw enough gaps to finish in one pass most times
+    while True:
+        pos = last + np.cumsum(rng.geometric(p, size=chunk))
+        if pos[-1] >= m:
+            chosen.append(pos[pos < m])
+            break
+        chosen.append(pos)
+        last = pos[-1]
+        chunk = int((m-last)*p*1.1) + 16
+    return np.concatenate(chosen)
+
+def pair_from_index(k):
+    '''
+    Maps linear indices k of the strict upper triangle to node pairs (u,v) with u < v.
+    Pairs are numbered column by column: k = v*(v-1)/2 + u
+    '''
+    k = np.asarray(k, dtype=np.int64)
+    v = ((1 + np.sqrt(1 + 8*k.astype(np.float64)))//2).astype(np.int64)
+    # Correct off-by-one errors from floating point rounding for very large k
+    v -= (v*(v-1)//2 > k)
+    v += ((v+1)*v//2 <= k)
+    u = k - v*(v-1)//2
+    return u, v
+
+def symmetric_csr(n,u,v):
+    '''
+    Builds the symmetric n by n adjacency matrix (CSR, int8 with 1s for connections) of the undirected
+    edges (u,v). Duplicate edges are merged.
+    '''
+    rows = np.concatenate((u, v)).astype(np.int32)
+    cols = np.concatenate((v, u)).astype(np.int32)
+    A = sp.csr_matrix((np.ones(len(rows), dtype=np.int8), (rows, cols)), shape=(n, n))
+    A.sum_duplicates()
+    A.data[:] = 1 # Merged duplicates count as a single connection
+    return A
+
+class SparseGraph:
+    '''
+    Lightweight stand-in for the NetworkX Graph returned by the array-based generators (random_sparse,
+    small_world_sparse). Only holds the CSR adjacency matrix A. The NetworkX Graph is built the first time
+    to_networkx is called, eg. when Visualization needs it.
+    '''
+    def __init__(self,A):
+        self.A = A
+        self.graph = None
+        
+    def number_of_nodes(self):
+        return self.A.shape[0]
+        
+    def to_networkx(self):
+        if self.graph is None:
+            self.graph = lazy('networkx').from_scipy_sparse_array(self.A)
+        return self.graph
 
 class AdjacencyMatrix:  
     '''
@@ -27,12 +96,13 @@ class AdjacencyMatrix:
         d: degrees
     '''
     def __init__(self,n): 
-        plt.clf() # Clears any previous figures
-        plt.close() # Clears any figure windows
+        close_figures(clear=True) # Clears any previous figures and figure windows
         
+    @profiled()
     def random(self,n,p): 
         # Interchangeable based on UI for different types of topography
         #G = nx.dense_gnm_random_graph(n,m) # Uses NetX to generate random topography, need to add input param m
+        nx = lazy('networkx')
         Graph = nx.gnp_random_graph(n,p)
         #nx.draw(G, with_labels=True) # Draws connectivity figure
         #plt.savefig("Random.png") # Saves connectivity figure as Random.png
@@ -41,13 +111,61 @@ class AdjacencyMatrix:
         A = nx.adjacency_matrix(Graph) # Assigns A as adjacency matrix (which nodes are connected)
         return A, Graph 
     
+    @profiled()
     def small_world(self,n,k,p): 
+        nx = lazy('networkx')
         Graph = nx.newman_watts_strogatz_graph(n,k,p) 
         #nx.draw(G, with_labels=True)
         #plt.savefig("Small-world.png")
         A = nx.adjacency_matrix(Graph)
         return A, Graph
     
+    @profiled()
+    def random_sparse(self,n,p,seed=None):
+        '''
+        Array-based G(n,p) random graph, same model as nx.gnp_random_graph but without building a NetworkX Graph.
+        Uses geometric edge skipping over the n*(n-1)/2 possible connections, so the cost is O(n + edges).
+        seed: integer seed (or numpy Generator) for reproducible topologies
+        Returns A (CSR adjacency matrix) and a SparseGraph that builds the NetworkX Graph lazily
+        '''
+        rng = np.random.default_rng(seed)
+        k = geometric_indices(n*(n-1)//2, p, rng) # linear indices of connected node pairs
+        u, v = pair_from_index(k)
+        A = symmetric_csr(n, u, v)
+        return A, SparseGraph(A)
+    
+    @profiled()
+    def small_world_sparse(self,n,k,p,seed=None):
+        '''
+        Array-based Newman-Watts-Strogatz small-world graph, same model as nx.newman_watts_strogatz_graph
+        but without building a NetworkX Graph.
+        Each node is joined to its k//2 nearest neighbours on each side of a ring, then for every ring edge (u,v)
+        a shortcut (u,w) to a random node w != u is added with probability p. Shortcuts that already exist are
+        merged instead of redrawn.
+        seed: integer seed (or numpy Generator) for reproducible topologies
+        Returns A (CSR adjacency matrix) and a SparseGraph that builds the NetworkX Graph lazily
+        '''
+        if k > n:
+            raise ValueError("k>n, choose smaller k or n")
+        rng = np.random.default_rng(seed)
+        if k == n: # Complete graph, same as networkx
+            u, v = pair_from_index(np.arange(n*(n-1)//2, dtype=np.int64))
+            A = symmetric_csr(n, u, v)
+            return A, SparseGraph(A)
+        
+        # Ring lattice
+        nodes = np.arange(n, dtype=np.int64)
+        ring_u = np.tile(nodes, k//2)
+        ring_v = (ring_u + np.repeat(np.arange(1, k//2+1), n)) % n
+        
+        # Random shortcuts from the source node of each selected ring edge
+        short_u = ring_u[rng.random(len(ring_u)) < p]
+        short_w = rng.integers(0, n-1, size=len(short_u))
+        short_w += (short_w >= short_u) # Skips the source node itself, no self connections
+        
+        A = symmetric_csr(n, np.concatenate((ring_u, short_u)), np.concatenate((ring_v, short_w)))
+        return A, SparseGraph(A)
+    
     def unidir_coord(self,rows, cols):
         # function to remove duplicate connections like (0,3) and (3,0) so that all connections are uni- and not bi-directional
         coord = zip(rows,cols) # To get an array of coordinate pair tuples, to define node pairs or edges 
@@ -57,11 +175,16 @@ class AdjacencyMatrix:
                                       # In each 1 by 2 vector: column 0 is source neuron and column 1 is target neuron
         new_rows = g[:,0] #1-D array of all source neurons i
         new_cols = g[:,1] #1-D array of all target neurons j
-        new_coord = zip(new_rows,new_cols) # list of tuples, source and target ordered pairs with no duplicates
+        new_coord = np.column_stack((new_rows,new_cols)) # (connections x 2) array of source and target ordered pairs
+                                                          # with no duplicates, same as adj_synapse_type_sparse
         return new_coord, new_rows, new_cols
     
-    def adj_synapse_type(self,A,excit):
+    @profiled()
+    def adj_synapse_type(self,A,excit,sparse=False):
         ### Define connections as inhibitory or excitatory in the adjacency matrix
+        if sparse:
+            return self.adj_synapse_type_sparse(A,excit) # Never densifies A, use for large networks
+        
         A_mat = A.todense() # Converts adjacency matrix from 'scipy.sparse.csr.csr_matrix' to numpy matrix                              
         rows, cols = np.nonzero(A_mat) # Two arrays of index positions for connections
         [new_coord, new_rows, new_cols] = self.unidir_coord(rows,cols) # Removes duplicate connections
@@ -81,4 +204,35 @@ class AdjacencyMatrix:
             y = new_cols [i]
             connect_A.append(A_mat[x,y])
         connect_A = np.array(connect_A) # Converting data type list to numpy array
-        return connect_A,new_coord,new_rows,new_cols
\ No newline at end of file
+        return connect_A,new_coord,new_rows,new_cols
+
+    @profiled()
+    def adj_synapse_type_sparse(self,A,excit):
+        '''
+        Sparse version of adj_synapse_type. Works directly on the CSR adjacency matrix so memory and time
+        are O(edges) instead of O(n*n), which makes graphs with millions of neurons practical.
+        
+        Returns the same (connect_A, new_coord, new_rows, new_cols) contract as adj_synapse_type:
+            connect_A: float64 array, +weight for excitatory and -weight for inhibitory connections
+            new_coord: (connections x 2) int32 array of (source, target) pairs
+            new_rows: int32 array of source neurons
+            new_cols: int32 array of target neurons
+        Connections are ordered by source neuron and then by target neuron.
+        
+        A has to be symmetric (undirected graph), as produced by random and small_world
+        '''
+        # Upper triangle keeps one ordered pair (i<=j) per undirected connection, same as unidir_coord
+        A_up = sp.triu(sp.csr_matrix(A), k=0, format='csr')
+        A_up.sum_duplicates() # Canonical format: sorted column indices within each row, no duplicates
+        A_up.eliminate_zeros()
+
+        n_rows = A_up.shape[0]
+        new_rows = np.repeat(np.arange(n_rows, dtype=np.int32), np.diff(A_up.indptr)) # Source neuron of every entry
+        new_cols = A_up.indices.astype(np.int32) # Target neuron of every entry
+        connect_A = A_up.data.astype(np.float64)
+        
+        # If source neuron belongs to upper 20% of n it is inhibitory and the weight is made negative
+        connect_A[new_rows > (excit-1)] *= -1
+        
+        new_coord = np.column_stack((new_rows, new_cols)) # array of source and target ordered pairs
+        return connect_A,new_coord,new_rows,new_cols
@@ -0,0 +1,142 @@
+import os
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.colors import to_rgb
+
+from .SpikeTrainSet import to_ms
+
+def raster_counts(t,i,N,tstart,tend,time_bins=1000,neuron_bins=None,chunk=2**22):
+    '''
+    Spikes binned into a (neuron_bins x time_bins) image over [tstart,tend) (ms) and neurons 0..N-1.
+    Spikes are binned chunk at a time, so the image costs the same to draw for any number of spikes.
+    t: spike times (Brian2 quantity or ms), i: neuron indices
+    neuron_bins: defaults to one row per neuron up to 1000 rows
+    Returns counts: (neuron_bins x time_bins) array of spike counts
+    '''
+    if neuron_bins is None:
+        neuron_bins = min(N, 1000)
+    neuron_bins = max(int(neuron_bins), 1)
+    t = to_ms(t)
+    i = np.asarray(i)
+    counts = np.zeros(neuron_bins*time_bins, dtype=np.int64)
+    scale = time_bins / float(tend - tstart)
+    for k0 in range(0, len(t), chunk):
+        tb = np.floor((t[k0:k0+chunk] - tstart)*scale).astype(np.int64)
+        nb = i[k0:k0+chunk].astype(np.int64) * neuron_bins // max(N, 1)
+        keep = (tb >= 0) & (tb < time_bins) & (nb >= 0) & (nb < neuron_bins)
+        counts += np.bincount(nb[keep]*time_bins + tb[keep], minlength=neuron_bins*time_bins)
+    return counts.reshape(neuron_bins, time_bins)
+
+def psth(t,tstart,tend,bin_size=2):
+    '''
+    Peri-stimulus time histogram: total number of spikes in bins [t0,t0 + bin_size) from tstart to tend (ms)
+    Returns edges (ms), counts
+    '''
+    t = to_ms(t)
+    n_bins = max(int(np.ceil((tend - tstart) / float(bin_size))), 1)
+    b = np.floor((t - tstart) / bin_size).astype(np.int64)
+    keep = (b >= 0) & (b < n_bins)
+    return tstart + bin_size*np.arange(n_bins+1), np.bincount(b[keep], minlength=n_bins)
+
+def raster_rgba(counts,color):
+    # Colored RGBA image of a raster_counts image, transparent where there are no spikes
+    rgba = np.zeros(counts.shape + (4,))
+    rgba[..., :3] = to_rgb(color)
+    if counts.max() > 0:
+        level = np.sqrt(counts / float(counts.max())) # Single spikes stay visible next to dense bins
+        rgba[..., 3] = np.where(counts > 0, 0.35 + 0.65*level, 0)
+    return rgba
+
+def draw_raster(ax,t,i,N,tstart,tend,color='r',time_bins=1000,neuron_bins=None):
+    # Draws the raster plot of (t,i) on ax as an image, returns the raster_counts image
+    counts = raster_counts(t,i,N,tstart,tend,time_bins,neuron_bins)
+    ax.imshow(raster_rgba(counts,color),extent=[tstart,tend,0,N],origin='lower',aspect='auto',
+              interpolation='nearest')
+    ax.set_xlim(tstart,tend)
+    ax.set_ylim(0,N)
+    return counts
+
+def draw_psth(ax,t,tstart,tend,bin_size=2,color='C0'):
+    # Draws the PSTH of t on ax from the binned counts, returns edges (ms), counts
+    edges,counts = psth(t,tstart,tend,bin_size)
+    ax.stairs(counts,edges,fill=True,color=color)
+    ax.set_xlim(tstart,tend)
+    return edges,counts
+
+class BatchFigures:
+    '''
+    Headless figures of the batch simulation program (batch_plot in N2_BatchSimModel.ipynb)
+
+    Description:
+    Spikes are binned into a time x neuron image and PSTH arrays first and those are drawn, so a figure costs the
+    same for 1e3 or 1e7 spikes. Figures are built on matplotlib's Agg canvas without pyplot, so no global figure
+    state is shared and every datastream entry can be rendered in its own worker process.
+
+    Parameters:
+        N: number of neurons per network
+        run_time: total simulation time (ms, no units)
+        phases: times of the phase boundaries (ms), eg. [phase1, phase2, phase3]
+        bin_size: PSTH bin size (ms)
+        time_bins: number of time bins of the raster images
+    '''
+    def __init__(self,N,run_time,phases=(),bin_size=2,time_bins=1000):
+        self.N = N
+        self.run_time = run_time
+        self.phases = list(phases)
+        self.bin_size = bin_size
+        self.time_bins = time_bins
+
+    def figure(self,entry,title=''):
+        '''
+        Figure of one datastream entry (SN_1t,SN_1i,SN_2t,SN_2i,SN_indvt): rasters of Network 2 and Network 1 and
+        the PSTHs of Network 2, Network 1 and the uncoupled control
+        '''
+        SN1t,SN1i,SN2t,SN2i,SN0t = entry
+        fig = Figure(figsize=(12,10))
+        FigureCanvasAgg(fig)
+        axes = fig.subplots(5,1,sharex=True,gridspec_kw={'height_ratios':[3,3,1,1,1]})
+        draw_raster(axes[0],SN2t,SN2i,self.N,0,self.run_time,'r',self.time_bins) # target or slave network
+        draw_raster(axes[1],SN1t,SN1i,self.N,0,self.run_time,'g',self.time_bins) # source or master network
+        draw_psth(axes[2],SN2t,0,self.run_time,self.bin_size,'r')
+        draw_psth(axes[3],SN1t,0,self.run_time,self.bin_size,'g')
+        draw_psth(axes[4],SN0t,0,self.run_time,self.bin_size,'k')
+        for ax, label in zip(axes, ['Network 2','Network 1','Network 2 spikes','Network 1 spikes','Uncoupled spikes']):
+            ax.set_ylabel(label)
+            for phase in self.phases:
+                ax.axvline(x=phase,color='k',linewidth=1.5)
+        axes[0].set_title(title)
+        axes[-1].set_xlabel('Time (ms)')
+        return fig
+
+    def save(self,entry,filename,title='',dpi=100):
+        fig = self.figure(entry,title)
+        fig.savefig(filename,dpi=dpi)
+        return filename
+
+    def export(self,datastream,directory,record_param=None,w_couple=None,n_workers=None,fmt='png',dpi=100):
+        '''
+        Saves one figure per datastream entry into directory, rendering them in parallel worker processes.
+        record_param/w_couple: optional, used for the titles as in the notebook
+        n_workers: number of worker processes, None uses all cores and 1 renders in this process
+        Returns the list of file names in datastream order
+        '''
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        jobs = []
+        for index, entry in enumerate(datastream):
+            entry = tuple(to_ms(x) if k in (0,2,4) else np.asarray(x) for k, x in enumerate(entry)) # plain arrays pickle cheaply
+            title = ''
+            name = 'batch_%03d' % index
+            if record_param is not None:
+                weight, prob = record_param[index]
+                cf = weight/w_couple if w_couple is not None else weight
+                title = 'Coupling of Two Small World Networks\n with p= %.2f and cf=%.2f' % (prob, float(cf))
+                name = 'batch_p%.3f_cf%.3f' % (prob, float(cf))
+            jobs.append((entry, os.path.join(directory, '%s.%s' % (name, fmt)), title))
+        if n_workers == 1:
+            return [self.save(entry,filename,title,dpi) for entry, filename, title in jobs]
+        with ProcessPoolExecutor(max_workers=n_workers) as pool:
+            futures = [pool.submit(self.save,entry,filename,title,dpi) for entry, filename, title in jobs]
+            return [future.result() for future in futures]
@@ -0,0 +1,574 @@
+import functools
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from brian2 import *
+
+from .BrianVisualization import BrianVisualization, coupling_indices, coupling_synapses
+from .Spike_Stats import Spike_Stats
+from .LIFEngine import LIFEngine
+from .Profiler import Profiler, span, run_network
+
+def point_seed(base_seed,w_couple,p_couple):
+    # Deterministic seed for grid point (w_couple,p_couple), independent of which worker runs it, in which order,
+    # or where the point sits in the grid (so an extended grid reuses cached points)
+    bits = [int(np.float64(np.asarray(value)).view(np.uint64)) for value in (w_couple, p_couple)]
+    return int(np.random.SeedSequence([base_seed] + bits).generate_state(1)[0])
+
+def coupling_seed(base_seed,p_couple):
+    # Seed of the random coupling pattern of p_couple ('pattern'/'fan' of the config). It does not depend on w_couple,
+    # so every weight and every engine (per point, template, replica, NumPy, standalone) couples the same neuron pairs
+    return point_seed(base_seed,0,p_couple)
+
+# Units of the arrays stored per point in the ResultCache (values are kept in SI units without Brian2 units)
+point_units = {'SN_1t': second, 'SN_2t': second, 'SN_indvt': second, 'SN_1i': 1, 'SN_2i': 1,
+               'SN_1runtime': second, 'SN_1v': volt, 'SN_2v': volt,
+               'SN_1ge': siemens, 'SN_1gi': siemens, 'SN_2ge': siemens, 'SN_2gi': siemens}
+
+def point_to_arrays(cc,spikes,monitors):
+    # Flattens a point result into a dict of plain arrays for the ResultCache
+    point = {'cc': np.asarray(cc)}
+    names = ['SN_1t','SN_1i','SN_2t','SN_2i','SN_indvt']
+    values = list(spikes)
+    if monitors is not None:
+        names += ['SN_1runtime','SN_1v','SN_2v','SN_1ge','SN_1gi','SN_2ge','SN_2gi']
+        values += list(monitors[0]) + list(monitors[1])
+    for name, value in zip(names, values):
+        point[name] = np.asarray(value)
+    return point
+
+def point_from_arrays(point):
+    # Inverse of point_to_arrays, restores Brian2 units
+    def get(name):
+        return point[name]*point_units[name]
+    spikes = tuple(get(name) for name in ['SN_1t','SN_1i','SN_2t','SN_2i','SN_indvt'])
+    monitors = None
+    if 'SN_1v' in point:
+        monitors = (tuple(get(name) for name in ['SN_1runtime','SN_1v','SN_2v']),
+                    tuple(get(name) for name in ['SN_1ge','SN_1gi','SN_2ge','SN_2gi']))
+    return float(point['cc']), spikes, monitors
+
+def run_point(config,w_couple,p_couple,rand_seed,record,c_seed=0):
+    '''
+    Runs one (w_couple,p_couple) point of the batch program in its own Brian2 scope:
+    uncoupled control (Network 3) --> uncoupled/coupled/uncoupled phases of Networks 1 and 2 --> batch_cc
+    c_seed: seed of the coupling pattern (see coupling_seed)
+
+    Returns:
+        cc: correlation co-efficient of the binned spike trains of Network 1 and 2 during coupling
+        spikes: datastream entry in the notebook format (SN_1t,SN_1i,SN_2t,SN_2i,SN_indvt)
+        monitors: None if record is False, otherwise (voltage_monitor entry, conductance_monitor entry)
+    '''
+    start_scope()
+    seed(rand_seed) # Seeds both numpy and Brian2 random number generators
+    if config.get('codegen_target'):
+        prefs.codegen.target = config['codegen_target']
+
+    BrianVis = BrianVisualization()
+    stats = Spike_Stats()
+    namespace = config['namespace'] # Model constants, workers do not see the notebook's globals
+    N = config['N']
+    t1 = config['t1']
+    t2 = config['t2']
+    phase1 = int(t1)
+    phase2 = int(t1+t2)
+
+    # Creating individual network groups, Network 3 is the uncoupled analog to Network 1
+    with span('network_construction'):
+        groups = []
+        for net in range(3):
+            rows, cols, connect_W = config['topology'][net]
+            [G,S,P] = BrianVis.network_indv(rows,cols,connect_W,N,config['PInput'][net],'neurongroup_%d' %(net+1),
+                                            'synapsegroup_%d' %(net+1),config['neuron_diffeqns'],config['integ_method'],
+                                            config['v_c'],config['g_EE'],config['g_II'])
+            for name, value in config['states'][net].items(): # eg. tau_gi and I of each network
+                setattr(G, name, value)
+            groups.append((G,S,P))
+        [(G1,S1,P1),(G2,S2,P2),(G3,S3,P3)] = groups
+
+        net_batch = Network(G1,P1,S1,G2,P2,S2)
+        spikemon_indv = SpikeMonitor(G3, variables='v',name='spikemon_indv')
+        statemon_indv = StateMonitor(G3,variables='v',record=0,name='statemon_indv')
+        net_indv = Network(G3,P3,S3,spikemon_indv,statemon_indv)
+
+    # running the full simulation for uncoupled Network 1 as a control
+    run_network(net_indv,(2*t1+t2)*ms,'control',namespace)
+    with span('get_states'):
+        SN_indvt = net_indv.get_states()['spikemon_indv']['t']
+
+    # Coupling networks
+    with span('network_construction'):
+        [statemon_cG1,spikemon_cG1,statemon_cG2,spikemon_cG2,_,_,_,S1c2] =\
+        BrianVis.network_coupling(N,config['excit'],config['inhib'],p_couple,w_couple,G1,G2,'Synapse_1c2',config['connect_type'],
+                                  config.get('pattern','one_to_one'),config.get('fan'),c_seed)
+        net_batch.add(spikemon_cG1,spikemon_cG2,statemon_cG1,statemon_cG2)
+        coupled = S1c2 is not None # No coupling synapses for p_couple = 0
+        if coupled:
+            net_batch.add(S1c2)
+
+    # run 3 phase simulation (uncoupled --> coupled --> uncoupled)
+    if coupled:
+        S1c2.w = 0
+    run_network(net_batch,t1*ms,'phase1',namespace)
+    if coupled:
+        S1c2.w = w_couple * np.random.uniform(0,1,len(S1c2.w))
+    run_network(net_batch,t2*ms,'phase2',namespace)
+    if coupled:
+        S1c2.w = 0
+    run_network(net_batch,t1*ms,'phase3',namespace)
+
+    with span('get_states'):
+        states = net_batch.get_states()
+    [SN_1i,SN_1t] = [states['spikemon_cG1'][k] for k in ['i','t']]
+    [SN_2i,SN_2t] = [states['spikemon_cG2'][k] for k in ['i','t']]
+    cc = stats.batch_cc(SN_1t,SN_2t,phase1,phase2,config['bin_size'])
+    spikes = (SN_1t,SN_1i,SN_2t,SN_2i,SN_indvt)
+
+    if not record:
+        return cc, spikes, None
+    [SN_1v,SN_1ge,SN_1gi,SN_1runtime] = [states['statemon_cG1'][param] for param in ['v','ge','gi','t']]
+    [SN_2v,SN_2ge,SN_2gi] = [states['statemon_cG2'][param] for param in ['v','ge','gi']]
+    monitors = ((SN_1runtime,SN_1v,SN_2v), (SN_1ge,SN_1gi,SN_2ge,SN_2gi))
+    return cc, spikes, monitors
+
+worker_template = None # network_template of this process, built once and reused for all its points
+worker_control_seed = 0
+
+def init_template(config,p_couple_vec,record,control_seed=0):
+    global worker_template, worker_control_seed
+    worker_control_seed = control_seed
+    start_scope()
+    if config.get('codegen_target'):
+        prefs.codegen.target = config['codegen_target']
+    c_seeds = [coupling_seed(control_seed,p_couple) for p_couple in p_couple_vec]
+    worker_template = BrianVisualization().network_template(config,p_couple_vec,record,c_seeds)
+
+def batch_seed(base_seed,w_couple_vec,p_couple_vec):
+    # Deterministic seed of a replica batch, from the (w_couple,p_couple) values of all of its points
+    bits = [int(np.float64(np.asarray(value)).view(np.uint64)) for value in list(w_couple_vec) + list(p_couple_vec)]
+    return int(np.random.SeedSequence([base_seed] + bits).generate_state(1)[0])
+
+def tile_values(value,copies,n):
+    # Per element values (Brian2 quantity or plain) of one network repeated for each replica
+    values = np.broadcast_to(np.asarray(value, dtype=np.float64), (n,))
+    return Quantity(np.tile(values, copies), dim=get_dimensions(value))
+
+def run_replicas(config,w_couple_vec,p_couple_vec,rand_seed,record,replica_states=None,c_seeds=None):
+    '''
+    Simulates R = len(w_couple_vec) independent copies of the coupled Networks 1 and 2 in one run.
+    Replica r occupies neurons r*N..(r+1)*N-1 of one NeuronGroup per network. Its recurrent synapses are the
+    network topology shifted by r*N (block diagonal) and its coupling synapses are those of
+    (w_couple_vec[r],p_couple_vec[r]), so one vectorized state update advances all grid points.
+    The uncoupled control (Network 3) is simulated once for all replicas.
+    replica_states: optional list with one [dict for Network 1, dict for Network 2] per replica overriding
+                    config['states'] values (eg. I, tau_gi) of that replica
+    c_seeds: seed of the coupling pattern of each replica (see coupling_seed), default 0
+    Returns a list with one (cc, spikes, monitors) per replica, same as run_point
+    '''
+    start_scope()
+    seed(rand_seed)
+    if config.get('codegen_target'):
+        prefs.codegen.target = config['codegen_target']
+
+    BrianVis = BrianVisualization()
+    stats = Spike_Stats()
+    namespace = config['namespace']
+    N = config['N']
+    R = len(w_couple_vec)
+    t1 = config['t1']
+    t2 = config['t2']
+
+    groups = []
+    for net in range(3):
+        rows, cols, connect_W = config['topology'][net]
+        copies = R if net < 2 else 1
+        shift = np.repeat(np.arange(copies, dtype=np.int64)*N, len(rows))
+        rows_r = (np.tile(np.asarray(rows, dtype=np.int64), copies) + shift).astype(np.int32)
+        cols_r = (np.tile(np.asarray(cols, dtype=np.int64), copies) + shift).astype(np.int32)
+        [G,S,P] = BrianVis.network_indv(rows_r,cols_r,tile_values(connect_W,copies,len(rows)),N*copies,config['PInput'][net],'neurongroup_%d' %(net+1),
+                                        'synapsegroup_%d' %(net+1),config['neuron_diffeqns'],config['integ_method'],
+                                        config['v_c'],config['g_EE'],config['g_II'])
+        for name, value in config['states'][net].items():
+            values = tile_values(value,copies,N)
+            if net < 2 and replica_states is not None:
+                for r in range(R):
+                    if name in replica_states[r][net]:
+                        values[r*N:(r+1)*N] = replica_states[r][net][name]
+            setattr(G, name, values)
+        groups.append((G,S,P))
+    [(G1,S1,P1),(G2,S2,P2),(G3,S3,P3)] = groups
+
+    # Block diagonal coupling, replica r uses the pattern of p_couple_vec[r]
+    c_seeds = [0]*R if c_seeds is None else c_seeds
+    coupling = [coupling_indices(N,config['excit'],config['inhib'],p_couple_vec[r],config['connect_type'],
+                                 config.get('pattern','one_to_one'),config.get('fan'),c_seeds[r]) for r in range(R)]
+    sizes = np.array([len(c_rows) for c_rows, _ in coupling])
+    c_rows = np.concatenate([c_rows + r*N for r, (c_rows, _) in enumerate(coupling)]).astype(np.int32)
+    c_cols = np.concatenate([c_cols + r*N for r, (_, c_cols) in enumerate(coupling)]).astype(np.int32)
+    S1c2 = coupling_synapses(G1,G2,'Synapse_1c2',c_rows,c_cols) # None when every p_couple is 0
+    coupled = S1c2 is not None
+    spikemon_cG1 = SpikeMonitor(G1, name='spikemon_cG1')
+    spikemon_cG2 = SpikeMonitor(G2, name='spikemon_cG2')
+    spikemon_indv = SpikeMonitor(G3, name='spikemon_indv')
+    net_batch = Network(G1,P1,S1,G2,P2,S2,spikemon_cG1,spikemon_cG2)
+    if coupled:
+        net_batch.add(S1c2)
+    if record: # Neuron 0 of every replica
+        statemon_cG1 = StateMonitor(G1,variables=('v','ge','gi'), record=np.arange(R)*N, dt=10*us,name='statemon_cG1')
+        statemon_cG2 = StateMonitor(G2,variables=('v','ge','gi'), record=np.arange(R)*N, dt=10*us,name='statemon_cG2')
+        net_batch.add(statemon_cG1,statemon_cG2)
+    net_indv = Network(G3,P3,S3,spikemon_indv)
+
+    net_indv.run((2*t1+t2)*ms, namespace=namespace)
+    SN_indvt = net_indv.get_states()['spikemon_indv']['t']
+
+    # run 3 phase simulation (uncoupled --> coupled --> uncoupled)
+    w = np.concatenate([np.asarray(w_couple_vec[r])*np.random.uniform(0,1,sizes[r]) for r in range(R)])
+    if coupled:
+        S1c2.w = 0*volt
+    net_batch.run(t1*ms, namespace=namespace)
+    if coupled:
+        S1c2.w = w*volt
+    net_batch.run(t2*ms, namespace=namespace)
+    if coupled:
+        S1c2.w = 0*volt
+    net_batch.run(t1*ms, namespace=namespace)
+
+    states = net_batch.get_states()
+    def split(monitor):
+        # Spike times and replica-local neuron indices of each replica, in time order
+        i = np.asarray(monitor['i'])
+        t = monitor['t']
+        replica = i // N
+        order = np.argsort(replica, kind='stable')
+        bounds = np.searchsorted(replica[order], np.arange(R+1))
+        return [(t[order[bounds[r]:bounds[r+1]]], i[order[bounds[r]:bounds[r+1]]] - r*N) for r in range(R)]
+    spikes1 = split(states['spikemon_cG1'])
+    spikes2 = split(states['spikemon_cG2'])
+
+    results = []
+    for r in range(R):
+        SN_1t, SN_1i = spikes1[r]
+        SN_2t, SN_2i = spikes2[r]
+        cc = stats.batch_cc(SN_1t,SN_2t,int(t1),int(t1+t2),config['bin_size'])
+        monitors = None
+        if record:
+            [SN_1v,SN_1ge,SN_1gi,SN_1runtime] = [states['statemon_cG1'][param] for param in ['v','ge','gi','t']]
+            [SN_2v,SN_2ge,SN_2gi] = [states['statemon_cG2'][param] for param in ['v','ge','gi']]
+            column = slice(r, r+1) # (time x recorded neuron) arrays, one recorded neuron per replica
+            monitors = ((SN_1runtime,SN_1v[:,column],SN_2v[:,column]),
+                        (SN_1ge[:,column],SN_1gi[:,column],SN_2ge[:,column],SN_2gi[:,column]))
+        results.append((cc, (SN_1t,SN_1i,SN_2t,SN_2i,SN_indvt), monitors))
+    return results
+
+def run_template_point(config,w_couple,p_couple,rand_seed,record,c_seed=0):
+    '''
+    Same as run_point on the process' network_template: no objects are created per point and the uncoupled
+    control is simulated once per process instead of once per point
+    '''
+    BrianVis = BrianVisualization.__new__(BrianVisualization) # No figure clearing or new scope
+    t1 = config['t1']
+    t2 = config['t2']
+    SN_indvt = BrianVis.template_control(worker_template,2*t1+t2,worker_control_seed)
+    states = BrianVis.template_point(worker_template,w_couple,p_couple,rand_seed,record,c_seed)
+    [SN_1i,SN_1t] = [states['spikemon_cG1'][k] for k in ['i','t']]
+    [SN_2i,SN_2t] = [states['spikemon_cG2'][k] for k in ['i','t']]
+    cc = Spike_Stats().batch_cc(SN_1t,SN_2t,int(t1),int(t1+t2),config['bin_size'])
+    spikes = (SN_1t,SN_1i,SN_2t,SN_2i,SN_indvt)
+
+    if not record:
+        return cc, spikes, None
+    [SN_1v,SN_1ge,SN_1gi,SN_1runtime] = [states['statemon_cG1'][param] for param in ['v','ge','gi','t']]
+    [SN_2v,SN_2ge,SN_2gi] = [states['statemon_cG2'][param] for param in ['v','ge','gi']]
+    monitors = ((SN_1runtime,SN_1v,SN_2v), (SN_1ge,SN_1gi,SN_2ge,SN_2gi))
+    return cc, spikes, monitors
+
+def run_lif_point(config,w_couple,p_couple,rand_seed,record,c_seed=0):
+    '''
+    Same as run_point on the NumPy LIFEngine instead of Brian2 (no object setup or code generation).
+    Networks 1 and 2 are simulated as one engine of 2*N neurons (Network 2 is N..2N-1) whose coupling synapses
+    are switched on and off between phases. Returns (cc, spikes, monitors) in the run_point format, the state
+    monitors sample on the same 10 us clock. tests/test_lif_engine.py checks it against run_point
+    '''
+    N = config['N']
+    t1 = config['t1']
+    t2 = config['t2']
+    dt = config.get('dt', defaultclock.dt)
+    control_seed, coupled_seed, weight_seed = np.random.SeedSequence(rand_seed).spawn(3)
+    def engine(size,rows,cols,w,states,PInput,engine_seed):
+        return LIFEngine(size,rows,cols,w,config['namespace'],states,PInput,config['v_c'],config['g_EE'],config['g_II'],
+                         dt=dt,method=config['integ_method'],seed=engine_seed)
+
+    # Uncoupled control (Network 3)
+    rows, cols, connect_W = config['topology'][2]
+    control = engine(N,rows,cols,connect_W/float(100),config['states'][2],config['PInput'][2],control_seed)
+    control.run((2*t1+t2)*ms)
+    SN_indvt = control.spikes()[0]*second
+
+    # Networks 1 and 2 plus the coupling synapses, which come last
+    c_rows, c_cols = coupling_indices(N,config['excit'],config['inhib'],p_couple,config['connect_type'],
+                                      config.get('pattern','one_to_one'),config.get('fan'),c_seed)
+    (rows1, cols1, W1), (rows2, cols2, W2) = config['topology'][:2]
+    rows = np.concatenate([np.asarray(rows1), np.asarray(rows2) + N, c_rows])
+    cols = np.concatenate([np.asarray(cols1), np.asarray(cols2) + N, c_cols.astype(np.int64) + N])
+    w = np.concatenate([np.asarray(W1)/100, np.asarray(W2)/100, np.zeros(len(c_rows))])
+    states = {}
+    for name in config['states'][0]:
+        states[name] = np.concatenate([np.broadcast_to(np.asarray(config['states'][net][name], dtype=np.float64), (N,))
+                                       for net in range(2)])
+    PInput = np.repeat([float(config['PInput'][0]), float(config['PInput'][1])], N)
+    net_batch = engine(2*N,rows,cols,w,states,PInput,coupled_seed)
+    if record:
+        net_batch.monitor([0, N], dt=10*us) # Same clock as the state monitors of network_coupling
+
+    # run 3 phase simulation (uncoupled --> coupled --> uncoupled)
+    start = len(rows) - len(c_rows)
+    net_batch.run(t1*ms)
+    net_batch.set_weights(float(w_couple)*np.random.default_rng(weight_seed).uniform(0,1,len(c_rows)), start)
+    net_batch.run(t2*ms)
+    net_batch.set_weights(np.zeros(len(c_rows)), start)
+    net_batch.run(t1*ms)
+
+    t, i = net_batch.spikes()
+    net1 = i < N
+    SN_1t, SN_1i = t[net1]*second, i[net1]
+    SN_2t, SN_2i = t[~net1]*second, i[~net1] - N
+    cc = Spike_Stats().batch_cc(SN_1t,SN_2t,int(t1),int(t1+t2),config['bin_size'])
+    spikes = (SN_1t,SN_1i,SN_2t,SN_2i,SN_indvt)
+
+    if not record:
+        return cc, spikes, None
+    recorded = net_batch.states()
+    [SN_1v,SN_2v] = [recorded['v'][:,k:k+1]*volt for k in range(2)]
+    [SN_1ge,SN_2ge] = [recorded['ge'][:,k:k+1]*siemens for k in range(2)]
+    [SN_1gi,SN_2gi] = [recorded['gi'][:,k:k+1]*siemens for k in range(2)]
+    monitors = ((recorded['t']*second,SN_1v,SN_2v), (SN_1ge,SN_1gi,SN_2ge,SN_2gi))
+    return cc, spikes, monitors
+
+def profile_task(task,config,w_couple,p_couple,rand_seed,record,c_seed=0):
+    # Runs a point task under its own Profiler (also in worker processes), returns (result, records)
+    with Profiler() as prof:
+        with prof.point(w_couple=float(np.asarray(w_couple)), p_couple=float(p_couple), seed=rand_seed):
+            result = task(config,w_couple,p_couple,rand_seed,record,c_seed)
+    return result, prof.records
+
+class BatchSweep:
+    '''
+    Parallel version of the batch simulation program in N2_BatchSimModel.ipynb
+
+    Description:
+    Fans the (w_couple_vec x p_couple_vec) grid out over a process pool. Each grid point runs in its own
+    Brian2 scope with a deterministic seed derived from (seed, w_couple, p_couple), so results
+    do not depend on the number of workers or the order in which points finish.
+    With a ResultCache, finished points are saved as soon as they complete and reruns or extended grids
+    only simulate the points that are not cached yet.
+
+    Returns (from run):
+        coeff: (p_len x w_len) matrix of correlation co-efficients
+        datastream, voltage_monitor, conductance_monitor: lists in the same order as record_param,
+                 same tuple formats as in the notebook
+
+    Parameters:
+        config: dict describing the model, keys are named as in the notebook
+            topology: [(rows,cols,connect_W) of Network 1, Network 2, Network 3 (uncoupled control)]
+            PInput: [PInput of Network 1, Network 2, Network 3]
+            states: [dict of NeuronGroup values eg. {'tau_gi':..,'I':..} for Network 1, 2, 3]
+            N, excit, inhib, connect_type, neuron_diffeqns, integ_method, v_c, g_EE, g_II, bin_size
+            t1, t2: uncoupled and coupled phase durations (ms, no units)
+            namespace: dict of constants used in the equations (C_mem, E_ex, E_i, E_l, gL, tau_ge, we, wi, v_th, v_r)
+            codegen_target: optional Brian2 code generation target eg. 'numpy' or 'cython'
+        n_workers: number of worker processes, None uses all cores and 1 runs in this process
+        seed: base seed for the whole grid
+        cache: optional ResultCache
+        template: reuse one network_template per worker process instead of building the model for every point.
+                  The uncoupled control is then simulated once per worker with seed, not once per point
+        engine: 'brian2' or 'numpy' to simulate the points with the LIFEngine (run_lif_point), which needs no
+                code generation. The config may then give the time step as 'dt' (default: Brian2's defaultclock.dt)
+        profile: record every simulated point with a Profiler (phases, Brian2 per-object times, peak RSS),
+                 the records and their summary are in self.profiler (see Profiler.report and Profiler.save)
+    '''
+    def __init__(self,config,n_workers=None,seed=0,cache=None,template=False,engine='brian2',profile=False):
+        if engine not in ('brian2', 'numpy'):
+            raise ValueError("engine must be 'brian2' or 'numpy', not %r" % engine)
+        if template and engine != 'brian2':
+            raise ValueError('template mode needs the brian2 engine')
+        self.config = config
+        self.n_workers = n_workers
+        self.seed = seed
+        self.cache = cache
+        self.template = template
+        self.engine = engine
+        self.profiler = Profiler() if profile else None
+
+    def point_key(self,w_couple,p_couple):
+        # Cache key of a grid point. codegen_target does not change results so it is left out
+        model = dict((name, value) for name, value in self.config.items() if name != 'codegen_target')
+        if self.template:
+            model['template'] = True # Control is simulated once, so results differ from per point runs
+        if self.engine != 'brian2':
+            model['engine'] = self.engine
+        return self.cache.key(model, w_couple, p_couple, point_seed(self.seed,w_couple,p_couple),
+                              coupling_seed(self.seed,p_couple))
+
+    def record_index(self,record_param,w_couple,p_couple):
+        # Index into record_param of a (weight,probability) pair, None if this point is not recorded
+        for k in range(len(record_param)):
+            if np.isclose(np.asarray(record_param[k][0]), np.asarray(w_couple)) and np.isclose(record_param[k][1], p_couple):
+                return k
+        return None
+
+    def run(self,w_couple_vec,p_couple_vec,record_param=()):
+        w_len = len(w_couple_vec)
+        p_len = len(p_couple_vec)
+        coeff = np.zeros((p_len,w_len))
+        datastream = [None]*len(record_param)
+        voltage_monitor = [None]*len(record_param)
+        conductance_monitor = [None]*len(record_param)
+
+        def store(weight,prob,k,result):
+            cc, spikes, monitors = result
+            coeff[prob,weight] = cc
+            if k is not None:
+                datastream[k] = spikes
+                [voltage_monitor[k],conductance_monitor[k]] = monitors
+
+        points = []
+        for weight in range(w_len):
+            for prob in range(p_len):
+                k = self.record_index(record_param,w_couple_vec[weight],p_couple_vec[prob])
+                if self.cache is not None:
+                    cached = self.cache.get(self.point_key(w_couple_vec[weight],p_couple_vec[prob]))
+                    # Recorded points also need the state monitors, which are only cached for recorded runs
+                    if cached is not None and (k is None or 'SN_1v' in cached):
+                        store(weight,prob,k,point_from_arrays(cached))
+                        continue
+                points.append((weight, prob, k))
+
+        def finish(weight,prob,k,result):
+            if self.cache is not None:
+                self.cache.put(self.point_key(w_couple_vec[weight],p_couple_vec[prob]),point_to_arrays(*result))
+            store(weight,prob,k,result)
+
+        self.run_points(points,w_couple_vec,p_couple_vec,record_param,finish)
+        return coeff, datastream, voltage_monitor, conductance_monitor
+
+    def run_points(self,points,w_couple_vec,p_couple_vec,record_param,finish):
+        # Simulates the (weight index, probability index, record index) points, finish is called with each result
+        task = run_lif_point if self.engine == 'numpy' else run_point
+        initializer = None
+        initargs = ()
+        if self.template:
+            task = run_template_point
+            initializer = init_template
+            initargs = (self.config,p_couple_vec,len(record_param) > 0,self.seed)
+        if self.profiler is not None:
+            task = functools.partial(profile_task,task)
+            finish_point = finish
+            def finish(weight,prob,k,result):
+                result, records = result
+                self.profiler.add_records(records)
+                finish_point(weight,prob,k,result)
+        if self.n_workers == 1:
+            if points and initializer is not None:
+                initializer(*initargs)
+            for weight, prob, k in points:
+                finish(weight,prob,k,task(self.config,w_couple_vec[weight],p_couple_vec[prob],
+                                          point_seed(self.seed,w_couple_vec[weight],p_couple_vec[prob]),k is not None,
+                                          coupling_seed(self.seed,p_couple_vec[prob])))
+        else:
+            with ProcessPoolExecutor(max_workers=self.n_workers,initializer=initializer,initargs=initargs) as pool:
+                futures = {}
+                for weight, prob, k in points:
+                    future = pool.submit(task,self.config,w_couple_vec[weight],p_couple_vec[prob],
+                                         point_seed(self.seed,w_couple_vec[weight],p_couple_vec[prob]),k is not None,
+                                         coupling_seed(self.seed,p_couple_vec[prob]))
+                    futures[future] = (weight, prob, k)
+                for future in as_completed(futures):
+                    weight, prob, k = futures[future]
+                    finish(weight,prob,k,future.result())
+
+class ReplicaSweep(BatchSweep):
+    '''
+    BatchSweep that packs up to `replicas` grid points into one simulation (see run_replicas), so a grid of small
+    networks is simulated in a few large vectorized runs. Batches run in parallel over the process pool.
+    The grid is split into batches of consecutive points (in BatchSweep.run order) before the cache is looked up,
+    and a batch with any missing point is simulated as a whole, so a point always sees the same batch. Points of
+    a batch share one seed derived from all of their (w_couple,p_couple) values and the noise of one Brian2 run,
+    so cache keys cover the batch composition and a different grid or replica count never reuses a point.
+    The uncoupled control is simulated once per batch.
+
+    Returns (from run): same as BatchSweep.run, plus
+        states: (p_len x w_len) list of the [Network 1, Network 2] NeuronGroup values of every point
+
+    Parameters:
+        same as BatchSweep, plus
+        replicas: maximum number of grid points per simulation
+        replica_states: optional function (w_couple, p_couple, rng) --> [dict for Network 1, dict for Network 2]
+                        with the per neuron values (eg. I, tau_gi) of that point's replica, overriding config['states'].
+                        rng is a numpy Generator seeded from point_seed, so the values do not depend on the batching
+    '''
+    def __init__(self,config,n_workers=None,seed=0,cache=None,replicas=16,replica_states=None):
+        BatchSweep.__init__(self,config,n_workers,seed,cache)
+        self.replicas = replicas
+        self.replica_states = replica_states
+        self.batches = []
+        self.batch_of = {}
+
+    def point_states(self,w_couple,p_couple):
+        # Per replica overrides of config['states'] for Networks 1 and 2 of a point
+        if self.replica_states is None:
+            return [{}, {}]
+        rng = np.random.default_rng(point_seed(self.seed,w_couple,p_couple))
+        return self.replica_states(w_couple,p_couple,rng)
+
+    def point_key(self,w_couple,p_couple):
+        # Results depend on the batch a point was simulated in and on its position there
+        batch, position = self.batch_of[(float(np.asarray(w_couple)), float(p_couple))]
+        return self.cache.key(BatchSweep.point_key(self,w_couple,p_couple), 'replicas',
+                              [self.grid_values(point) for point in self.batches[batch]], position,
+                              self.point_states(w_couple,p_couple))
+
+    def grid_values(self,point):
+        weight, prob = point
+        return self.w_couple_vec[weight], self.p_couple_vec[prob]
+
+    def run(self,w_couple_vec,p_couple_vec,record_param=()):
+        self.w_couple_vec = w_couple_vec
+        self.p_couple_vec = p_couple_vec
+        grid = [(weight, prob) for weight in range(len(w_couple_vec)) for prob in range(len(p_couple_vec))]
+        self.batches = [grid[k0:k0+self.replicas] for k0 in range(0, len(grid), self.replicas)]
+        self.batch_of = {}
+        for batch, points in enumerate(self.batches):
+            for position, point in enumerate(points):
+                w_couple, p_couple = self.grid_values(point)
+                self.batch_of[(float(np.asarray(w_couple)), float(p_couple))] = (batch, position)
+        coeff, datastream, voltage_monitor, conductance_monitor = BatchSweep.run(self,w_couple_vec,p_couple_vec,
+                                                                                 record_param)
+        states = [[None]*len(w_couple_vec) for _ in range(len(p_couple_vec))]
+        for weight, prob in grid:
+            overrides = self.point_states(w_couple_vec[weight],p_couple_vec[prob])
+            states[prob][weight] = [dict(self.config['states'][net], **overrides[net]) for net in range(2)]
+        return coeff, datastream, voltage_monitor, conductance_monitor, states
+
+    def run_points(self,points,w_couple_vec,p_couple_vec,record_param,finish):
+        missing = dict(((weight, prob), k) for weight, prob, k in points)
+        batches = [batch for batch in self.batches if any(point in missing for point in batch)]
+        def arguments(batch):
+            w = [w_couple_vec[weight] for weight, _ in batch]
+            p = [p_couple_vec[prob] for _, prob in batch]
+            record = any(missing.get(point) is not None for point in batch)
+            replica_states = [self.point_states(w[r],p[r]) for r in range(len(batch))]
+            return (self.config, w, p, batch_seed(self.seed,w,p), record, replica_states,
+                    [coupling_seed(self.seed,q) for q in p])
+        def finish_batch(batch,results):
+            # Cached points of a partially cached batch are simulated again but keep their stored result
+            for point, result in zip(batch, results):
+                if point in missing:
+                    finish(point[0],point[1],missing[point],result)
+        if self.n_workers == 1:
+            for batch in batches:
+                finish_batch(batch,run_replicas(*arguments(batch)))
+        else:
+            with ProcessPoolExecutor(max_workers=self.n_workers) as pool:
+                futures = {pool.submit(run_replicas, *arguments(batch)): batch for batch in batches}
+                for future in as_completed(futures):
+                    finish_batch(futures[future],future.result())
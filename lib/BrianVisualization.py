@@ -1,7 +1,85 @@
-import matplotlib.pyplot as plt
-import matplotlib.patches as mpatches
+import numpy as np
+import scipy.sparse as sp
 from brian2 import *
 
+from .AdjacencyMatrix import geometric_indices
+from .OnlineSpikeStats import OnlineSpikeStats
+from .BatchFigures import draw_raster, draw_psth
+from .Profiler import profiled
+from .LazyImports import pyplot, close_figures
+
+def coupling_indices(N,excit,inhib,p_couple,connect_type,pattern='one_to_one',fan=None,seed=None):
+    '''
+    Source (Network 1) and target (Network 2) neuron indices of the coupling synapses as int32 arrays.
+    connect_type: 'ee', 'ii', 'ie' or 'ei', first letter is the source population and second the target,
+                  excitatory neurons are 0..excit-1 and inhibitory neurons N-inhib..N-1
+    pattern:
+        'one_to_one': neuron k of the first ceil(p_couple*excit) excitatory or last ceil(p_couple*inhib)
+                      inhibitory neurons drives neuron k of the target selection (the original coupling)
+        'probabilistic': every source/target pair is connected with probability p_couple
+        'fan_in': each of the selected target neurons receives fan synapses from random distinct sources
+        'fan_out': each of the selected source neurons makes fan synapses onto random distinct targets
+    seed: seed of the random patterns
+    '''
+    def population(kind,count):
+        if kind == 'e':
+            return np.arange(0, count, dtype=np.int32)
+        if kind == 'i':
+            return np.arange(N-count, N, dtype=np.int32)
+        raise ValueError('Unknown connect_type %r' % (connect_type,))
+
+    def selected(kind):
+        # First p_couple fraction of the excitatory or last p_couple fraction of the inhibitory neurons
+        return population(kind, int(np.ceil(p_couple*(excit if kind == 'e' else inhib))))
+
+    def distinct(n,pool):
+        # n rows of fan distinct random picks from range(pool)
+        if fan > pool:
+            raise ValueError('fan (%d) is larger than the population (%d)' % (fan, pool))
+        picks = rng.integers(0, pool, (n, fan))
+        while True: # redraw duplicates within a row until there are none
+            picks.sort(axis=1)
+            dup = picks[:, 1:] == picks[:, :-1]
+            if not dup.any():
+                return picks
+            picks[:, 1:][dup] = rng.integers(0, pool, int(dup.sum()))
+
+    src, tgt = connect_type[0], connect_type[1]
+    rng = np.random.default_rng(seed)
+    if pattern == 'one_to_one':
+        c_rows = selected(src)
+        c_cols = selected(tgt)
+        n = min(len(c_rows), len(c_cols))
+        return c_rows[:n], c_cols[:n]
+    pool_src = population(src, excit if src == 'e' else inhib)
+    pool_tgt = population(tgt, excit if tgt == 'e' else inhib)
+    if pattern == 'probabilistic':
+        k = geometric_indices(len(pool_src)*len(pool_tgt), p_couple, rng)
+        return pool_src[k // len(pool_tgt)], pool_tgt[k % len(pool_tgt)]
+    if pattern == 'fan_in':
+        targets = selected(tgt)
+        picks = distinct(len(targets), len(pool_src))
+        return pool_src[picks.ravel()], np.repeat(targets, fan)
+    if pattern == 'fan_out':
+        sources = selected(src)
+        picks = distinct(len(sources), len(pool_tgt))
+        return np.repeat(sources, fan), pool_tgt[picks.ravel()]
+    raise ValueError('Unknown coupling pattern %r' % (pattern,))
+
+def coupling_synapses(G1,G2,sname,c_rows,c_cols):
+    '''
+    Network 1 --> Network 2 coupling synapses connecting c_rows to c_cols, with weights left at 0.
+    Returns None if there are no pairs (eg. p_couple = 0): Brian2 cannot connect, set or run empty synapses, and
+    synapses that are never added to a network log unused_brian_object warnings
+    '''
+    if len(c_rows) == 0:
+        return None
+    S = Synapses(G1,G2, model ='''w : volt''', on_pre='''v_post += w
+                                                         ge+=we*(w>0*volt)
+                                                         gi+=wi*(w<0*volt)''',name=sname)#, delay=5*ms) # G1 drives G2
+    S.connect(i=c_rows, j=c_cols)
+    return S
+
 class BrianVisualization:
     '''
     Function 4: Visualization of Brian 
@@ -27,11 +105,11 @@ class BrianVisualization:
     
     '''
     def __init__(self):
-        plt.clf() # Clears any previous figures
-        plt.close() # Clears any figure windows
+        close_figures(clear=True) # Clears any previous figures and figure windows
         
         start_scope()
     
+    @profiled()
     def network_indv(self,rows,cols,connect_W,N,PInput,gname,sname,neuron_diffeqns,integ_method,v_c,g_EE,g_II):
         # rows and cols 1-D arrays of source and target neurons that are connected as defined in graph from networkx
         # connect_W: 1-D array of strength of connections corresponding to source and target neuron pairs 
@@ -83,7 +161,8 @@ class BrianVisualization:
                
         return G1,S1,P1
 
-    def network_coupling(self,N,excit,inhib,p_couple,w_couple,G1,G2,sname,connect_type):
+    @profiled()
+    def network_coupling(self,N,excit,inhib,p_couple,w_couple,G1,G2,sname,connect_type,pattern='one_to_one',fan=None,seed=None):
         '''
         Should see how coupling between different subpopulation has global effects (raster plot)
             - Could see difference if neurons have same firing rate (non-PoissonInput) vs. different firing rate (all-PoissonInput)
@@ -91,45 +170,17 @@ class BrianVisualization:
                 - See Monitoring Synaptic Variables from http://brian2.readthedocs.io/en/2.0.1/user/synapses.html
             = Can introduce multiple output synapses (multisynaptic_index from http://brian2.readthedocs.io/en/2.0.1/user/synapses.html)
                 - Or more simply "S.connect(i=numpy.arange(10), j=1)"
+        pattern, fan, seed: coupling pattern, see coupling_indices ('one_to_one' is the original ee/ii/ie/ei coupling)
+        Returns c_rows, c_cols as int32 arrays and coup_mat as an (N x N) scipy.sparse CSR matrix with 1s for connections
+        The synapses S3 are None if the pattern has no connections (see coupling_synapses)
         '''
-        S3 = Synapses(G1,G2, model ='''w : volt''', on_pre='''v_post += w
-                                                              ge+=we*(w>0*volt)
-                                                              gi+=wi*(w<0*volt)''',name=sname)#, delay=5*ms) # G1 drives G2
-        
-        ### Manually defining coupling ###
-        p_couple2 = p_couple*excit
-        i_couple2 = p_couple*inhib
-        
-        # If want 1:1 for only first p_couple% neurons (excitatory --> excitatory)
-        if connect_type == 'ee':
-            c_rows = list(arange(0,p_couple2,dtype=int)) # Source neurons
-            c_cols = list(arange(0,p_couple2,dtype=int)) # Target neurons
-        elif connect_type == 'ii':
-            c_rows = list(arange(N-i_couple2,N,dtype=int))
-            c_cols = list(arange(N-i_couple2,N,dtype=int))
-        elif connect_type == 'ie':
-            c_rows = list(arange(N-i_couple2,N,dtype=int))
-            c_cols = list(arange(0,p_couple2,dtype=int))
-        elif connect_type == 'ei':
-            c_rows = list(arange(0,p_couple2,dtype=int))
-            c_cols = list(arange(N-i_couple2,N,dtype=int))
-
-        S3.connect(i=c_rows, j=c_cols) # Manually defined coupling
-        S3.w = w_couple
-        ###################################
-        
-        ##### Probabilistic coupling #####
-        #S3.connect(p=0.05) # Probabilistic connection - Chance that G2 will connect with and spike from G1
-        #S3.w = 0.02
-        #S3.connect(p=p_couple)
-        ###################################
-                
-        # Coupling matrix
-        coup_mat = [[0 for x in range(N)] for y in range(N)]
+        c_rows, c_cols = coupling_indices(N,excit,inhib,p_couple,connect_type,pattern,fan,seed)
+        S3 = coupling_synapses(G1,G2,sname,c_rows,c_cols)
+        if S3 is not None:
+            S3.w = w_couple
 
-        for ii in range(len(c_rows)):
-            for jj in range(len(c_cols)):
-                coup_mat[ii][ii] = 1      # Matrix has 1s for connections and 0s for none
+        # Coupling matrix
+        coup_mat = sp.csr_matrix((np.ones(len(c_rows), dtype=np.int8), (c_rows, c_cols)), shape=(N, N))
 
         #statemon1 = StateMonitor(G1, 'v', record=0,name='statemon1_'+ G1.name) # Records just neuron 0 to save resources
         statemon1 = StateMonitor(G1,variables=('v','ge','gi'), record=0, dt=10*us,name='statemon_cG1')
@@ -140,6 +191,128 @@ class BrianVisualization:
         
         return statemon1,spikemon1,statemon2,spikemon2,c_rows,c_cols,coup_mat,S3
         
+    @profiled()
+    def network_template(self,config,p_couple_vec,record=False,c_seeds=None):
+        '''
+        Builds the coupled two network model of the batch program once, to be reused for every grid point.
+        The coupling synapses are the superset of the coupling patterns of all probabilities in p_couple_vec,
+        a grid point only changes their weights (synapses outside its pattern keep weight 0), so no objects are
+        created and no code is generated per point. Networks are stored in their initial state ('template').
+        config: BatchSweep config dict (optional 'pattern'/'fan' keys select the coupling pattern)
+        record: include the state monitors of network_coupling (switched off for points that are not recorded)
+        c_seeds: seed of the random coupling pattern of each p_couple_vec value, default 0
+        Returns template: dict of the networks and objects, used by template_control and template_point
+        '''
+        N = config['N']
+        groups = []
+        for net in range(3):
+            rows, cols, connect_W = config['topology'][net]
+            [G,S,P] = self.network_indv(rows,cols,connect_W,N,config['PInput'][net],'neurongroup_%d' %(net+1),
+                                        'synapsegroup_%d' %(net+1),config['neuron_diffeqns'],config['integ_method'],
+                                        config['v_c'],config['g_EE'],config['g_II'])
+            for name, value in config['states'][net].items(): # eg. tau_gi and I of each network
+                setattr(G, name, value)
+            groups.append((G,S,P))
+        [(G1,S1,P1),(G2,S2,P2),(G3,S3,P3)] = groups
+
+        # Superset of all candidate coupling synapses as source*N + target
+        pattern = config.get('pattern','one_to_one')
+        c_seeds = [0]*len(p_couple_vec) if c_seeds is None else c_seeds
+        keys = [coupling_indices(N,config['excit'],config['inhib'],p,config['connect_type'],pattern,config.get('fan'),
+                                 c_seed) for p, c_seed in zip(p_couple_vec, c_seeds)]
+        keys = np.unique(np.concatenate([r.astype(np.int64)*N + c for r, c in keys]))
+        # p_couple = 0 creates only the monitors, the synapses connect the superset
+        [statemon1,spikemon1,statemon2,spikemon2,_,_,_,_] = \
+            self.network_coupling(N,config['excit'],config['inhib'],0,0*volt,G1,G2,'Synapse_1c2',config['connect_type'])
+        S1c2 = coupling_synapses(G1,G2,'Synapse_1c2',(keys // N).astype(np.int32),(keys % N).astype(np.int32))
+        net_batch = Network(G1,P1,S1,G2,P2,S2,spikemon1,spikemon2)
+        if S1c2 is not None: # None when all p_couple are 0
+            S1c2.w = 0*volt
+            net_batch.add(S1c2)
+        if record:
+            net_batch.add(statemon1,statemon2)
+        spikemon_indv = SpikeMonitor(G3, variables='v',name='spikemon_indv')
+        net_indv = Network(G3,P3,S3,spikemon_indv)
+        net_batch.store('template')
+        net_indv.store('template')
+        return {'config': config, 'keys': keys, 'net_batch': net_batch, 'net_indv': net_indv, 'S1c2': S1c2,
+                'statemons': (statemon1,statemon2) if record else None, 'control': {}}
+
+    @profiled()
+    def template_control(self,template,duration,rand_seed=0):
+        '''
+        Spike times of the uncoupled control (Network 3) for duration (ms). It does not depend on the coupling,
+        so it is simulated once per template, duration and seed and cached
+        '''
+        key = (duration, rand_seed)
+        if key not in template['control']:
+            net_indv = template['net_indv']
+            net_indv.restore('template')
+            seed(rand_seed)
+            net_indv.run(duration*ms, namespace=template['config']['namespace'])
+            template['control'][key] = net_indv.get_states()['spikemon_indv']['t']
+        return template['control'][key]
+
+    @profiled()
+    def template_point(self,template,w_couple,p_couple,rand_seed,record=False,c_seed=0):
+        '''
+        One grid point on the template: restore --> uncoupled/coupled/uncoupled phases with the coupling weights of
+        (w_couple,p_couple). c_seed is the seed of its coupling pattern, as given to network_template
+        Returns the get_states() dict of the coupled networks
+        '''
+        config = template['config']
+        N = config['N']
+        net_batch = template['net_batch']
+        S1c2 = template['S1c2']
+        net_batch.restore('template')
+        seed(rand_seed)
+        c_rows, c_cols = coupling_indices(N,config['excit'],config['inhib'],p_couple,config['connect_type'],
+                                          config.get('pattern','one_to_one'),config.get('fan'),c_seed)
+        mask = np.isin(template['keys'], c_rows.astype(np.int64)*N + c_cols)
+        if template['statemons'] is not None:
+            for statemon in template['statemons']:
+                statemon.active = record
+        namespace = config['namespace']
+
+        # run 3 phase simulation (uncoupled --> coupled --> uncoupled)
+        coupled = S1c2 is not None
+        if coupled:
+            S1c2.w = 0*volt
+        net_batch.run(config['t1']*ms, namespace=namespace)
+        if coupled:
+            w = np.zeros(len(mask))
+            w[mask] = np.asarray(w_couple) * np.random.uniform(0,1,mask.sum())
+            S1c2.w = w*volt
+        net_batch.run(config['t2']*ms, namespace=namespace)
+        if coupled:
+            S1c2.w = 0*volt
+        net_batch.run(config['t1']*ms, namespace=namespace)
+        return net_batch.get_states()
+
+    def network_streaming(self,G1,G2,bin_size=1,history=1000,name='online_stats'):
+        '''
+        Streaming alternative to the SpikeMonitors of network_coupling for long runs.
+        A network_operation reads the spikes of G1 and G2 after every thresholding step and updates an
+        OnlineSpikeStats (spike counts, running ISI moments, binned population rates and the Network 1/Network 2
+        binned correlation), so memory does not grow with run time and results can be read mid-run.
+        Add the returned network operation to the Network instead of spikemon1/spikemon2, eg.
+            [online, stream_op] = BrianVis.network_streaming(G1,G2)
+            net_batch.add(stream_op)
+            ...
+            online.flush() # closes the last bin of the uncoupled phase
+            online.reset_correlation() # at the start of the coupled phase
+            net_batch.run(t2*ms)
+            online.flush()
+            cc = online.correlation()
+        '''
+        online = OnlineSpikeStats([len(G1), len(G2)], bin_size=bin_size, history=history, dt=float(G1.clock.dt/ms))
+
+        @network_operation(when='after_thresholds', name=name)
+        def stream_spikes(t):
+            online.update(float(t/ms), [G1.spikes, G2.spikes])
+
+        return online, stream_spikes
+
     def spike_time(self,spikemon):
         all_values = spikemon.all_values()
         spike_times = all_values['t'][0] # Spike times for just neuron 0
@@ -153,21 +326,29 @@ class BrianVisualization:
         ylabel('Voltage (V)')
         xlabel('Time (ms)')
         
-    def raster_plot(self,spikemon,spikemon_other):
-        #ion()
-        plot(spikemon.t/ms, spikemon.i, '.r')
-        plot(spikemon_other.t/ms, spikemon_other.i, '.k') # Plots overlay of each network
-        #plt.xlim([0,105])
-        #plt.xticks(np.arange(0, 1200, step=20))
-        xlabel('Time (ms)')
-        ylabel('Neuron index');
-        #plt.show(block=True)
-        
-    def spike_hist(self,run_time,all_spikes):
-        my_bins = arange(0,run_time+2,2)
-        plt.hist(all_spikes, bins=my_bins)
-        plt.xlim([0,105])
-        plt.yticks(np.arange(0, 30, step=2))
-        plt.margins()
-        xlabel('Time (ms)')
-        ylabel('Total number of spikes')
\ No newline at end of file
+    def raster_plot(self,spikemon,spikemon_other,ax=None,time_bins=1000):
+        '''
+        Raster plot of both networks (red and black overlay). Spikes are binned into a time x neuron image first,
+        so drawing takes the same time for any number of spikes
+        '''
+        if ax is None:
+            ax = pyplot().gca()
+        N = max(len(spikemon.source), len(spikemon_other.source))
+        tend = max(np.max(np.asarray(spikemon.t), initial=0), np.max(np.asarray(spikemon_other.t), initial=0))*1000 + 1 # ms
+        draw_raster(ax,spikemon.t,spikemon.i,N,0,tend,'r',time_bins)
+        draw_raster(ax,spikemon_other.t,spikemon_other.i,N,0,tend,'k',time_bins) # Plots overlay of each network
+        ax.set_xlabel('Time (ms)')
+        ax.set_ylabel('Neuron index')
+        return ax
+
+    def spike_hist(self,run_time,all_spikes,bin_size=2,ax=None):
+        '''
+        PSTH of all_spikes (ms) over the whole run, counts are binned before drawing
+        Returns edges (ms), counts
+        '''
+        if ax is None:
+            ax = pyplot().gca()
+        edges,counts = draw_psth(ax,all_spikes,0,run_time,bin_size)
+        ax.set_xlabel('Time (ms)')
+        ax.set_ylabel('Total number of spikes')
+        return edges,counts
@@ -0,0 +1,201 @@
+import numpy as np
+
+def ragged_range(starts,lengths):
+    # Concatenation of range(starts[k], starts[k]+lengths[k]) for all k
+    total = int(lengths.sum())
+    if total == 0:
+        return np.zeros(0, dtype=np.int64)
+    offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+    return offsets + np.arange(total)
+
+def si(value):
+    # Plain float64 value(s) in SI units, Brian2 quantities are converted and plain numbers taken as SI already
+    return np.asarray(value, dtype=np.float64)
+
+class LIFEngine:
+    '''
+    Clock-driven NumPy simulator of the conductance-based LIF population built by BrianVisualization.network_indv
+
+    Description:
+    Simulates without Brian2 objects, code generation or a compiler:
+        dv/dt = (1/C_mem)*(ge*(v - E_ex) + gi*(v - E_i) + gL*(v - E_l) + I) : volt (unless refractory)
+        dge/dt = -ge/tau_ge
+        dgi/dt = -gi/tau_gi
+    threshold v > v_th, reset v = v_r, refractory period (10 ms), synapses v_post += w, ge += we*(w > 0),
+    gi += wi*(w < 0) and PoissonInput(G, 'v', n_poisson, poisson_rate, weight=PInput). As in Brian2, writes to v
+    by synapses and Poisson input are dropped while a neuron is refractory.
+    Every time step follows Brian2's default schedule: record states --> integrate --> threshold -->
+    synapses and Poisson input --> reset. Spikes are propagated event driven: the CSR rows of the spiking neurons are
+    gathered and summed onto their targets (a sparse matrix-vector product with the spike vector), so a step costs
+    O(N + spikes x fan-out). All neurons, and optionally R replicas of the population (block diagonal synapses,
+    neuron r*N + k is neuron k of replica r), are updated by the same vectorized operations.
+    Noise comes from a numpy Generator, so runs are reproducible but not spike-for-spike identical to Brian2.
+
+    All values are plain numbers in SI units (volt, siemens, ampere, second) or Brian2 quantities.
+
+    Parameters:
+        N: number of neurons of one replica
+        rows, cols: source and target neuron of each synapse
+        w: synaptic weights (volt), ie. connect_W/100 as in network_indv
+        params: model constants C_mem, gL, E_ex, E_i, E_l, tau_ge, v_th, v_r, we, wi (eg. the notebook namespace),
+                I and tau_gi may be given here or in states
+        states: dict of per neuron values, eg. {'I': ..., 'tau_gi': ...}, of length N (shared by the replicas)
+                or R*N
+        PInput: Poisson input weight (volt), one value or one per neuron
+        v_c, g_EE, g_II: initial v, ge, gi
+        replicas: number of copies R of the population simulated together
+        dt: time step (s), Brian2's default clock is 0.1 ms
+        method: integration method of network_indv's integ_method. Brian2's 'heun' is the stochastic Heun scheme,
+                which reduces to 'euler' for these noise free equations, 'rk2' is the midpoint method
+        seed: seed of the Poisson input
+    '''
+    def __init__(self,N,rows,cols,w,params,states=None,PInput=0,v_c=-70e-3,g_EE=0,g_II=0,replicas=1,dt=1e-4,
+                 method='heun',refractory=10e-3,n_poisson=5,poisson_rate=100,seed=None):
+        if method not in ('euler', 'heun', 'rk2'):
+            raise ValueError("method must be 'euler', 'heun' or 'rk2', not %r" % method)
+        self.N = N
+        self.replicas = replicas
+        self.size = N*replicas
+        self.dt = float(si(dt))
+        self.method = method
+        self.refractory_steps = int(round(float(si(refractory)) / self.dt))
+        self.rng = np.random.default_rng(seed)
+
+        values = dict(params)
+        values.update(states or {})
+        for name in ['C_mem','gL','E_ex','E_i','E_l','tau_ge','v_th','v_r','we','wi']:
+            setattr(self, name, float(si(values[name])))
+        self.I = self.per_neuron(values['I'])
+        self.tau_gi = self.per_neuron(values['tau_gi'])
+        self.PInput = self.per_neuron(PInput)
+        self.p_poisson = float(si(poisson_rate))*self.dt
+        self.n_poisson = n_poisson
+        self.poisson = bool(np.any(self.PInput)) # PoissonInput off if PInput = 0
+
+        # Synapses of all replicas grouped by source neuron (CSR), order maps them back to the given order
+        rows = np.asarray(rows, dtype=np.int64)
+        cols = np.asarray(cols, dtype=np.int64)
+        shift = np.repeat(np.arange(replicas, dtype=np.int64)*N, len(rows))
+        rows = np.tile(rows, replicas) + shift
+        cols = np.tile(cols, replicas) + shift
+        self.order = np.argsort(rows, kind='stable')
+        self.targets = cols[self.order]
+        self.indptr = np.zeros(self.size+1, dtype=np.int64)
+        np.cumsum(np.bincount(rows, minlength=self.size), out=self.indptr[1:])
+        self.n_synapses = len(rows) // replicas
+        self.weights = np.zeros((replicas, self.n_synapses))
+        self.set_weights(w)
+
+        self.v = np.full(self.size, float(si(v_c)))
+        self.ge = np.full(self.size, float(si(g_EE)))
+        self.gi = np.full(self.size, float(si(g_II)))
+        self.lastspike = np.full(self.size, -2**40, dtype=np.int64) # step of the last spike
+        self.step = 0
+        self.spike_t = [] # Spike steps and neuron indices, one array per step with spikes
+        self.spike_i = []
+        self.record = None
+        self.record_every = 1
+        self.recorded = {'t': [], 'v': [], 'ge': [], 'gi': []}
+
+    def per_neuron(self,value):
+        # One value per neuron of all replicas from a single value, N values (shared by the replicas) or R*N values
+        x = si(value).ravel()
+        if x.size == self.N:
+            x = np.tile(x, self.replicas)
+        return np.broadcast_to(x, (self.size,)).copy()
+
+    def set_weights(self,w,start=0):
+        '''
+        Sets the weights (volt) of synapses start, start+1, ... in the order given to the constructor.
+        w: 1-D array shared by all replicas or (replicas x synapses) array with the values of each replica
+        '''
+        w = si(w)
+        self.weights[:, start:start + w.shape[-1]] = w
+        self.w = self.weights.ravel()[self.order]
+        self.excit = (self.w > 0).astype(np.float64)
+        self.inhib = (self.w < 0).astype(np.float64)
+
+    def monitor(self,record,dt=None):
+        '''
+        Records v, ge, gi of the neuron indices in record, like a StateMonitor with its own clock of dt (default:
+        the engine dt, which must be a multiple of it). As in Brian2, the first sample of a step is taken before
+        the update and the others see the state after it, eg. network_coupling records every 10 us
+        '''
+        self.record = np.atleast_1d(np.asarray(record, dtype=np.int64))
+        if dt is not None:
+            self.record_every = int(round(self.dt / float(si(dt))))
+            if self.record_every < 1 or not np.isclose(self.record_every*float(si(dt)), self.dt):
+                raise ValueError('Monitor dt must divide the engine dt (%g s)' % self.dt)
+
+    def derivative(self,v,ge,gi):
+        return (ge*(v - self.E_ex) + gi*(v - self.E_i) + self.gL*(v - self.E_l) + self.I) / self.C_mem
+
+    def run(self,duration):
+        # Advances the simulation by duration (s)
+        dt = self.dt
+        for _ in range(int(round(float(si(duration)) / dt))):
+            k = self.step
+            v, ge, gi = self.v, self.ge, self.gi
+            if self.record is not None:
+                self.recorded['t'].append(k*dt)
+                self.recorded['v'].append(v[self.record])
+                self.recorded['ge'].append(ge[self.record])
+                self.recorded['gi'].append(gi[self.record])
+
+            active = (k - self.lastspike) >= self.refractory_steps
+            k1 = self.derivative(v, ge, gi)
+            if self.method == 'rk2':
+                ge_half = ge - 0.5*dt*ge/self.tau_ge
+                gi_half = gi - 0.5*dt*gi/self.tau_gi
+                dv = dt*self.derivative(v + 0.5*dt*k1*active, ge_half, gi_half)
+                ge_new = ge - dt*ge_half/self.tau_ge
+                gi_new = gi - dt*gi_half/self.tau_gi
+            else:
+                dv = dt*k1
+                ge_new = ge - dt*ge/self.tau_ge
+                gi_new = gi - dt*gi/self.tau_gi
+            v = v + dv*active
+            ge = ge_new
+            gi = gi_new
+
+            spiking = np.flatnonzero(active & (v > self.v_th))
+            active[spiking] = False # v is (unless refractory), so synapses and Poisson input only write to active neurons
+            if len(spiking):
+                self.lastspike[spiking] = k
+                self.spike_t.append(np.full(len(spiking), k, dtype=np.int64))
+                self.spike_i.append(spiking)
+                syn = ragged_range(self.indptr[spiking], self.indptr[spiking+1] - self.indptr[spiking])
+                if len(syn):
+                    targets = self.targets[syn]
+                    v += np.bincount(targets, weights=self.w[syn], minlength=self.size)*active
+                    ge += self.we*np.bincount(targets, weights=self.excit[syn], minlength=self.size)
+                    gi += self.wi*np.bincount(targets, weights=self.inhib[syn], minlength=self.size)
+            if self.poisson:
+                v += self.rng.binomial(self.n_poisson, self.p_poisson, self.size)*self.PInput*active
+            v[spiking] = self.v_r
+            self.v, self.ge, self.gi = v, ge, gi
+            self.step = k + 1
+            if self.record is not None:
+                for j in range(1, self.record_every): # Samples of a finer monitor clock within this step
+                    self.recorded['t'].append(k*dt + j*dt/self.record_every)
+                    self.recorded['v'].append(v[self.record])
+                    self.recorded['ge'].append(ge[self.record])
+                    self.recorded['gi'].append(gi[self.record])
+
+    def spikes(self):
+        # Spike times (s) and neuron indices in time order, same as a SpikeMonitor's t and i
+        if not self.spike_t:
+            return np.zeros(0), np.zeros(0, dtype=np.int32)
+        return np.concatenate(self.spike_t)*self.dt, np.concatenate(self.spike_i).astype(np.int32)
+
+    def replica_spikes(self):
+        # spikes() of every replica with replica-local neuron indices
+        t, i = self.spikes()
+        replica = i // self.N
+        return [(t[replica == r], i[replica == r] - r*self.N) for r in range(self.replicas)]
+
+    def states(self):
+        # Recorded t (s) and (time x recorded neuron) arrays of v (volt), ge and gi (siemens)
+        if not self.recorded['t']:
+            return {'t': np.zeros(0), 'v': np.zeros((0, 0)), 'ge': np.zeros((0, 0)), 'gi': np.zeros((0, 0))}
+        return dict((name, np.array(values)) for name, values in self.recorded.items())
@@ -0,0 +1,41 @@
+import importlib
+import sys
+import time
+
+import_times = {} # Module name --> seconds its first import took, for the modules loaded through lazy
+
+def lazy(name):
+    '''
+    Imports a module on first use and returns it. Brian2, matplotlib and networkx take from a fraction of a second
+    to seconds to import (matplotlib.pyplot also picks a GUI backend), so the analysis and topology modules only
+    load them in the functions that need them. The time of each first import is kept in import_times
+    '''
+    module = sys.modules.get(name)
+    if module is None:
+        start = time.perf_counter()
+        module = importlib.import_module(name)
+        import_times[name] = time.perf_counter() - start
+    return module
+
+def loaded(name):
+    # The module if it has already been imported (by anyone), otherwise None
+    return sys.modules.get(name)
+
+def pyplot():
+    return lazy('matplotlib.pyplot')
+
+def close_figures(clear=False):
+    '''
+    plt.clf() (if clear) and plt.close() of the constructors, done only if pyplot is already loaded: without
+    pyplot there are no figures to clear, and headless workers never load a plotting backend
+    '''
+    plt = loaded('matplotlib.pyplot')
+    if plt is not None:
+        if clear:
+            plt.clf() # Clears any previous figures
+        plt.close() # Clears any figure windows
+
+def import_report():
+    # Lazily imported modules and their first import time, slowest first
+    lines = ['%-32s %8.3f s' % (name, t) for name, t in sorted(import_times.items(), key=lambda item: -item[1])]
+    return '\n'.join(lines)
@@ -0,0 +1,206 @@
+import functools
+import json
+import time
+import numpy as np
+
+try:
+    import resource
+except ImportError: # Windows
+    resource = None
+
+active = None # Profiler that is currently recording, None when profiling is off (the default)
+
+def peak_rss():
+    # Peak resident set size of this process in bytes, None where the resource module is not available
+    if resource is None:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024 # kB on Linux
+
+def span(name,**info):
+    # Timing span of the active Profiler, a no-op context when profiling is off
+    if active is None:
+        return Span(None, name, info)
+    return active.span(name,**info)
+
+def profiled(name=None):
+    '''
+    Decorator that records every call of the function as a span named name (default: Class.method).
+    Costs one global lookup per call while profiling is off
+    '''
+    def decorate(func):
+        label = name or func.__qualname__
+        @functools.wraps(func)
+        def wrapper(*args,**kwargs):
+            if active is None:
+                return func(*args,**kwargs)
+            with active.span(label):
+                return func(*args,**kwargs)
+        return wrapper
+    return decorate
+
+def run_network(net,duration,name,namespace=None):
+    '''
+    net.run(duration) inside a span. With a Profiler that has brian_profile set, the network is run with
+    profile=True and the per-object times are added to the current point record
+    '''
+    if active is None:
+        return net.run(duration, namespace=namespace)
+    with active.span(name):
+        net.run(duration, namespace=namespace, profile=active.brian_profile)
+    if active.brian_profile:
+        active.add_brian_profile(net)
+
+class Span:
+    # Context manager of one timing span, disabled when profiler is None
+    def __init__(self,profiler,name,info):
+        self.profiler = profiler
+        self.name = name
+        self.info = info
+
+    def __enter__(self):
+        if self.profiler is not None:
+            self.profiler.open(self)
+        return self
+
+    def __exit__(self,*exc):
+        if self.profiler is not None:
+            self.profiler.close(self)
+        return False
+
+class Profiler:
+    '''
+    Structured timing of simulations and analysis
+
+    Description:
+    While a Profiler is active (with Profiler() as prof: ...), the methods of AdjacencyMatrix, BrianVisualization
+    and Spike_Stats decorated with @profiled, and the phases of a sweep point (network construction, uncoupled
+    control, the uncoupled/coupled/uncoupled runs, get_states and analysis) are recorded as nested spans.
+    Every span keeps its path (eg. 'phase1/Spike_Stats.batch_cc'), start time and duration relative to the
+    record, and the peak RSS of the process when it ended.
+    Spans are grouped into records, one per sweep point (see point) or one 'session' record for spans outside a
+    point. With brian_profile, networks run through run_network use Brian2's profile=True, and the per-object
+    times (state updaters, thresholders, synapse pathways, monitors...) are added to the record.
+    Code generation happens in the first run of a network, so 'codegen' of a record estimates it as the wall time
+    of the profiled runs minus the Brian2 object times.
+    Profiling is off by default and then costs one global lookup per decorated call.
+
+    Returns (summary): dict of span name --> calls, total, mean and max duration (s) and share of the total record time
+
+    Parameters:
+        brian_profile: collect Brian2 per-object timings
+    '''
+    def __init__(self,brian_profile=True):
+        self.brian_profile = brian_profile
+        self.records = []
+        self.record = None
+        self.stack = []
+        self.previous = None
+
+    def __enter__(self):
+        global active
+        self.previous = active
+        active = self
+        return self
+
+    def __exit__(self,*exc):
+        global active
+        if self.record is not None and self.record['name'] == 'session':
+            self.finish_record()
+        active = self.previous
+        return False
+
+    def span(self,name,**info):
+        return Span(self, name, info)
+
+    def point(self,**labels):
+        # Span that starts a new record, eg. with prof.point(w_couple=w, p_couple=p): ...
+        return Span(self, 'point', labels)
+
+    def new_record(self,name,labels):
+        self.record = {'name': name, 'labels': labels, 'start_time': time.time(), 'spans': [], 'brian2': {},
+                       'brian2_run_time': 0.0}
+        self.origin = time.perf_counter()
+
+    def finish_record(self):
+        record = self.record
+        record['total'] = time.perf_counter() - self.origin
+        record['peak_rss'] = peak_rss()
+        if record['brian2']:
+            record['codegen'] = max(record['brian2_run_time'] - sum(record['brian2'].values()), 0.0)
+        self.records.append(record)
+        self.record = None
+
+    def open(self,s):
+        if s.name == 'point':
+            if self.record is not None and self.record['name'] == 'session':
+                self.finish_record()
+            self.new_record('point', s.info)
+            s.start = time.perf_counter()
+            return
+        if self.record is None:
+            self.new_record('session', {})
+        self.stack.append(s.name)
+        s.path = '/'.join(self.stack)
+        s.start = time.perf_counter()
+
+    def close(self,s):
+        end = time.perf_counter()
+        if s.name == 'point':
+            self.finish_record()
+            return
+        self.stack.pop()
+        entry = {'name': s.name, 'path': s.path, 'depth': len(self.stack), 'start': s.start - self.origin,
+                 'duration': end - s.start, 'peak_rss': peak_rss()}
+        entry.update(s.info)
+        self.record['spans'].append(entry)
+
+    def add_brian_profile(self,net):
+        # Adds the Brian2 per-object times of the last run of net to the current record
+        brian2 = self.record['brian2']
+        for name, t in net.profiling_info:
+            brian2[name] = brian2.get(name, 0.0) + float(t)
+        self.record['brian2_run_time'] += self.record['spans'][-1]['duration']
+
+    def add_records(self,records):
+        # Records collected in worker processes
+        self.records.extend(records)
+
+    def summary(self):
+        # Aggregate of all records, per span name and per Brian2 object
+        spans = {}
+        brian2 = {}
+        total = sum(record['total'] for record in self.records)
+        for record in self.records:
+            for entry in record['spans']:
+                spans.setdefault(entry['name'], []).append(entry['duration'])
+            for name, t in record['brian2'].items():
+                brian2[name] = brian2.get(name, 0.0) + t
+        def stats(durations):
+            d = np.asarray(durations)
+            return {'calls': len(d), 'total': float(d.sum()), 'mean': float(d.mean()), 'max': float(d.max()),
+                    'share': float(d.sum() / total) if total > 0 else 0.0}
+        return {'records': len(self.records), 'total': total,
+                'peak_rss': max([r['peak_rss'] or 0 for r in self.records] or [0]),
+                'codegen': sum(r.get('codegen', 0.0) for r in self.records),
+                'spans': dict((name, stats(d)) for name, d in spans.items()),
+                'brian2': dict(sorted(brian2.items(), key=lambda item: -item[1]))}
+
+    def report(self):
+        # Human readable summary table, spans sorted by total time
+        summary = self.summary()
+        lines = ['%d records, %.3f s total, peak RSS %.1f MB' % (summary['records'], summary['total'],
+                                                                 summary['peak_rss'] / 2.0**20)]
+        lines.append('%-40s %7s %10s %10s %7s' % ('span', 'calls', 'total (s)', 'mean (s)', 'share'))
+        for name, s in sorted(summary['spans'].items(), key=lambda item: -item[1]['total']):
+            lines.append('%-40s %7d %10.4f %10.4f %6.1f%%' % (name, s['calls'], s['total'], s['mean'], 100*s['share']))
+        if summary['brian2']:
+            lines.append('Brian2 objects (codegen estimate %.3f s)' % summary['codegen'])
+            for name, t in summary['brian2'].items():
+                lines.append('    %-36s %10.4f' % (name, t))
+        return '\n'.join(lines)
+
+    def save(self,filename):
+        # Per-point records and the summary as JSON
+        with open(filename, 'w') as f:
+            json.dump({'records': self.records, 'summary': self.summary()}, f, indent=1, default=str)
+        return filename
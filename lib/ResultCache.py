@@ -0,0 +1,121 @@
+import hashlib
+import os
+import tempfile
+import time
+import numpy as np
+
+def digest_update(h,obj):
+    '''
+    Feeds obj into the hash h in a stable way. Handles nested dicts/lists/tuples, strings, numbers,
+    numpy arrays and Brian2 quantities (hashed by their SI values and dimensions)
+    '''
+    if isinstance(obj, dict):
+        h.update(b'dict%d' % len(obj))
+        for key in sorted(obj, key=str):
+            digest_update(h, str(key))
+            digest_update(h, obj[key])
+    elif isinstance(obj, (list, tuple)):
+        h.update(b'list%d' % len(obj))
+        for item in obj:
+            digest_update(h, item)
+    elif isinstance(obj, str):
+        h.update(b'str' + obj.encode('utf-8'))
+    elif hasattr(obj, 'dim') or isinstance(obj, (np.ndarray, np.generic)):
+        # Brian2 quantities hash by their dimensions and SI values
+        h.update(b'array' + str(getattr(obj, 'dim', '')).encode('utf-8'))
+        values = np.ascontiguousarray(np.asarray(obj))
+        h.update(str(values.dtype).encode('utf-8') + str(values.shape).encode('utf-8'))
+        h.update(values.tobytes())
+    else:
+        h.update(repr(obj).encode('utf-8'))
+
+class ResultCache:
+    '''
+    On-disk cache of sweep point results
+
+    Description:
+    Every point is stored as one .npz file named by a content hash of everything the result depends on
+    (topology rows/cols/connect_W, neuron equations, integration method, phases, coupling parameters, seed).
+    Files are written to a temporary name and renamed when complete, so an interrupted run never leaves a
+    half-written point behind and a rerun only computes the points that are missing.
+    When the cache grows beyond max_bytes the least recently used points are deleted.
+
+    Parameters:
+        directory: folder to keep the cached points in (created if needed)
+        max_bytes: size limit of the cache
+    '''
+    def __init__(self,directory,max_bytes=2*1024**3):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def key(self,*parts):
+        # Hex digest identifying a point, parts can be any mix of dicts, arrays, quantities, strings and numbers
+        h = hashlib.sha256()
+        digest_update(h, parts)
+        return h.hexdigest()
+
+    def path(self,key):
+        return os.path.join(self.directory, key + '.npz')
+
+    def get(self,key):
+        '''
+        Returns a dict of arrays stored for key, or None if the point is not cached
+        '''
+        path = self.path(key)
+        try:
+            with np.load(path) as data:
+                point = {name: data[name] for name in data.files}
+            os.utime(path, None) # Marks point as recently used for LRU eviction
+        except (IOError, OSError, ValueError):
+            return None # Missing, evicted meanwhile, or unreadable
+        return point
+
+    def put(self,key,point):
+        '''
+        Stores a dict of arrays for key
+        '''
+        fd, tmp = tempfile.mkstemp(prefix='.tmp-', suffix='.npz', dir=self.directory)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.savez(f, **point)
+            os.replace(tmp, self.path(key)) # Atomic, readers see either nothing or the complete file
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+        self.evict()
+
+    def evict(self):
+        # Deletes least recently used points until the cache fits into max_bytes
+        entries = []
+        total = 0
+        now = time.time()
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            if name.startswith('.tmp-'):
+                if now - stat.st_mtime > 3600: # Left behind by a crashed writer
+                    os.remove(path)
+                continue
+            if name.endswith('.npz'):
+                entries.append((stat.st_mtime, stat.st_size, path))
+                total += stat.st_size
+        entries.sort()
+        for mtime, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+
+    def size(self):
+        # Total size in bytes of the cached points
+        return sum(os.path.getsize(os.path.join(self.directory, name))
+                   for name in os.listdir(self.directory) if name.endswith('.npz') and not name.startswith('.tmp-'))
@@ -0,0 +1,177 @@
+import numpy as np
+
+def to_ms(t):
+    '''
+    Returns spike times as a float64 array in ms (no units).
+    Brian2 quantities are converted from seconds, plain numbers are taken to be in ms already.
+    '''
+    if hasattr(t, 'dim'):
+        return np.asarray(t, dtype=np.float64)*1000.0
+    if isinstance(t, (list, tuple)) and len(t) > 0 and hasattr(t[0], 'dim'): # list of Brian2 quantities
+        return np.array([float(x) for x in t], dtype=np.float64)*1000.0
+    return np.asarray(t, dtype=np.float64)
+
+class SpikeTrainSet:
+    '''
+    Compact array-backed container for the spike trains of a neuron population
+
+    Description:
+    Spikes are kept CSR style: spike times grouped by neuron and sorted within each neuron, the neuron index
+    of every spike and an indptr array of offsets, so the spikes of neuron k are t[indptr[k]:indptr[k+1]].
+    This takes 12 bytes per spike (float64 time + int32 index) instead of one Quantity object per spike.
+    Build it once from a SpikeMonitor (from_monitor) or from get_states() arrays (from_states) and pass it
+    to Spike_Stats and SynchronicityCalculation.
+
+    Attributes:
+        t: spike times (ms, float64) grouped by neuron
+        i: neuron index of each spike (int32)
+        indptr: offsets of each neuron's spikes into t (length N+1)
+        N: number of neurons
+
+    Parameters:
+        t: spike times, Brian2 quantity or plain numbers in ms
+        i: neuron index of each spike
+        N: number of neurons, defaults to the largest index + 1
+    '''
+    def __init__(self,t,i,N=None,indptr=None):
+        t = to_ms(t)
+        i = np.asarray(i, dtype=np.int32)
+        if N is None:
+            N = int(i.max())+1 if len(i) else 0
+        if indptr is None:
+            # Sort by neuron and then by time. Monitors record in time order, so a stable sort by neuron is enough
+            if len(t) > 1 and np.any(np.diff(t) < 0):
+                order = np.lexsort((t, i))
+            else:
+                order = np.argsort(i, kind='stable')
+            t = t[order]
+            i = i[order]
+            indptr = np.zeros(N+1, dtype=np.int64)
+            np.cumsum(np.bincount(i, minlength=N), out=indptr[1:])
+        self.t = t
+        self.indptr = indptr
+        self.N = N
+        self._i = i # None for neuron slices, computed on first use
+        self._by_time = None # Time sorted (t, i) arrays, computed on first use
+
+    @classmethod
+    def from_monitor(cls,spikemon,N=None):
+        # From a Brian2 SpikeMonitor, N defaults to the size of the monitored group
+        if N is None:
+            N = len(spikemon.source)
+        return cls(spikemon.t, spikemon.i, N)
+
+    @classmethod
+    def from_states(cls,states,N=None):
+        # From the SpikeMonitor entry of Network.get_states() eg. states['spikemon_cG1']
+        return cls(states['t'], states['i'], N)
+
+    @classmethod
+    def from_dict(cls,trains,N=None):
+        # From a dict of neuron index --> spike times, eg. spikemon.spike_trains()
+        if N is None:
+            N = max(trains)+1 if len(trains) else 0
+        times = [to_ms(trains[k]) for k in sorted(trains)]
+        index = [np.full(len(times[n]), k, dtype=np.int32) for n, k in enumerate(sorted(trains))]
+        if not times:
+            return cls(np.zeros(0), np.zeros(0, dtype=np.int32), N)
+        return cls(np.concatenate(times), np.concatenate(index), N)
+
+    @classmethod
+    def convert(cls,spikes,N=None):
+        '''
+        Returns spikes as a SpikeTrainSet. Accepts a SpikeTrainSet, a SpikeMonitor, a get_states() entry
+        or a dict of neuron index --> spike times
+        '''
+        if isinstance(spikes, cls):
+            return spikes
+        if isinstance(spikes, dict):
+            if 't' in spikes and 'i' in spikes:
+                return cls.from_states(spikes, N)
+            return cls.from_dict(spikes, N)
+        if hasattr(spikes, 'spike_trains'):
+            return cls.from_monitor(spikes, N)
+        raise TypeError('Cannot convert %s to a SpikeTrainSet' % type(spikes).__name__)
+
+    @property
+    def i(self):
+        if self._i is None:
+            self._i = np.repeat(np.arange(self.N, dtype=np.int32), np.diff(self.indptr)).astype(np.int32)
+        return self._i
+
+    def __len__(self):
+        return len(self.t) # Total number of spikes
+
+    @property
+    def nbytes(self):
+        return self.t.nbytes + self.i.nbytes + self.indptr.nbytes
+
+    def counts(self):
+        # Number of spikes of each neuron
+        return np.diff(self.indptr)
+
+    def train(self,k):
+        # Spike times (ms) of neuron k, a view into t
+        return self.t[self.indptr[k]:self.indptr[k+1]]
+
+    def neurons(self,start,stop):
+        '''
+        Spike trains of neurons start..stop-1 as a new SpikeTrainSet (re-indexed from 0) that shares memory
+        with this one
+        '''
+        lo = self.indptr[start]
+        hi = self.indptr[stop]
+        subset = SpikeTrainSet.__new__(SpikeTrainSet)
+        subset.t = self.t[lo:hi]
+        subset.indptr = self.indptr[start:stop+1] - lo
+        subset.N = stop - start
+        subset._i = None
+        subset._by_time = None
+        return subset
+
+    def by_time(self):
+        # Spike times and neuron indices of the whole population sorted by time (ties ordered by neuron)
+        if self._by_time is None:
+            order = np.argsort(self.t, kind='stable')
+            self._by_time = (self.t[order], self.i[order])
+        return self._by_time
+
+    def time_slice(self,tstart,tend):
+        '''
+        Spike times and neuron indices of the population in the interval (tstart,tend] (ms), sorted by time.
+        Views into the time sorted arrays, found by binary search
+        '''
+        t_sorted, i_sorted = self.by_time()
+        lo = np.searchsorted(t_sorted, tstart, side='right')
+        hi = np.searchsorted(t_sorted, tend, side='right')
+        return t_sorted[lo:hi], i_sorted[lo:hi]
+
+    def window_bounds(self,windows):
+        '''
+        Offsets into t of each neuron's spikes inside each time window (tstart,tend] (ms).
+        All windows are found in one pass over the spikes, spikes of neuron k in window w are
+        t[lo[w,k]:hi[w,k]].
+        Returns lo, hi: (number of windows x N) arrays
+        '''
+        windows = np.asarray(windows, dtype=np.float64).reshape(-1, 2)
+        edges = np.unique(windows)
+        n_bins = len(edges) + 1
+        # Bin j holds the spikes with edges[j-1] < t <= edges[j]
+        bins = np.searchsorted(edges, self.t, side='left')
+        counts = np.bincount(self.i.astype(np.int64)*n_bins + bins, minlength=self.N*n_bins).reshape(self.N, n_bins)
+        below = np.cumsum(counts, axis=1) # below[k,j]: number of spikes of neuron k with t <= edges[j]
+        start = self.indptr[:-1]
+        lo = start + below[:, np.searchsorted(edges, windows[:, 0])].T
+        hi = start + below[:, np.searchsorted(edges, windows[:, 1])].T
+        return lo, hi
+
+    def window(self,tstart,tend):
+        # Spikes within (tstart,tend] (ms) as a new SpikeTrainSet with the same neurons
+        keep = (self.t > tstart) & (self.t <= tend)
+        indptr = np.zeros(self.N+1, dtype=np.int64)
+        np.cumsum(np.bincount(self.i[keep], minlength=self.N), out=indptr[1:])
+        return SpikeTrainSet(self.t[keep], self.i[keep], self.N, indptr=indptr)
+
+    def to_dict(self):
+        # Dict of neuron index --> spike times (ms), same layout as spikemon.spike_trains()
+        return {k: self.train(k) for k in range(self.N)}
@@ -1,5 +1,8 @@
 import numpy as np
-from brian2 import *
+import scipy.sparse as sp
+
+from .SpikeTrainSet import SpikeTrainSet, to_ms
+from .Profiler import profiled
 
 class Spike_Stats:
     '''
@@ -7,91 +10,156 @@ class Spike_Stats:
                  like mean, variance, co-efficent of variation. Spike trains can also be compared to produce correlation
                  coefficients
 
+                 Spikes can be passed as a SpikeTrainSet, a SpikeMonitor or a dict of neuron index --> spike times.
+                 Spike times and ISIs are returned in ms (no units)
+
     Parameters:
     '''
 
     def __init__(self):  # Not sure what to do here yet
         pass
 
+    @profiled()
     def ISI_stats(self, spikemon):
-        neuron_spikes = spikemon.spike_trains()  # Dictionary with dict keys as neuron indices and
-        # dict values as an array of spike times for that neuron
-        firing_n = list(set(sort(spikemon.i)))  # To create a set or list of all unique neuron indices that have spiked
+        spikes = SpikeTrainSet.convert(spikemon)  # Spike times of each neuron are spikes.train(neuron)
+        firing_n = np.flatnonzero(spikes.counts())  # Unique neuron indices that have spiked
         # in order to calculate statistical parameters for each unique neuron
+        [mean, var, cv, _, _] = self.ISI_arrays(spikes)  # Statistics of all neurons computed at once
 
         ISI = {}  # Create an empty dictionary to contain dict keys as neuron indices and dict values as an array of ISIs
         ISI_mean = {}  # Dict for ISI mean of each neuron index
         ISI_var = {}  # Dict for ISI variance of each neuron index
         ISI_cv = {}  # Dict for ISI co-efficient of variation (CV) for each neuron index
 
-        # Calculate variance and mean of each ISI (Inter-Spike-Interval)
         for i in firing_n:
-            # Calculate ISI array by subtracting spike times of each neuron to get an array of spike intervals
-            ISI[i] = np.diff(neuron_spikes[i])
-            # Calculate mean of ISI
-            ISI_mean[i] = np.mean(ISI[i])
-            # Calculate variance of ISI
-            ISI_var[i] = np.var(ISI[i])
-            # Calculate co-efficient of variation(CV) of ISI
-            ISI_cv[i] = np.sqrt(ISI_var[i]) / ISI_mean[i]
+            # ISI array by subtracting spike times of each neuron to get an array of spike intervals
+            ISI[i] = np.diff(spikes.train(i))
+            ISI_mean[i] = mean[i]
+            ISI_var[i] = var[i]
+            ISI_cv[i] = cv[i]
         return ISI, ISI_mean, ISI_var, ISI_cv
 
-    def spk_extract(self, spikemon, tstart, tend):
+    @profiled()
+    def ISI_arrays(self, spikemon, N=None):
+        '''
+        ISI statistics of every neuron computed at once from the spikes sorted by (neuron, time).
+        ISIs of all neurons come from one np.diff, intervals that cross from one neuron to the next are dropped, and
+        the per-neuron sums are segment reductions with np.bincount.
+        Returns arrays of length N (NaN for neurons with fewer than 2 spikes, or 3 spikes for LV):
+        - ISI_mean, ISI_var, ISI_cv: mean, variance and co-efficient of variation of the ISIs (ms)
+        - ISI_lv: local variation, mean of 3*((I[k]-I[k+1])/(I[k]+I[k+1]))**2 over consecutive ISIs
+        - ISI_count: number of ISIs of each neuron
+        '''
+        spikes = SpikeTrainSet.convert(spikemon, N)
+        N = spikes.N
+        t = spikes.t
+        i = spikes.i
+        same = i[1:] == i[:-1]  # Intervals between two spikes of the same neuron
+        ISI = np.diff(t)[same]
+        owner = i[1:][same]
+        ISI_count = np.bincount(owner, minlength=N)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            ISI_mean = np.bincount(owner, weights=ISI, minlength=N) / ISI_count
+            ISI_var = np.bincount(owner, weights=(ISI - ISI_mean[owner]) ** 2, minlength=N) / ISI_count
+            ISI_cv = np.sqrt(ISI_var) / ISI_mean
+
+            # Local variation from pairs of consecutive ISIs of the same neuron
+            pair = owner[1:] == owner[:-1]
+            I1 = ISI[:-1][pair]
+            I2 = ISI[1:][pair]
+            pair_owner = owner[1:][pair]
+            ISI_lv = 3 * np.bincount(pair_owner, weights=((I1 - I2) / (I1 + I2)) ** 2, minlength=N) \
+                     / np.bincount(pair_owner, minlength=N)
+        return ISI_mean, ISI_var, ISI_cv, ISI_lv, ISI_count
+
+    def ISI_arrays_windows(self, spikemon, windows, N=None):
+        '''
+        ISI_arrays for each time interval (tstart,tend] in windows, eg. the three phases of the batch simulation.
+        Only ISIs between spikes inside the same interval are counted.
+        Returns a list with one (ISI_mean, ISI_var, ISI_cv, ISI_lv, ISI_count) tuple per interval
+        '''
+        spikes = SpikeTrainSet.convert(spikemon, N)
+        return [self.ISI_arrays(spikes.window(tstart, tend)) for tstart, tend in windows]
+
+    def spk_extract(self, spikemon, tstart, tend, N=None):
         '''
         This function splits up spike monitors into desired time intervals and outputs:
         - a dictionary of neuron indices with their corresponding spike times within the specified interval
         - an array of spike times generated within the time interval for the entire network irrespective of neuron indices
         - an array of neuron indices corresponding to spike times
+        N is the number of neurons, taken from the spike monitor if not given
+        '''
+        return self.spk_extract_windows(spikemon, [(tstart, tend)], N)[0]
+
+    @profiled()
+    def spk_extract_windows(self, spikemon, windows, N=None):
+        '''
+        Same as spk_extract for several time intervals at once, eg. the three phases
+        [(0,phase1),(phase1,phase2),(phase2,phase3)]. Spikes are found by binary search on the sorted spike times,
+        and the spike trains in SN_mon are views into the SpikeTrainSet arrays (no copies).
+        Returns a list with one (SN_mon, SN_t, SN_i) tuple per interval
+        '''
+        spikes = SpikeTrainSet.convert(spikemon, N)
+        lo, hi = spikes.window_bounds(windows)
+
+        extracted = []
+        for w, (tstart, tend) in enumerate(windows):
+            SN_mon = {neuron: spikes.t[lo[w, neuron]:hi[w, neuron]] for neuron in range(spikes.N)}
+            # Spike times sorted irrespective of neuron and the corresponding neuron indices. Identical to any
+            # spikemonitor.i output
+            SN_t, SN_i = spikes.time_slice(tstart, tend)
+            extracted.append((SN_mon, SN_t, SN_i))
+        return extracted
+
+    def bin_positions(self, sp_time, tstart, tend, bin_size):
+        '''
+        Bin index of every spike time (ms) within (tstart,tend] and the number of bins.
+        Returns bin_pos, t_size, in_window (boolean mask of the spikes that were kept)
+        '''
+        sp_time = to_ms(sp_time)
+        t_size = len(np.arange(tstart, tend, bin_size)) + 1
+        in_window = (sp_time > tstart) & (sp_time <= tend)  # removes spike times above or below the interval
+        bin_pos = ((sp_time[in_window] / bin_size) - tstart / bin_size).astype(np.int64)
+        return bin_pos, t_size, in_window
+
+    @profiled()
+    def spikebin_matrix(self, spikes, tstart, tend, bin_size, N=None, dtype=np.float32):
+        '''
+        Binning engine used by spikebin_indv, spikebin_total and spike_cc.
+        Counts the spikes of every neuron in bins of bin_size (ms) over (tstart,tend] without any Python loops.
+        - counts: scipy.sparse CSR matrix (neurons x bins) of spike counts, stored as dtype (eg. np.float32 or
+                  np.int16), only bins with spikes take up memory
+        - rate: number of spikes of the whole network in each bin normalized by bin size (same as spikebin_total)
+        - bins: [t0,t0 + bin_size), [t1,t1 + bin_size).....
         '''
-        SN_t = []
-        SN_i = []
-        SN_mon = {}
-
-        for neuron in arange(n):
-            temp_time = [j for j in spikemon.spike_trains()[neuron] if j > tstart * ms and j <= tend * ms]
-            SN_t.extend(temp_time[:])
-            SN_mon[neuron] = temp_time
-        SN_t = sort(SN_t)
-
-        # This for loop is to return an array of neuron indices corresponding to spikes times. Identical to any
-        # spikemonitor.i output
-        for t in SN_t:
-            for index in SN_mon.keys():  # iterating through neuron indices' spike trains
-                for spike in SN_mon[index]:  # iterating through values in spike trains
-                    if t == spike / ms:
-                        SN_i.append(index)
-                        flag = 1
-                        break
-                    else:
-                        flag = 0
-            if flag == 1:
-                break
-
-        return SN_mon, SN_t, SN_i
-
-    def spikebin_indv(self, sp_time, tstart, tend):
+        spikes = SpikeTrainSet.convert(spikes, N)
+        bin_pos, t_size, in_window = self.bin_positions(spikes.t, tstart, tend, bin_size)
+        neuron = spikes.i[in_window]
+        counts = sp.csr_matrix((np.ones(len(bin_pos), dtype=dtype), (neuron, bin_pos)), shape=(spikes.N, t_size))
+        counts.sum_duplicates()  # Several spikes in the same bin add up
+        rate = np.bincount(bin_pos, minlength=t_size) / float(bin_size)
+        return counts, rate
+
+    @profiled()
+    def spikebin_indv(self, sp_time, tstart, tend, bin_size=1):
         '''
         This function takes in an array of spike times and counts the number of spikes occuring within a time interval
         defined by bin_size.
         It outputs an array of 0's and 1's to indicate whether or not a spike occured within an interval:
         - for each neuron (sp_ibinary)
         - bins: [t0,t0 + bin_size), [t1,t1 + bin_size).....
+        Use spikebin_matrix directly to keep the result sparse
         '''
-
+        spikes = SpikeTrainSet.convert(sp_time)
+        counts, _ = self.spikebin_matrix(spikes, tstart, tend, bin_size, dtype=np.int16)
         sp_ibinary = {}
-        t_interval = arange(tstart, tend, bin_size)  # bin_size is a global parameter defined in the input section
-        t_size = len(t_interval) + 1
-
-        for k in range(0, len(sp_time)):
-            temp = np.array([0] * t_size)  # Converting to an array so that simulatenous assignment
-            # to multiple indices is possible
-            if sp_time[k] != []:
-                bin_pos = ((sp_time[k] / (bin_size * ms)) - tstart / bin_size).astype(int)
-                temp[bin_pos] = 1
-                sp_ibinary[k] = temp
+        for k in np.flatnonzero(spikes.counts()):  # Only neurons that have spiked
+            sp_ibinary[k] = (counts[k].toarray().ravel() > 0).astype(int)
 
         return sp_ibinary
 
+    @profiled()
     def spikebin_total(self, sp_time, tstart, tend,bin_size):
         '''
         This function takes in an array of spike times and counts the number of spikes occuring within a time interval
@@ -100,36 +168,99 @@ class Spike_Stats:
         - for the overall network (sp_tbinary)
         - bins: [t0,t0 + bin_size), [t1,t1 + bin_size).....
         '''
-        # Calculating binary spike train for the overall network
-        t_interval = np.arange(tstart, tend, bin_size)  # bin_size is a global parameter defined in the input section
-        t_size = len(t_interval) + 1
-
-        sp_tbinary = np.array([0] * t_size)  # empty array to store the binary spike train
-        sp_time_phase = [j for j in sp_time if
-                         j > tstart * ms and j <= tend * ms]  # removes spike times above or below the
-        # desired time interval
-        for k in sp_time_phase:
-            bin_pos = int((k / (bin_size * ms)) - tstart / bin_size)
-            sp_tbinary[bin_pos] = 1 + sp_tbinary[bin_pos]
-
-        sp_tbinary = sp_tbinary / bin_size
+        if isinstance(sp_time, SpikeTrainSet):
+            sp_time = sp_time.t  # All spike times of the network irrespective of neuron indices
+        bin_pos, t_size, _ = self.bin_positions(sp_time, tstart, tend, bin_size)
+        sp_tbinary = np.bincount(bin_pos, minlength=t_size) / float(bin_size)
 
         return sp_tbinary
 
-    def spike_cc(self, set1, set2):
+    @profiled()
+    def spike_cc(self, set1, set2, N=None):
         '''
         This function calculates Pearson product-moment correlation co-efficients of individual neuron spike trains
+        set1 and set2 are either dicts of binary spike trains from spikebin_indv or (neurons x bins) matrices from
+        spikebin_matrix (sparse or dense). All pairs are computed at once with one matrix product.
+        For dicts the result is an N x N matrix (N defaults to the largest neuron index + 1) with 0 for neurons
+        that did not spike. For matrices the result is (neurons in set1 x neurons in set2).
+        Pairs where a spike train has zero variance are NaN, except two trains with a spike in every bin (all 1s),
+        which are 1 like in spike_tcc
         '''
         # set1 = SN1_2_binary
         # set2 = SN2_2_binary
-        final_CC = np.zeros((n, n))
-
-        for i in set1:
-            val1 = set1[i]
-            for j in set2:
-                val2 = set2[j]
-                corr = np.corrcoef(val1, val2)
-                final_CC[i][j] = corr[0, 1]
+        if not isinstance(set1, dict):
+            return self.spike_cc_blocked(set1, set2, block_size=None, dtype=np.float64)
+
+        keys1 = sorted(set1)
+        keys2 = sorted(set2)
+        if N is None:
+            N = max(keys1 + keys2) + 1 if (keys1 or keys2) else 0
+        final_CC = np.zeros((N, N))
+        if keys1 and keys2:
+            corr = self.spike_cc_blocked(np.array([set1[i] for i in keys1]), np.array([set2[j] for j in keys2]),
+                                         block_size=None, dtype=np.float64)
+            final_CC[np.ix_(keys1, keys2)] = corr
+        return final_CC
+
+    def cc_moments(self, X):
+        '''
+        Row statistics of a (neurons x bins) spike matrix used by spike_cc_blocked.
+        Returns X as float64 CSR, row means, row standard deviations and the value of constant rows (NaN otherwise)
+        '''
+        X = sp.csr_matrix(X, dtype=np.float64)
+        T = X.shape[1]
+        mean = np.asarray(X.sum(axis=1)).ravel() / T
+        var = np.asarray(X.multiply(X).sum(axis=1)).ravel() / T - mean ** 2
+        std = np.sqrt(np.maximum(var, 0))
+        low = X.min(axis=1).toarray().ravel()
+        high = X.max(axis=1).toarray().ravel()
+        constant = np.where(low == high, low, np.nan)  # Zero variance trains, eg. [1,1,1] or no spikes
+        return X, mean, std, constant
+
+    @profiled()
+    def spike_cc_blocked(self, set1, set2, block_size=4096, out=None, dtype=np.float32):
+        '''
+        Pearson correlation co-efficients of every spike train (row) in set1 with every spike train in set2.
+        The matrices are centred and normalised through their row means and standard deviations, so each block of
+        the result is one sparse matrix product.
+        block_size: number of rows and columns computed at a time, None for a single block
+        out: None to return the result in memory, or a file name to stream the blocks into a .npy memory-mapped
+             file (eg. for a 50k x 50k correlation that does not fit in RAM)
+        '''
+        X, mean1, std1, const1 = self.cc_moments(set1)
+        Y, mean2, std2, const2 = self.cc_moments(set2)
+        if X.shape[1] != Y.shape[1]:
+            raise ValueError('Spike trains have %d and %d bins' % (X.shape[1], Y.shape[1]))
+        T = X.shape[1]
+        n1 = X.shape[0]
+        n2 = Y.shape[0]
+        if out is None:
+            final_CC = np.empty((n1, n2), dtype=dtype)
+        else:
+            final_CC = np.lib.format.open_memmap(out, mode='w+', dtype=dtype, shape=(n1, n2))
+        if block_size is None:
+            block_size = max(n1, n2, 1)
+
+        Yt = Y.T.tocsc()
+        for i0 in range(0, n1, block_size):
+            i1 = min(i0 + block_size, n1)
+            X_blk = X[i0:i1]
+            for j0 in range(0, n2, block_size):
+                j1 = min(j0 + block_size, n2)
+                cross = (X_blk @ Yt[:, j0:j1]).toarray() / T
+                cov = cross - np.outer(mean1[i0:i1], mean2[j0:j1])
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    corr = cov / np.outer(std1[i0:i1], std2[j0:j1])
+                # Pearson co-efficient is undefined for constant spike trains (variance is zero). Only two trains
+                # that spike in every bin count as identical (1, the spike_tcc rule); silent or other constant trains
+                # are NaN, so neurons that never fire do not look perfectly synchronised
+                zero_var = np.isfinite(const1[i0:i1])[:, None] | np.isfinite(const2[j0:j1])[None, :]
+                all_ones = (const1[i0:i1] == 1)[:, None] & (const2[j0:j1] == 1)[None, :]
+                corr[zero_var] = np.nan
+                corr[all_ones] = 1
+                final_CC[i0:i1, j0:j1] = corr
+        if out is not None:
+            final_CC.flush()
         return final_CC
 
     def spike_tcc(self, set1, set2):
@@ -144,12 +275,13 @@ class Spike_Stats:
         if all(set1 == [1] * len(set1)) and all(
                 set2 == [1] * len(set2)):  # Check if all elements in both binary spike trains
             # are all 1s (if so Pearson method is undefined)
-            corr = array([[1, 1], [1, 1]])  # set a value of 1 to show both spike trains are the same
+            corr = np.array([[1, 1], [1, 1]])  # set a value of 1 to show both spike trains are the same
         else:
             corr = np.corrcoef(set1, set2)
 
         return corr[0, 1]
 
+    @profiled()
     def batch_cc(self, SN1_2t, SN2_2t,phase1,phase2,bin_size):
         SN1_2_tbin = self.spikebin_total(SN1_2t, phase1, phase2,bin_size)
         SN2_2_tbin = self.spikebin_total(SN2_2t, phase1, phase2,bin_size)
@@ -157,7 +289,7 @@ class Spike_Stats:
         return SN_2_tCC
 
     # older func. Made newer one to cut down on unnecessary data
-    def batch_cc_old(self, SN1, SN2):
+    def batch_cc_old(self, SN1, SN2, phase1, phase2, phase3, bin_size=1):
         '''
         This function can be called each time a simulation is run to generate statistics of spike trains for each network
         and for each neuron within the networks
@@ -177,14 +309,9 @@ class Spike_Stats:
 
         # [SN0_all,SN0_allt] = stats.spk_extract(SN0,0,run_time)
 
-        [SN1_1, SN1_1t, _] = self.spk_extract(SN1, 0, phase1)
-        [SN2_1, SN2_1t, _] = self.spk_extract(SN2, 0, phase1)
-
-        [SN1_2, SN1_2t, _] = self.spk_extract(SN1, phase1, phase2)
-        [SN2_2, SN2_2t, _] = self.spk_extract(SN2, phase1, phase2)
-
-        [SN1_3, SN1_3t, _] = self.spk_extract(SN1, phase2, phase3)
-        [SN2_3, SN2_3t, _] = self.spk_extract(SN2, phase2, phase3)
+        phases = [(0, phase1), (phase1, phase2), (phase2, phase3)]
+        [(SN1_1, SN1_1t, _), (SN1_2, SN1_2t, _), (SN1_3, SN1_3t, _)] = self.spk_extract_windows(SN1, phases)
+        [(SN2_1, SN2_1t, _), (SN2_2, SN2_2t, _), (SN2_3, SN2_3t, _)] = self.spk_extract_windows(SN2, phases)
 
         ##############################################################################
         # Create binary spike trains, put into stats class
@@ -204,10 +331,10 @@ class Spike_Stats:
         #         SN_1_tCC = self.spike_tcc(SN1_1_tbin,SN2_1_tbin)
 
         # Coupled networks
-        SN1_2_ibin = self.spikebin_indv(SN1_2, phase1, phase2)
-        SN2_2_ibin = self.spikebin_indv(SN2_2, phase1, phase2)
-        SN1_2_tbin = self.spikebin_total(SN1_1t, phase1, phase2)
-        SN2_2_tbin = self.spikebin_total(SN2_1t, phase1, phase2)
+        SN1_2_ibin = self.spikebin_indv(SN1_2, phase1, phase2, bin_size)
+        SN2_2_ibin = self.spikebin_indv(SN2_2, phase1, phase2, bin_size)
+        SN1_2_tbin = self.spikebin_total(SN1_2t, phase1, phase2, bin_size)
+        SN2_2_tbin = self.spikebin_total(SN2_2t, phase1, phase2, bin_size)
         SN_2_iCC = self.spike_cc(SN1_2_ibin, SN2_2_ibin)
         SN_2_tCC = self.spike_tcc(SN1_2_tbin, SN2_2_tbin)
 
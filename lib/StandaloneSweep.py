@@ -0,0 +1,201 @@
+import os
+import shutil
+import multiprocessing
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from brian2 import *
+
+from .BrianVisualization import BrianVisualization, coupling_indices
+from .BatchSweep import BatchSweep, point_seed, coupling_seed
+from .Spike_Stats import Spike_Stats
+
+built = None # StandaloneSweep whose compiled binary the forked workers execute
+
+def standalone_point(index,w_couple,p_couple,t1,t2,record):
+    # Worker task, runs in a process forked after the build so it shares the compiled project
+    return built.run_point(index,w_couple,p_couple,t1,t2,record)
+
+class StandaloneSweep(BatchSweep):
+    '''
+    Compile-once, run-many version of BatchSweep on Brian2's C++ standalone device
+
+    Description:
+    Networks 1, 2, 3 (network_indv) and the Network 1 --> Network 2 coupling synapses (network_coupling) are built
+    into one C++ standalone project and compiled once. Everything that changes between grid points is a run-time
+    argument of the binary:
+    - coupling weights: one weight per synapse of the superset of the coupling patterns of all p_couple_vec values,
+      synapses that are not part of a point's pattern get weight 0 (this is the probability mask)
+    - phase windows: the coupling synapses only act while t_on <= t < t_off (t_on = t1, t_off = t1 + t2)
+    Each grid point is one execution of the binary with its own results directory, in parallel over a process pool
+    forked after the build, so per-point cost is close to the pure simulation time.
+
+    Differences to BatchSweep:
+    - the simulated duration is fixed at build time (2*t1 + t2 of the config), points with shorter phases are
+      cut to their own duration
+    - the noise (PoissonInput, initial draws) is seeded once at build time, so all points see the same noise
+      (common random numbers), coupling weights are drawn per point from point_seed
+    Needs a working C++ compiler (eg. g++).
+
+    Returns (from run): same as BatchSweep.run
+
+    Parameters:
+        config: same dict as BatchSweep, plus optional 'pattern' and 'fan' (see coupling_indices)
+        directory: folder of the standalone project
+        n_workers: number of worker processes, None uses all cores and 1 runs in this process
+        seed: seed of the build and base seed of the per point weights
+    '''
+    def __init__(self,config,directory='standalone_sweep',n_workers=None,seed=0):
+        BatchSweep.__init__(self,config,n_workers,seed)
+        self.directory = os.path.abspath(directory)
+        self.objects = None
+
+    def build(self,p_couple_vec,record=True):
+        '''
+        Builds and compiles the model with coupling synapses for every p_couple in p_couple_vec.
+        record: compile the state monitors (needed for points in record_param)
+        '''
+        config = self.config
+        N = config['N']
+        set_device('cpp_standalone', directory=self.directory, build_on_run=False)
+        device.reinit()
+        device.activate(directory=self.directory, build_on_run=False)
+        seed(self.seed)
+
+        BrianVis = BrianVisualization()
+        groups = []
+        for net in range(3):
+            rows, cols, connect_W = config['topology'][net]
+            [G,S,P] = BrianVis.network_indv(rows,cols,connect_W,N,config['PInput'][net],'neurongroup_%d' %(net+1),
+                                            'synapsegroup_%d' %(net+1),config['neuron_diffeqns'],config['integ_method'],
+                                            config['v_c'],config['g_EE'],config['g_II'])
+            for name, value in config['states'][net].items():
+                setattr(G, name, value)
+            groups.append((G,S,P))
+        [(G1,S1,P1),(G2,S2,P2),(G3,S3,P3)] = groups
+
+        # Superset of the coupling synapses of all probabilities
+        keys = [self.coupling_keys(p) for p in p_couple_vec]
+        self.keys = np.unique(np.concatenate(keys)) if keys else np.zeros(0, dtype=np.int64)
+        coupled = len(self.keys) > 0 # No coupling synapses when all p_couple are 0 (see coupling_synapses)
+        S1c2 = None
+        if coupled:
+            S1c2 = Synapses(G1,G2, model='''w : volt
+                                            t_on : second (shared)
+                                            t_off : second (shared)''',
+                            on_pre='''v_post += w*int(t >= t_on and t < t_off)
+                                      ge+=we*(w>0*volt)*int(t >= t_on and t < t_off)
+                                      gi+=wi*(w<0*volt)*int(t >= t_on and t < t_off)''',name='Synapse_1c2')
+            S1c2.connect(i=(self.keys // N).astype(np.int32), j=(self.keys % N).astype(np.int32))
+            S1c2.w = 0*volt
+            S1c2.t_on = config['t1']*ms
+            S1c2.t_off = (config['t1']+config['t2'])*ms
+
+        spikemon_cG1 = SpikeMonitor(G1, name='spikemon_cG1')
+        spikemon_cG2 = SpikeMonitor(G2, name='spikemon_cG2')
+        spikemon_indv = SpikeMonitor(G3, name='spikemon_indv')
+        objects = [G1,P1,S1,G2,P2,S2,G3,P3,S3,spikemon_cG1,spikemon_cG2,spikemon_indv]
+        if coupled:
+            objects.append(S1c2)
+        statemons = None
+        if record:
+            statemons = (StateMonitor(G1,variables=('v','ge','gi'), record=0, dt=10*us,name='statemon_cG1'),
+                         StateMonitor(G2,variables=('v','ge','gi'), record=0, dt=10*us,name='statemon_cG2'))
+            objects += list(statemons)
+        net = Network(*objects)
+        self.duration = 2*config['t1'] + config['t2'] # ms
+        net.run(self.duration*ms, namespace=config['namespace'])
+        device.build(directory=self.directory, compile=True, run=False, with_output=False)
+        self.objects = dict(S1c2=S1c2, spikemon_cG1=spikemon_cG1, spikemon_cG2=spikemon_cG2,
+                            spikemon_indv=spikemon_indv, statemons=statemons)
+
+    def coupling_keys(self,p_couple):
+        # Coupling synapses of one probability as source*N + target
+        config = self.config
+        c_rows, c_cols = coupling_indices(config['N'],config['excit'],config['inhib'],p_couple,config['connect_type'],
+                                          config.get('pattern','one_to_one'),config.get('fan'),
+                                          coupling_seed(self.seed,p_couple))
+        return c_rows.astype(np.int64)*config['N'] + c_cols
+
+    def run_point(self,index,w_couple,p_couple,t1,t2,record):
+        '''
+        Executes the compiled binary for one grid point, returns (cc, spikes, monitors) like BatchSweep.run_point
+        '''
+        objects = self.objects
+        S1c2 = objects['S1c2']
+        mask = np.isin(self.keys, self.coupling_keys(p_couple))
+        rng = np.random.default_rng(point_seed(self.seed,w_couple,p_couple))
+        w = np.zeros(len(self.keys))
+        w[mask] = np.asarray(w_couple) * rng.uniform(0,1,mask.sum()) # SI units (volt)
+        run_args = {S1c2.w: w*volt, S1c2.t_on: t1*ms, S1c2.t_off: (t1+t2)*ms} if S1c2 is not None else {}
+        results = 'results_%d' % index
+        device.run(self.directory, results_directory=results, with_output=False, run_args=run_args)
+        try:
+            end = (2*t1+t2)*ms
+            def spikes(monitor):
+                keep = monitor.t < end
+                return monitor.t[keep], monitor.i[keep]
+            SN_1t, SN_1i = spikes(objects['spikemon_cG1'])
+            SN_2t, SN_2i = spikes(objects['spikemon_cG2'])
+            SN_indvt = spikes(objects['spikemon_indv'])[0]
+            cc = Spike_Stats().batch_cc(SN_1t,SN_2t,int(t1),int(t1+t2),self.config['bin_size'])
+            monitors = None
+            if record:
+                statemon1, statemon2 = objects['statemons']
+                keep = statemon1.t < end
+                # (time x neuron) arrays, same layout as the get_states() entries in BatchSweep
+                monitors = ((statemon1.t[keep], statemon1.v[:,keep].T, statemon2.v[:,keep].T),
+                            (statemon1.ge[:,keep].T, statemon1.gi[:,keep].T, statemon2.ge[:,keep].T, statemon2.gi[:,keep].T))
+        finally:
+            shutil.rmtree(os.path.join(self.directory, results), ignore_errors=True)
+        return cc, (SN_1t,SN_1i,SN_2t,SN_2i,SN_indvt), monitors
+
+    def run(self,w_couple_vec,p_couple_vec,record_param=(),t1=None,t2=None):
+        '''
+        Runs the (w_couple_vec x p_couple_vec) grid, building the project first if needed.
+        t1, t2: optional phase durations (ms) for this grid, 2*t1 + t2 must not exceed the built duration
+        '''
+        global built
+        t1 = self.config['t1'] if t1 is None else t1
+        t2 = self.config['t2'] if t2 is None else t2
+        if self.objects is None or not np.all([np.all(np.isin(self.coupling_keys(p), self.keys)) for p in p_couple_vec]):
+            self.build(p_couple_vec, record=len(record_param) > 0)
+        if 2*t1 + t2 > self.duration:
+            raise ValueError('Phases of %g ms are longer than the built duration of %g ms' % (2*t1+t2, self.duration))
+        if len(record_param) > 0 and self.objects['statemons'] is None:
+            raise ValueError('Project was built without state monitors, rebuild with record=True')
+
+        w_len = len(w_couple_vec)
+        p_len = len(p_couple_vec)
+        coeff = np.zeros((p_len,w_len))
+        datastream = [None]*len(record_param)
+        voltage_monitor = [None]*len(record_param)
+        conductance_monitor = [None]*len(record_param)
+        points = [(weight, prob, self.record_index(record_param,w_couple_vec[weight],p_couple_vec[prob]))
+                  for weight in range(w_len) for prob in range(p_len)]
+
+        def store(weight,prob,k,result):
+            cc, spikes, monitors = result
+            coeff[prob,weight] = cc
+            if k is not None:
+                datastream[k] = spikes
+                [voltage_monitor[k],conductance_monitor[k]] = monitors
+
+        if self.n_workers == 1:
+            for index, (weight, prob, k) in enumerate(points):
+                store(weight,prob,k,self.run_point(index,w_couple_vec[weight],p_couple_vec[prob],t1,t2,k is not None))
+        else:
+            built = self
+            # Workers are forked so they inherit the built device and its objects
+            with ProcessPoolExecutor(max_workers=self.n_workers, mp_context=multiprocessing.get_context('fork')) as pool:
+                futures = [(weight, prob, k, pool.submit(standalone_point,index,w_couple_vec[weight],p_couple_vec[prob],
+                                                          t1,t2,k is not None))
+                           for index, (weight, prob, k) in enumerate(points)]
+                for weight, prob, k, future in futures:
+                    store(weight,prob,k,future.result())
+        return coeff, datastream, voltage_monitor, conductance_monitor
+
+    def close(self):
+        # Switches Brian2 back to runtime mode
+        device.reinit()
+        set_device('runtime')
+        self.objects = None
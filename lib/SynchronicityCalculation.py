@@ -1,11 +1,212 @@
-import matplotlib.pyplot as plt
-import matplotlib.patches as mpatches
 import numpy as np
+import scipy.sparse as sp
+from scipy.fft import rfft, irfft, next_fast_len
+
+from .Spike_Stats import Spike_Stats
+from .SpikeTrainSet import SpikeTrainSet, to_ms
+from .SynchronyMatrix import SynchronyMatrix
+from .LazyImports import pyplot, close_figures
+
+def pooled_ms(spikes):
+    # All spike times (ms) of a SpikeTrainSet, SpikeMonitor or array of spike times, sorted irrespective of neuron
+    if isinstance(spikes, SpikeTrainSet):
+        return spikes.by_time()[0]
+    if hasattr(spikes, 't'):
+        return to_ms(spikes.t)
+    return to_ms(spikes)
+
+class SpikeTrain:
+    '''
+    Spike times (ms) of one train observed over the interval [t_start,t_end], same role as pyspike.SpikeTrain.
+    Spikes are sorted, outside the edges are dropped and simultaneous spikes (eg. of different neurons
+    in a pooled population train) are counted once
+    '''
+    def __init__(self,spikes,edges):
+        self.t_start = float(edges[0])
+        self.t_end = float(edges[1])
+        spikes = np.unique(to_ms(spikes))
+        self.spikes = spikes[(spikes >= self.t_start) & (spikes <= self.t_end)]
+
+def train_knots(st):
+    # Spike times with the auxiliary spikes before and after the train used by the ISI- and SPIKE-distance
+    # (same edge correction as PySpike). Empty trains only get the edges
+    s = st.spikes
+    if len(s) == 0:
+        return np.array([st.t_start, st.t_end])
+    if len(s) == 1:
+        return np.concatenate(([st.t_start], s, [st.t_end]))
+    return np.concatenate(([min(st.t_start, 2*s[0]-s[1])], s, [max(st.t_end, 2*s[-1]-s[-2])]))
+
+def nearest_distance(x,ref):
+    # Distance from every x to the closest value of the sorted array ref
+    k = np.searchsorted(ref, x)
+    before = np.abs(x - ref[np.maximum(k-1, 0)])
+    after = np.abs(ref[np.minimum(k, len(ref)-1)] - x)
+    return np.minimum(before, after)
+
+def segments(st1,st2):
+    # Edges of the intervals between consecutive events of both trains
+    events = np.concatenate((st1.spikes, st2.spikes, [st1.t_start, st1.t_end]))
+    return np.unique(events)
+
+def isi_profile(st1,st2):
+    '''
+    ISI-distance profile, piecewise constant |isi_1-isi_2|/max(isi_1,isi_2) over the intervals between events.
+    Returns x (interval edges, length M+1) and y (value of each interval, length M)
+    '''
+    x = segments(st1, st2)
+    mid = 0.5*(x[:-1] + x[1:])
+    isi = []
+    for st in (st1, st2):
+        K = train_knots(st)
+        p = np.clip(np.searchsorted(K, mid, side='right') - 1, 0, len(K)-2)
+        isi.append(K[p+1] - K[p])
+    y = np.abs(isi[0] - isi[1]) / np.maximum(isi[0], isi[1])
+    return x, y
+
+def isi_distance(st1,st2):
+    # Time average of the ISI-distance profile, 0 for identical trains
+    x, y = isi_profile(st1, st2)
+    return np.sum(y*np.diff(x)) / (x[-1] - x[0])
+
+def spike_profile(st1,st2):
+    '''
+    SPIKE-distance profile, piecewise linear between events.
+    Returns x (interval edges, length M+1), y1 and y2 (value at the start and at the end of each interval)
+    '''
+    x = segments(st1, st2)
+    left = x[:-1]
+    right = x[1:]
+    mid = 0.5*(left + right)
+    knots = [train_knots(st1), train_knots(st2)]
+    isi = []
+    s_left = []
+    s_right = []
+    for n, st in enumerate((st1, st2)):
+        K = knots[n]
+        D = nearest_distance(K, knots[1-n]) # Distance of each spike to the closest spike of the other train
+        if len(st.spikes):
+            D[0] = D[1] # Auxiliary spikes take the distance of the first and last real spike
+            D[-1] = D[-2]
+        p = np.clip(np.searchsorted(K, mid, side='right') - 1, 0, len(K)-2)
+        f = p + 1
+        interval = K[f] - K[p]
+        isi.append(interval)
+        # Distance to the closest spike interpolated between the previous and following spike
+        s_left.append((D[p]*(K[f]-left) + D[f]*(left-K[p])) / interval)
+        s_right.append((D[p]*(K[f]-right) + D[f]*(right-K[p])) / interval)
+    mean_isi = 0.5*(isi[0] + isi[1])
+    y1 = 0.5*(s_left[0]*isi[1] + s_left[1]*isi[0]) / mean_isi**2
+    y2 = 0.5*(s_right[0]*isi[1] + s_right[1]*isi[0]) / mean_isi**2
+    return x, y1, y2
+
+def spike_distance(st1,st2):
+    # Time average of the SPIKE-distance profile, 0 for identical trains
+    x, y1, y2 = spike_profile(st1, st2)
+    return np.sum(0.5*(y1 + y2)*np.diff(x)) / (x[-1] - x[0])
+
+def coincidences(s1,s2,max_tau):
+    # 1 for every spike of s1 that has a coincident spike in s2 within the adaptive window tau, else 0
+    if len(s1) == 0 or len(s2) == 0:
+        return np.zeros(len(s1))
+    def half_isi(s):
+        # Half of the shorter interval to the neighbouring spikes, max_tau at the ends of the train
+        gaps = np.diff(s)
+        return 0.5*np.minimum(np.concatenate(([max_tau], gaps)), np.concatenate((gaps, [max_tau])))
+    h1 = half_isi(s1)
+    h2 = half_isi(s2)
+    after = np.searchsorted(s2, s1, side='left') # First spike of s2 at or after each spike of s1
+    coincident = np.zeros(len(s1), dtype=bool)
+    for j in (after-1, after): # Closest spike before and after
+        valid = (j >= 0) & (j < len(s2))
+        j = np.clip(j, 0, len(s2)-1)
+        tau = np.minimum(h1, h2[j])
+        coincident |= valid & (np.abs(s1 - s2[j]) < tau)
+    return coincident.astype(np.float64)
+
+def spike_sync_profile(st1,st2,max_tau=None):
+    '''
+    SPIKE-synchronization profile, value 1 at every spike with a coincident spike in the other train, else 0.
+    max_tau: optional upper limit of the coincidence window (ms)
+    Returns x (spike times of both trains, sorted) and y (coincidence of each spike)
+    '''
+    limit = st1.t_end - st1.t_start
+    if max_tau is not None:
+        limit = min(limit, 2*max_tau)
+    c1 = coincidences(st1.spikes, st2.spikes, limit)
+    c2 = coincidences(st2.spikes, st1.spikes, limit)
+    x = np.concatenate((st1.spikes, st2.spikes))
+    order = np.argsort(x, kind='stable')
+    return x[order], np.concatenate((c1, c2))[order]
+
+def spike_sync(st1,st2,max_tau=None):
+    # Fraction of coincident spikes, 1 if both trains are empty
+    x, y = spike_sync_profile(st1, st2, max_tau)
+    if len(x) == 0:
+        return 1.0
+    return np.mean(y)
+
+def cross_correlogram(x,y,max_lag,pairs=None,block_size=256):
+    '''
+    Cross-correlograms of binned spike trains through FFT convolution, counts[lag] = sum_t x[t]*y[t+lag] for
+    lags -max_lag..max_lag (bins), so a peak at a positive lag means y tends to fire after x.
+    x, y: binned spike trains, 1-D arrays or (trains x bins) arrays/sparse matrices eg. from Spike_Stats.spikebin_matrix
+    pairs: None to correlate row k of x with row k of y, or (rows of x, rows of y) index arrays for many pairs
+    block_size: number of pairs transformed at a time
+    Returns lags (bins), counts and baseline ((pairs x lags) arrays, 1-D for 1-D inputs).
+    baseline is the shuffle predictor: the expected counts when y is circularly shifted by a random amount,
+    mean(y) times the sum of x over the bins that overlap at each lag. counts - baseline is the shuffle corrected
+    correlogram.
+    '''
+    single = not sp.issparse(x) and np.ndim(x) == 1
+    if single:
+        x = np.asarray(x)[None, :]
+        y = np.asarray(y)[None, :]
+    if x.shape[-1] != y.shape[-1]:
+        raise ValueError('Spike trains have %d and %d bins' % (x.shape[-1], y.shape[-1]))
+    T = x.shape[-1]
+    max_lag = int(min(max_lag, T-1))
+    n = next_fast_len(T + max_lag) # Zero padding so lags up to max_lag do not wrap around
+    lags = np.arange(-max_lag, max_lag+1)
+    if pairs is None:
+        rows_x = rows_y = np.arange(x.shape[0])
+    else:
+        rows_x = np.asarray(pairs[0])
+        rows_y = np.asarray(pairs[1])
+    counts = np.empty((len(rows_x), len(lags)))
+    baseline = np.empty((len(rows_x), len(lags)))
+
+    def dense(m,rows):
+        block = m[rows]
+        return block.toarray().astype(np.float64) if sp.issparse(block) else np.asarray(block, dtype=np.float64)
+
+    for k0 in range(0, len(rows_x), block_size):
+        k1 = min(k0 + block_size, len(rows_x))
+        # Every train of the block is transformed once, even if it takes part in several pairs
+        ux, ix = np.unique(rows_x[k0:k1], return_inverse=True)
+        uy, iy = np.unique(rows_y[k0:k1], return_inverse=True)
+        xb = dense(x, ux)
+        yb = dense(y, uy)
+        r = irfft(np.conj(rfft(xb, n))[ix] * rfft(yb, n)[iy], n)
+        counts[k0:k1] = np.concatenate((r[:, n-max_lag:], r[:, :max_lag+1]), axis=1)
+        # Sum of x over the overlapping bins t (0 <= t < T and 0 <= t+lag < T) from the cumulative sum of x
+        cs = np.zeros((len(ux), T+1))
+        np.cumsum(xb, axis=1, out=cs[:, 1:])
+        overlap = np.where(lags >= 0, cs[:, T-np.maximum(lags, 0)], cs[:, [T]] - cs[:, np.maximum(-lags, 0)])
+        baseline[k0:k1] = overlap[ix] * (yb.mean(axis=1)[iy])[:, None]
+    if single:
+        return lags, counts[0], baseline[0]
+    return lags, counts, baseline
 
 class SynchronicityCalculation:
     '''
     To calculate different metrics of synchronicity
     
+    Description:
+    SPIKE-synchronization, ISI-distance and SPIKE-distance are computed natively with NumPy (same definitions
+    and edge corrections as PySpike), in O(S log S) time for S spikes, and return the profiles as arrays
+    instead of plotting them. Use plot_profile to plot a profile.
+
     For more information:
         See Synch Metrics bookmarks folder
         http://wwwold.fi.isc.cnr.it/users/thomas.kreuz/sourcecode.html
@@ -15,91 +216,103 @@ class SynchronicityCalculation:
         http://www.scholarpedia.org/article/Measures_of_spike_train_synchrony#ISI-distance
     '''
     def __init__(self):
-        plt.clf() # Clears any previous figures
-        plt.close() # Clears any figure windows
+        close_figures(clear=True) # Clears any previous figures and figure windows
 
     def Initialize(self,spikemon1,spikemon2,tstart,tend):
-        try:
-            st1 = spk.SpikeTrain(spikemon1.t/ms, edges=[tstart,tend])
-            st2 = spk.SpikeTrain(spikemon2.t/ms, edges=[tstart,tend])
-            
-        except AttributeError:
-        # In case parameters passed to function are a dictionary of spike times in 'ms' and not spike monitors 
-        # The AttributeError 'dict' object has no attribute 't' results and is caught here
-            st1 = spk.SpikeTrain(spikemon1/ms, edges=[tstart,tend])
-            st2 = spk.SpikeTrain(spikemon2/ms, edges=[tstart,tend])
+        # Parameters can be spike monitors, SpikeTrainSets or arrays of spike times, tstart and tend in ms
+        st1 = SpikeTrain(pooled_ms(spikemon1), edges=[tstart,tend])
+        st2 = SpikeTrain(pooled_ms(spikemon2), edges=[tstart,tend])
 
         return st1,st2
 
-    def SPIKEsynch(self,st1,st2):
+    def SPIKEsynch(self,st1,st2,max_tau=None):
         '''
         SPIKE-synchronization measures similarity where 0 means absence of synchrony and bounded to 1
         indicating absolute synchrony
+        Returns the SPIKE-synchronization and its profile x (spike times), y (coincidences)
         '''
-        spike_sync = spk.spike_sync([st1,st2])
-        #print spike_sync
-
-        # Plotting SPIKE-synchronicity
-        spike_profile = spk.spike_sync_profile([st1,st2])
-        x,y = spike_profile.get_plottable_data()
-        plot(x,y,'-k')
-        ylabel('SPIKE-sync')
+        x,y = spike_sync_profile(st1,st2,max_tau)
+        spike_synch = np.mean(y) if len(x) else 1.0
+        return spike_synch,x,y
 
     def ISIdistance(self,st1,st2):
         '''
         ISI-distance quantifies dissimilarity based on differences of interspike intervals from two
-        different spike trains. Becomes 0 for identical spike trains and approaches -1 and 1 when
-        first or second spike train is faster than the other, respectively.
+        different spike trains. Becomes 0 for identical spike trains and is bounded by 1.
+        Returns the ISI-distance and its profile x (interval edges), y (value of each interval)
         '''
-        isi_prof = spk.isi_profile(st1,st2)
-        isi_dist = isi_prof.avrg()
-        #print isi_dist # Outputs nan if spike train has same time values
-
-        # Plotting ISI profile
-        x,y = isi_prof.get_plottable_data()
-        plot(x,y,'-k')
-        ylabel('ISI')
+        x,y = isi_profile(st1,st2)
+        isi_dist = np.sum(y*np.diff(x)) / (x[-1] - x[0])
+        return isi_dist,x,y
 
     def SPIKEdistance(self,st1,st2):
         '''
         SPIKE-distance quantifies dissimilarity based on exact spike timings. In other words,
         dissimilarity in terms of deviations from exact coincidences of spikes
         Becomes 0 for identical spike trains, and bounded by 1 for highly dissimilar
+        Returns the SPIKE-distance and its profile x (interval edges), y1, y2 (value at start and end of each interval)
+        '''
+        x,y1,y2 = spike_profile(st1,st2)
+        spike_dist = np.sum(0.5*(y1 + y2)*np.diff(x)) / (x[-1] - x[0])
+        return spike_dist,x,y1,y2
+
+    def synchrony_matrix(self,spikes1,spikes2=None,measure='spike',tstart=0,tend=None,N=None,n_workers=None,out=None):
         '''
-        spike_dist = spk.spike_distance([st1,st2])
-        #print spike_dist
-
-        spike_profile = spk.spike_profile([st1,st2])
-        x,y = spike_profile.get_plottable_data()
-        plot(x,y,'-k')
-        xlabel('Time (ms)')
-        ylabel('SPIKE-dist')
-
-    def CrossCorrelation(self,spikemon1,spikemon2):
-        # Normalize spike times
-        try:
-            norm1 = spikemon1.t / np.linalg.norm(spikemon1.t)
-            norm2 = spikemon2.t / np.linalg.norm(spikemon2.t)
-        
-        except AttributeError:
-            norm1 = spikemon1 / np.linalg.norm(spikemon1)
-            norm2 = spikemon2 / np.linalg.norm(spikemon2)
-            
-        test1 = norm1
-        test2 = norm2
-        y = np.correlate(test1,test2,"full") 
-        z = np.correlate(test1,test1,"full") 
-
-        # Plotting correlation
-        x_valy = range(len(y))
-        x_valz = range(len(z))
-        plot(x_valy-np.argmax(z/ms),y,'b')
-        plot(x_valz-np.argmax(z/ms),z,'g')
-        blue_patch = mpatches.Patch(color='blue', label='Test Correlation')
-        green_patch = mpatches.Patch(color='green', label='Autocorrelation')
-        suptitle('Comparing network 2 to network 1', fontsize=14, fontweight='bold')
-        plt.legend(handles=[blue_patch,green_patch])
-        
+        Neuron by neuron ISI-distance ('isi'), SPIKE-distance ('spike') or SPIKE-synchronization ('sync') matrix
+        between the neurons of spikes1 and spikes2, or within spikes1 if spikes2 is None (see SynchronyMatrix)
+        '''
+        return SynchronyMatrix(measure,n_workers=n_workers).compute(spikes1,spikes2,tstart,tend,N,out)
+
+    def plot_profile(self,x,y1,y2=None,label=''):
+        '''
+        Plots a profile returned by SPIKEsynch (x,y), ISIdistance (x,y) or SPIKEdistance (x,y1,y2)
+        '''
+        if y2 is not None: # piecewise linear
+            px = np.repeat(x, 2)[1:-1]
+            py = np.column_stack((y1, y2)).ravel()
+        elif len(y1) == len(x) - 1: # piecewise constant
+            px = np.repeat(x, 2)[1:-1]
+            py = np.repeat(y1, 2)
+        else: # values at spike times
+            px = x
+            py = y1
+        plt = pyplot()
+        plt.plot(px,py,'-k')
+        plt.xlabel('Time (ms)')
+        plt.ylabel(label)
+
+    def binned_total(self,spikes,tstart,tend,bin_size):
+        # Spike count of the whole population in each bin of (tstart,tend]
+        bin_pos, t_size, _ = Spike_Stats().bin_positions(pooled_ms(spikes), tstart, tend, bin_size)
+        return np.bincount(bin_pos, minlength=t_size).astype(np.float64)
+
+    def CrossCorrelation(self,spikemon1,spikemon2,tstart=0,tend=None,bin_size=1,max_lag=100):
+        '''
+        Cross-correlogram of the population spike trains of network 1 and network 2 and the autocorrelogram
+        of network 1, binned over (tstart,tend] (ms) and computed in one FFT batch (see cross_correlogram).
+        tend defaults to the last spike, bin_size and max_lag are in ms.
+        Returns lags (ms), cross counts, cross baseline (shuffle predictor), auto counts
+        eg. plt.plot(lags, cross - baseline)
+        '''
+        if tend is None:
+            tend = max(pooled_ms(spikemon1).max(initial=tstart), pooled_ms(spikemon2).max(initial=tstart))
+        x1 = self.binned_total(spikemon1,tstart,tend,bin_size)
+        x2 = self.binned_total(spikemon2,tstart,tend,bin_size)
+        lags,counts,baseline = cross_correlogram(np.vstack((x1,x1)),np.vstack((x2,x1)),int(round(max_lag/float(bin_size))))
+        return lags*bin_size,counts[0],baseline[0],counts[1]
+
+    def correlogram_pairs(self,spikes1,spikes2,pairs,tstart,tend,bin_size=1,max_lag=100,N=None):
+        '''
+        Cross-correlograms of many neuron pairs in one call.
+        pairs: (neuron indices of spikes1, neuron indices of spikes2)
+        Returns lags (ms), counts and baseline ((pairs x lags) arrays)
+        '''
+        stats = Spike_Stats()
+        X,_ = stats.spikebin_matrix(spikes1,tstart,tend,bin_size,N)
+        Y,_ = stats.spikebin_matrix(spikes2,tstart,tend,bin_size,N)
+        lags,counts,baseline = cross_correlogram(X,Y,int(round(max_lag/float(bin_size))),pairs)
+        return lags*bin_size,counts,baseline
+
     def sync_parameter(self,mean,sigma,N):
         '''
         Takes in the mean value of a parameter and generates another value from a Gaussian distribution within the range
@@ -0,0 +1,284 @@
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+from .SpikeTrainSet import SpikeTrainSet
+
+def ragged_gather(indptr,rows):
+    # Indices into CSR data of the entries of the given rows (concatenated) and the number of entries of each row
+    start = indptr[rows]
+    length = indptr[rows+1] - start
+    offsets = np.cumsum(length) - length
+    return np.arange(length.sum()) + np.repeat(start - offsets, length), length
+
+def knots(t,indptr,t_start,t_end):
+    '''
+    Spike times of every neuron with the auxiliary spikes before and after the train (same edge correction as
+    SynchronicityCalculation.train_knots), CSR style: knots of neuron k are kt[kptr[k]:kptr[k+1]]
+    '''
+    N = len(indptr) - 1
+    count = np.diff(indptr)
+    kptr = indptr + 2*np.arange(N+1)
+    kt = np.empty(len(t) + 2*N)
+    neuron = np.repeat(np.arange(N), count)
+    kt[np.arange(len(t)) + 2*neuron + 1] = t
+    first = indptr[:-1]
+    last = indptr[1:] - 1
+    many = count >= 2 # Auxiliary spikes are only extrapolated from trains with an interval
+    aux0 = np.full(N, float(t_start))
+    aux1 = np.full(N, float(t_end))
+    aux0[many] = np.minimum(t_start, 2*t[first[many]] - t[first[many]+1])
+    aux1[many] = np.maximum(t_end, 2*t[last[many]] - t[last[many]-1])
+    kt[kptr[:-1]] = aux0
+    kt[kptr[1:]-1] = aux1
+    return kt, kptr
+
+def half_isi(t,indptr,max_tau):
+    # Half of the shorter interval to the neighbouring spikes of the same neuron, max_tau at the ends of each train
+    if len(t) == 0:
+        return np.zeros(0)
+    gaps = np.diff(t)
+    first = np.zeros(len(t), dtype=bool)
+    first[indptr[:-1][np.diff(indptr) > 0]] = True
+    before = np.concatenate(([max_tau], gaps))
+    before[first] = max_tau
+    after = np.concatenate((gaps, [max_tau]))
+    after[np.roll(first, -1)] = max_tau
+    return 0.5*np.minimum(before, after)
+
+def tile_measure(t1,ptr1,t2,ptr2,t_start,t_end,measure,max_tau=None):
+    '''
+    ISI-distance, SPIKE-distance or SPIKE-synchronization of every train of (t1,ptr1) with every train of (t2,ptr2),
+    all pairs at once. Trains are CSR style spike times (ms) inside [t_start,t_end], sorted within each neuron.
+    The trains of pair p are shifted by p*W on a common time axis, so one sort and one binary search handle all
+    pairs; differences are always taken from the unshifted times.
+    Returns an (n1 x n2) array
+    '''
+    n1 = len(ptr1) - 1
+    n2 = len(ptr2) - 1
+    P = n1*n2
+    T = float(t_end - t_start)
+    base = t_start - T # Auxiliary spikes lie within [t_start-T, t_end+T]
+    W = 3*T + 1.0
+    pair_a = np.repeat(np.arange(n1), n2)
+    pair_b = np.tile(np.arange(n2), n1)
+
+    def gather(values,indptr,rows):
+        idx, length = ragged_gather(indptr, rows)
+        pair = np.repeat(np.arange(P), length)
+        return values[idx], pair, (values[idx] - base) + pair*W, length
+
+    SA, pidSA, keySA, nA = gather(t1, ptr1, pair_a)
+    SB, pidSB, keySB, nB = gather(t2, ptr2, pair_b)
+
+    if measure == 'sync':
+        limit = T if max_tau is None else min(T, 2*max_tau)
+        hA = half_isi(t1, ptr1, limit)[ragged_gather(ptr1, pair_a)[0]]
+        hB = half_isi(t2, ptr2, limit)[ragged_gather(ptr2, pair_b)[0]]
+
+        def coincident(S,key,pid,h,S_other,key_other,pid_other,h_other):
+            c = np.zeros(len(S), dtype=bool)
+            if len(S_other) == 0:
+                return c
+            after = np.searchsorted(key_other, key, side='left')
+            for j in (after-1, after): # Closest spike before and after in the other train of the same pair
+                j = np.clip(j, 0, len(S_other)-1)
+                tau = np.minimum(h, h_other[j])
+                c |= (pid_other[j] == pid) & (np.abs(S - S_other[j]) < tau)
+            return c
+
+        cA = coincident(SA, keySA, pidSA, hA, SB, keySB, pidSB, hB)
+        cB = coincident(SB, keySB, pidSB, hB, SA, keySA, pidSA, hA)
+        total = nA + nB
+        synced = np.bincount(pidSA, cA, minlength=P) + np.bincount(pidSB, cB, minlength=P)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            value = np.where(total > 0, synced / total, 1.0)
+        return value.reshape(n1, n2)
+
+    # Intervals between consecutive events (spikes of both trains and the edges) of every pair
+    events = np.concatenate((SA, SB, np.full(P, float(t_start)), np.full(P, float(t_end))))
+    event_pid = np.concatenate((pidSA, pidSB, np.arange(P), np.arange(P)))
+    keys, first = np.unique((events - base) + event_pid*W, return_index=True)
+    x = events[first]
+    pid = event_pid[first]
+    same = pid[:-1] == pid[1:]
+    left = x[:-1][same]
+    right = x[1:][same]
+    mid = 0.5*(keys[:-1] + keys[1:])[same]
+    segment_pid = pid[:-1][same]
+
+    sides = []
+    for kt_ptr, rows in ((knots(t1, ptr1, t_start, t_end), pair_a), (knots(t2, ptr2, t_start, t_end), pair_b)):
+        K, kpid, kkey, klen = gather(kt_ptr[0], kt_ptr[1], rows)
+        p = np.searchsorted(kkey, mid, side='right') - 1
+        sides.append((K, kpid, kkey, klen, p, p+1))
+
+    if measure == 'isi':
+        isi = [K[f] - K[p] for K, _, _, _, p, f in sides]
+        y = np.abs(isi[0] - isi[1]) / np.maximum(isi[0], isi[1])
+        return (np.bincount(segment_pid, y*(right - left), minlength=P) / T).reshape(n1, n2)
+
+    if measure != 'spike':
+        raise ValueError("measure must be 'isi', 'spike' or 'sync', not %r" % (measure,))
+    isi = []
+    s_left = []
+    s_right = []
+    for n, (K, kpid, kkey, klen, p, f) in enumerate(sides):
+        K_other, kpid_other, kkey_other = sides[1-n][:3]
+        # Distance of each knot to the closest knot of the other train of the same pair
+        k = np.searchsorted(kkey_other, kkey)
+        D = np.full(len(K), np.inf)
+        for j in (k-1, k):
+            j = np.clip(j, 0, len(K_other)-1)
+            D = np.minimum(D, np.where(kpid_other[j] == kpid, np.abs(K - K_other[j]), np.inf))
+        # Auxiliary spikes take the distance of the first and last real spike
+        end = np.cumsum(klen)
+        has_spikes = klen > 2
+        start = (end - klen)[has_spikes]
+        end = end[has_spikes] - 1
+        D[start] = D[start+1]
+        D[end] = D[end-1]
+        interval = K[f] - K[p]
+        isi.append(interval)
+        s_left.append((D[p]*(K[f]-left) + D[f]*(left-K[p])) / interval)
+        s_right.append((D[p]*(K[f]-right) + D[f]*(right-K[p])) / interval)
+    mean_isi = 0.5*(isi[0] + isi[1])
+    y1 = 0.5*(s_left[0]*isi[1] + s_left[1]*isi[0]) / mean_isi**2
+    y2 = 0.5*(s_right[0]*isi[1] + s_right[1]*isi[0]) / mean_isi**2
+    return (np.bincount(segment_pid, 0.5*(y1 + y2)*(right - left), minlength=P) / T).reshape(n1, n2)
+
+def share(arrays):
+    # Copies arrays into one shared memory block, returns the block and the layout workers need to attach to it
+    arrays = [np.ascontiguousarray(a) for a in arrays]
+    layout = []
+    offset = 0
+    for a in arrays:
+        layout.append((offset, a.dtype.str, a.shape))
+        offset += -(-a.nbytes // 8)*8
+    shm = shared_memory.SharedMemory(create=True, size=max(offset, 8))
+    for a, (start, dtype, shape) in zip(arrays, layout):
+        np.ndarray(shape, dtype=dtype, buffer=shm.buf, offset=start)[...] = a
+    return shm, layout
+
+def shared_tile(name,layout,tile,t_start,t_end,measure,max_tau):
+    # Worker task: attaches to the shared spike arrays and computes one tile of the matrix
+    shm = shared_memory.SharedMemory(name=name)
+    try:
+        t1, ptr1, t2, ptr2 = [np.ndarray(shape, dtype=dtype, buffer=shm.buf, offset=start)
+                              for start, dtype, shape in layout]
+        result = local_tile(t1, ptr1, t2, ptr2, tile, t_start, t_end, measure, max_tau)
+        del t1, ptr1, t2, ptr2 # Views must be released before the block is closed
+    finally:
+        shm.close()
+    return result
+
+def local_tile(t1,ptr1,t2,ptr2,tile,t_start,t_end,measure,max_tau):
+    i0, i1, j0, j1 = tile
+    a = slice(ptr1[i0], ptr1[i1])
+    b = slice(ptr2[j0], ptr2[j1])
+    return tile_measure(t1[a], ptr1[i0:i1+1] - ptr1[i0], t2[b], ptr2[j0:j1+1] - ptr2[j0],
+                        t_start, t_end, measure, max_tau)
+
+class SynchronyMatrix:
+    '''
+    Neuron by neuron ISI-distance, SPIKE-distance and SPIKE-synchronization matrices
+
+    Description:
+    The pair space is split into tiles of tile_size x tile_size neurons. All pairs of a tile are computed at once
+    with sorted arrays and binary search (see tile_measure), and tiles are spread over a process pool whose workers
+    read the spike trains from one shared memory block instead of receiving copies.
+    Within a network (spikes2 None) only the upper triangle of tiles is computed and mirrored.
+    Values are the same as the pairwise functions in SynchronicityCalculation.
+
+    Parameters:
+        measure: 'isi' (ISI-distance), 'spike' (SPIKE-distance) or 'sync' (SPIKE-synchronization)
+        tile_size: number of neurons per tile side, memory per tile grows with tile_size**2 * spikes per neuron
+        n_workers: number of worker processes, None uses all cores and 1 runs in this process
+        max_tau: optional upper limit of the SPIKE-synchronization coincidence window (ms)
+    '''
+    def __init__(self,measure='spike',tile_size=64,n_workers=None,max_tau=None):
+        if measure not in ('isi', 'spike', 'sync'):
+            raise ValueError("measure must be 'isi', 'spike' or 'sync', not %r" % (measure,))
+        self.measure = measure
+        self.tile_size = tile_size
+        self.n_workers = n_workers
+        self.max_tau = max_tau
+
+    def trains(self,spikes,tstart,tend,N=None):
+        # Spike times (ms) inside [tstart,tend] and indptr of a SpikeTrainSet, monitor or get_states() entry
+        spikes = SpikeTrainSet.convert(spikes, N)
+        keep = (spikes.t >= tstart) & (spikes.t <= tend)
+        indptr = np.zeros(spikes.N+1, dtype=np.int64)
+        np.cumsum(np.bincount(spikes.i[keep], minlength=spikes.N), out=indptr[1:])
+        return spikes.t[keep], indptr
+
+    def tiles(self,n1,n2,symmetric):
+        size = self.tile_size
+        for i0 in range(0, n1, size):
+            for j0 in range(i0 if symmetric else 0, n2, size):
+                yield (i0, min(i0+size, n1), j0, min(j0+size, n2))
+
+    def compute(self,spikes1,spikes2=None,tstart=0,tend=None,N=None,out=None,dtype=np.float64):
+        '''
+        Matrix of the measure between every neuron of spikes1 (rows) and every neuron of spikes2 (columns),
+        or between all neurons of spikes1 if spikes2 is None.
+        spikes1, spikes2: SpikeTrainSet, SpikeMonitor or get_states() entry
+        tstart, tend: interval (ms), tend defaults to the last spike
+        out: None to return the result in memory, or a file name for a .npy memory-mapped result
+        '''
+        return self.compute_runs([(spikes1, spikes2)], tstart, tend, N, None if out is None else [out], dtype)[0]
+
+    def compute_runs(self,runs,tstart=0,tend=None,N=None,out=None,dtype=np.float64):
+        '''
+        Same as compute for many runs (eg. every datastream entry of a sweep) with one worker pool.
+        runs: list of (spikes1, spikes2) tuples, spikes2 None for the matrix within spikes1
+        out: None, or a list with one .npy file name per run
+        Returns a list of matrices in the order of runs
+        '''
+        pool = None
+        if self.n_workers != 1:
+            pool = ProcessPoolExecutor(max_workers=self.n_workers)
+        try:
+            return [self.run_matrix(pool, spikes1, spikes2, tstart, tend, N, None if out is None else out[k], dtype)
+                    for k, (spikes1, spikes2) in enumerate(runs)]
+        finally:
+            if pool is not None:
+                pool.shutdown()
+
+    def run_matrix(self,pool,spikes1,spikes2,tstart,tend,N,out,dtype):
+        symmetric = spikes2 is None
+        if tend is None:
+            sets = [spikes1] if symmetric else [spikes1, spikes2]
+            tend = max([SpikeTrainSet.convert(s, N).t.max(initial=tstart) for s in sets])
+        t1, ptr1 = self.trains(spikes1, tstart, tend, N)
+        t2, ptr2 = (t1, ptr1) if symmetric else self.trains(spikes2, tstart, tend, N)
+        n1 = len(ptr1) - 1
+        n2 = len(ptr2) - 1
+        if out is None:
+            matrix = np.empty((n1, n2), dtype=dtype)
+        else:
+            matrix = np.lib.format.open_memmap(out, mode='w+', dtype=dtype, shape=(n1, n2))
+
+        def store(tile,values):
+            i0, i1, j0, j1 = tile
+            matrix[i0:i1, j0:j1] = values
+            if symmetric and i0 != j0:
+                matrix[j0:j1, i0:i1] = values.T
+
+        tiles = list(self.tiles(n1, n2, symmetric))
+        if pool is None:
+            for tile in tiles:
+                store(tile, local_tile(t1, ptr1, t2, ptr2, tile, tstart, tend, self.measure, self.max_tau))
+        else:
+            shm, layout = share([t1, ptr1, t2, ptr2])
+            try:
+                futures = [(tile, pool.submit(shared_tile, shm.name, layout, tile, tstart, tend, self.measure,
+                                              self.max_tau)) for tile in tiles]
+                for tile, future in futures:
+                    store(tile, future.result())
+            finally:
+                shm.close()
+                shm.unlink()
+        if out is not None:
+            matrix.flush()
+        return matrix
@@ -0,0 +1,142 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import numpy as np
+
+from .ResultCache import digest_update
+from .AdjacencyMatrix import AdjacencyMatrix
+from .LazyImports import lazy
+
+ARRAYS = ['new_rows', 'new_cols', 'connect_A', 'connect_W']
+GENERATORS = {'small_world': 'small_world_sparse', 'random': 'random_sparse'}
+
+opened = {} # (directory, key) --> StoredTopology already mapped by this process
+
+def load_topology(directory,key):
+    # Memory-maps a stored topology, once per process (also used to unpickle StoredTopology in workers)
+    name = (os.path.abspath(directory), key)
+    if name not in opened:
+        opened[name] = StoredTopology(directory, key)
+    return opened[name]
+
+class StoredTopology:
+    '''
+    One network topology of a TopologyStore, arrays are read-only np.memmap views of the stored .npy files:
+        new_rows, new_cols: int32 source and target neuron of every connection (as adj_synapse_type)
+        connect_A: float64 +1 excitatory / -1 inhibitory connections
+        connect_W: float64 connection weights in volt (SI, no units), connect_A*uniform(0,1)*mV as in the notebook
+        meta: dict of the parameters it was generated with
+    Unpacks like a BatchSweep topology entry, rows, cols, connect_W = topology, with connect_W as a Brian2 quantity
+    that views the mapped array. Pickles as (directory, key) only, so worker processes map the same files instead
+    of receiving a copy of the arrays, and the page cache holds one copy for all of them.
+    '''
+    def __init__(self,directory,key):
+        self.directory = directory
+        self.key = key
+        path = os.path.join(directory, key)
+        for name in ARRAYS:
+            setattr(self, name, np.load(os.path.join(path, name + '.npy'), mmap_mode='r'))
+        with open(os.path.join(path, 'meta.json')) as f:
+            self.meta = json.load(f)
+
+    def __reduce__(self):
+        return load_topology, (self.directory, self.key)
+
+    def __repr__(self):
+        # Also what ResultCache hashes, the key identifies the arrays
+        return 'StoredTopology(%r)' % self.key
+
+    def __len__(self):
+        return 3
+
+    def __iter__(self):
+        volt = lazy('brian2').volt
+        connect_W = lazy('brian2').Quantity(self.connect_W, dim=volt.dim, copy=False) # No copy of the mapped array
+        return iter((self.new_rows, self.new_cols, connect_W))
+
+    def __getitem__(self,index):
+        return list(self)[index]
+
+class TopologyStore:
+    '''
+    On-disk store of seeded network topologies
+
+    Description:
+    Every topology is generated once with explicit seeds and kept as .npy files (new_rows, new_cols, connect_A,
+    connect_W) in a folder named by a hash of (generator, n, k, p, excit fraction, seed). Later requests, from
+    any process, memory-map the files: reloading takes milliseconds for any size and all processes share the same
+    pages instead of holding their own copy.
+    The seed is expanded with np.random.SeedSequence into independent streams for the graph and for the random
+    connect_W scaling, so a topology depends on the key only (never on time or global random state).
+    Topologies are written into a temporary folder that is renamed when complete, so readers never see a
+    half-written topology and concurrent writers of the same key are harmless.
+
+    Parameters:
+        directory: folder to keep the topologies in (created if needed)
+    '''
+    def __init__(self,directory):
+        self.directory = directory
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def key(self,generator,n,k,p,excit=0.8,seed=0):
+        # Hex digest of the topology parameters, k is not used by the 'random' generator
+        if generator not in GENERATORS:
+            raise ValueError('Unknown generator %r, choose from %s' % (generator, sorted(GENERATORS)))
+        if generator == 'random':
+            k = None
+        h = hashlib.sha256()
+        digest_update(h, (generator, int(n), k, float(p), float(excit), int(seed)))
+        return h.hexdigest()[:32]
+
+    def get(self,generator,n,k,p,excit=0.8,seed=0):
+        '''
+        StoredTopology of a (generator, n, k, p, excit, seed) network, generated and saved if it is not stored yet.
+        generator: 'small_world' (AdjacencyMatrix.small_world_sparse, Newman-Watts-Strogatz)
+                   or 'random' (AdjacencyMatrix.random_sparse, G(n,p))
+        excit: fraction of excitatory neurons, neurons int(excit*n)..n-1 are inhibitory
+        '''
+        key = self.key(generator,n,k,p,excit,seed)
+        if not os.path.isdir(os.path.join(self.directory, key)):
+            self.generate(key,generator,n,k,p,excit,seed)
+        return load_topology(self.directory, key)
+
+    def generate(self,key,generator,n,k,p,excit,seed):
+        graph_seed, weight_seed = np.random.SeedSequence(seed).spawn(2)
+        am = AdjacencyMatrix.__new__(AdjacencyMatrix) # No figure clearing
+        if generator == 'small_world':
+            A, _ = am.small_world_sparse(n,k,p,seed=np.random.default_rng(graph_seed))
+        else:
+            A, _ = am.random_sparse(n,p,seed=np.random.default_rng(graph_seed))
+        connect_A, _, new_rows, new_cols = am.adj_synapse_type_sparse(A,int(excit*n))
+        connect_W = connect_A * np.random.default_rng(weight_seed).uniform(0,1,len(connect_A)) * 1e-3 # mV in volt
+        meta = {'generator': generator, 'n': int(n), 'k': k, 'p': float(p), 'excit': float(excit),
+                'seed': int(seed), 'excit_neurons': int(excit*n), 'connections': int(len(new_rows))}
+
+        tmp = tempfile.mkdtemp(prefix='.tmp-', dir=self.directory)
+        try:
+            for name, values in zip(ARRAYS, [new_rows, new_cols, connect_A, connect_W]):
+                np.save(os.path.join(tmp, name + '.npy'), values)
+            with open(os.path.join(tmp, 'meta.json'), 'w') as f:
+                json.dump(meta, f)
+            try:
+                os.rename(tmp, os.path.join(self.directory, key)) # Atomic, readers see nothing or the complete folder
+            except OSError:
+                if not os.path.isdir(os.path.join(self.directory, key)):
+                    raise
+                shutil.rmtree(tmp) # Another process stored the same topology first
+        except BaseException:
+            shutil.rmtree(tmp, ignore_errors=True)
+            raise
+
+    def keys(self):
+        # Keys of all stored topologies
+        return [name for name in os.listdir(self.directory)
+                if not name.startswith('.tmp-') and os.path.isdir(os.path.join(self.directory, name))]
+
+    def remove(self,key):
+        shutil.rmtree(os.path.join(self.directory, key), ignore_errors=True)
+        for name in [name for name in opened if name[1] == key]:
+            del opened[name]
@@ -1,7 +1,116 @@
-import matplotlib.pyplot as plt
-import matplotlib.patches as mpatches
-import networkx as nx
 import numpy as np
+import scipy.sparse as sp
+from scipy.sparse import csgraph
+
+from .LazyImports import lazy, loaded, pyplot, close_figures
+
+def as_graph(G):
+    # Graphs from the array-based generators in AdjacencyMatrix build their NetworkX Graph only when needed
+    if hasattr(G, 'to_networkx'):
+        return G.to_networkx()
+    return G
+
+def as_csr(G):
+    '''
+    Symmetric 0/1 CSR adjacency matrix without self-loops of a SparseGraph, scipy sparse matrix, dense array
+    or NetworkX Graph (nodes in G.nodes() order)
+    '''
+    if hasattr(G, 'to_networkx'): # SparseGraph from AdjacencyMatrix
+        A = G.A
+    elif loaded('networkx') is not None and isinstance(G, loaded('networkx').Graph): # Only imported if G can be one
+        A = loaded('networkx').to_scipy_sparse_array(G, format='csr')
+    else:
+        A = G
+    A = sp.csr_matrix(A)
+    A = ((A != 0) + (A != 0).T).astype(np.int32).tocsr()
+    A.setdiag(0)
+    A.eliminate_zeros()
+    return A
+
+def clustering(A):
+    '''
+    Clustering co-efficient of every node (same as nx.clustering) from sparse triangle counting:
+    the number of triangles through node k is half the row sum k of A^2 * A (element-wise)
+    '''
+    A = as_csr(A)
+    triangles = np.asarray((A @ A).multiply(A).sum(axis=1)).ravel() / 2.0
+    degree = np.diff(A.indptr)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cc = np.where(degree > 1, 2*triangles / (degree*(degree-1.0)), 0.0)
+    return cc
+
+def characteristic_path_length(A,n_sources=None,seed=None,confidence=0.95,block_size=256):
+    '''
+    Average shortest path length over all pairs of connected nodes (same as nx.average_shortest_path_length for a
+    connected graph), from breadth-first searches with scipy.sparse.csgraph.
+    n_sources: None for the exact value from every node, otherwise the number of randomly chosen source nodes
+               (seeded with seed) for an estimate of large graphs
+    confidence: confidence level of the returned interval
+    Returns cpl, (low, high): low == high == cpl for the exact value
+    '''
+    A = as_csr(A)
+    n = A.shape[0]
+    if n_sources is None or n_sources >= n:
+        sources = np.arange(n)
+    else:
+        sources = np.sort(np.random.default_rng(seed).choice(n, n_sources, replace=False))
+    # Sum and number of finite path lengths from each source, in blocks to bound memory at block_size x n
+    total = np.zeros(len(sources))
+    reached = np.zeros(len(sources))
+    for k0 in range(0, len(sources), block_size):
+        dist = csgraph.shortest_path(A, directed=False, unweighted=True, indices=sources[k0:k0+block_size])
+        finite = np.isfinite(dist) & (dist > 0)
+        total[k0:k0+block_size] = np.where(finite, dist, 0).sum(axis=1)
+        reached[k0:k0+block_size] = finite.sum(axis=1)
+    if reached.sum() == 0:
+        return np.nan, (np.nan, np.nan)
+    cpl = total.sum() / reached.sum()
+    if len(sources) == n:
+        return cpl, (cpl, cpl)
+    # Ratio estimator over the sampled sources, standard error with finite population correction
+    m = len(sources)
+    residual = (total - cpl*reached) / reached.mean()
+    se = np.sqrt(np.var(residual, ddof=1) / m * (1 - m/float(n))) if m > 1 else np.inf
+    half = lazy('scipy.stats').norm.ppf(0.5 + confidence/2.0) * se # scipy.stats takes most of a second to import
+    return cpl, (cpl - half, cpl + half)
+
+def connectivity_density(rows,cols,connect_W,N,n_bins=512,chunk=2**20):
+    '''
+    Excitatory and inhibitory connection counts binned into an (n_bins x n_bins) image of presynaptic (rows) x
+    postsynaptic (cols) neuron blocks, straight from the synapse arrays of adj_synapse_type.
+    Edges are binned chunk at a time, so memory does not grow with the number of synapses.
+    Returns excit, inhib: (n_bins x n_bins) arrays of connection counts
+    '''
+    n_bins = int(min(n_bins, N))
+    excit = np.zeros(n_bins*n_bins, dtype=np.int64)
+    inhib = np.zeros(n_bins*n_bins, dtype=np.int64)
+    for k0 in range(0, len(rows), chunk):
+        r = np.asarray(rows[k0:k0+chunk], dtype=np.int64) * n_bins // N
+        c = np.asarray(cols[k0:k0+chunk], dtype=np.int64) * n_bins // N
+        negative = np.asarray(connect_W[k0:k0+chunk]) < 0
+        pixel = r*n_bins + c
+        excit += np.bincount(pixel[~negative], minlength=n_bins*n_bins)
+        inhib += np.bincount(pixel[negative], minlength=n_bins*n_bins)
+    return excit.reshape(n_bins, n_bins), inhib.reshape(n_bins, n_bins)
+
+def density_image(excit,inhib):
+    # RGB image with excitatory density in red and inhibitory density in blue on a white background
+    e = excit / float(max(excit.max(), 1))
+    i = inhib / float(max(inhib.max(), 1))
+    return np.clip(np.dstack((1 - i, 1 - e - i, 1 - e)), 0, 1)
+
+def legend_axes(ax=None):
+    # Axes of the structural connection plots (a new figure if ax is None) with the excitatory/inhibitory legend
+    if ax is None:
+        plt = pyplot()
+        plt.figure()
+        ax = plt.gca()
+    mpatches = lazy('matplotlib.patches')
+    red_patch = mpatches.Patch(color='red', label='Excitatory')
+    blue_patch = mpatches.Patch(color='blue', label='Inhibitory')
+    ax.legend(handles=[red_patch,blue_patch])
+    ax.set_title('Structural Connections', fontsize=14, fontweight='bold')
+    return ax
 
 class Visualization:
     '''
@@ -21,80 +130,65 @@ class Visualization:
     Returns:
         cc_avg: Cluster coefficient averaged over all nodes
         ex_in_plot: Plot of colored excitatory/inhibitory connections
-        cpl_avg: Number of edges at shortest path over all nodes 
+        cpl_avg: Shortest path length averaged over all pairs of nodes
         
     Parameters:
-        G: NetworkX Graph from Function 1
+        G: NetworkX Graph or SparseGraph from Function 1 (cluster_coeff and char_path_len also take a CSR adjacency)
     '''
     def __init__(self):
         #plt.clf() # Clears any previous figures
-        plt.close() # Clears any figure windows
+        close_figures() # Clears any figure windows
 
-    def cluster_coeff(self,G):        
-        cc = nx.clustering(G) # calculate clustering co-eff according to different rules eg. no of triangles going through node
-        # outputs co-eff for all or specified nodes in dict form
-        cc_y=[]
-        for idx in cc:
-            cc_y=np.append(cc_y,cc[idx]) # access and append dict values (co-effs in this case) to array
-        
-        cc_avg = np.ndarray.mean(cc_y, dtype=np.float64)
+    def cluster_coeff(self,G):
+        cc_y = clustering(G) # co-eff of every node from the number of triangles going through it
+        cc_avg = np.mean(cc_y, dtype=np.float64)
         return cc_avg
     
-    def ex_in_connec(self,G,connect_W,new_coord):
-        plt.figure()
-        red_patch = mpatches.Patch(color='red', label='Excitatory')
-        blue_patch = mpatches.Patch(color='blue', label='Inhibitory')
-        plt.legend(handles=[red_patch,blue_patch])
-        plt.suptitle('Structural Connections', fontsize=14, fontweight='bold')
-
-        edges = G.edges() # list of tuple pairs
-        nodes = G.nodes() # array of nodes
+    def ex_in_connec(self,G,connect_W,new_coord,max_nodes=200,n_bins=512,ax=None):
+        '''
+        Plots the excitatory (red) and inhibitory (blue) structural connections.
+        Networks with up to max_nodes neurons are drawn node by node on a copy of G, larger networks as a binned
+        connection density image (see ex_in_density, which also returns the density arrays)
+        Returns the axes in both cases
+        '''
+        N = G.number_of_nodes() # SparseGraph does not build its NetworkX Graph for this
+        new_coord = np.array(list(new_coord)).reshape(-1,2) # (connections x 2) array, also from a zip of pairs
+        ax = legend_axes(ax)
+        if N > max_nodes:
+            self.ex_in_density(new_coord[:,0],new_coord[:,1],connect_W,N,n_bins,ax)
+            return ax
 
-        custom_color={}
-        for idx in range(len(connect_W)):
-            if connect_W[idx] < 0:
-                inhib_edge = new_coord[idx]
-                G.add_edge(*inhib_edge)     # adds an inhibitory edge connection to graph if it's not already there
-                custom_color[inhib_edge]='b'
-            else:
-                excit_edge = new_coord[idx]
-                G.add_edge(*excit_edge)
-                custom_color[excit_edge]='r'
-        if 0:
-            for idx,idy in enumerate(edges):
-                x1,y1 = edges[idx]
-                if connect_W < 0:
-                    inhib_edge = (x1,y1)
-                    G.add_edge(x1,y1)
-                    custom_color[x1,y1]='b' # Stores color of edges in dict
-                else:
-                    excit_edge = (x1,y1)
-                    G.add_edge(x1,y1)
-                    custom_color[x1,y1]='r'
-        
-        ex_in_plot=nx.draw_networkx(G,node_color='w',
+        nx = lazy('networkx')
+        H = nx.Graph(as_graph(G)) # Copy, the caller's graph is left unchanged
+        edges = [tuple(int(node) for node in coord) for coord in new_coord]
+        H.add_edges_from(edges) # adds any synapse that is not already an edge of the graph
+        colors = ['b' if w < 0 else 'r' for w in np.asarray(connect_W)]
+        nx.draw_networkx(H,ax=ax,node_color='w',
                          with_labels=True,
-                         node_list=nodes,
-                         #node_size=50,
                          node_size=200,
-                         edge_list=custom_color.keys(),
-                         edge_color=custom_color.values(),
-                         label='Blue=Inhibitory, Red=Excitatory')
+                         edgelist=edges,
+                         edge_color=colors)
         #plt.savefig("Structural Connections.png")
-        
-    def char_path_len(self,G):
-        cpl = nx.all_pairs_shortest_path_length(G) # shortest path lengths. Gen. returns tuple with source and target dict
-        my_array = []
-        my_key = []
-        cpl_count = []
-        for idx in cpl: # looping through each source node and looking at no of targets and length to target nodes
-            myarray = cpl[idx[1]] # cpl is a generator object. idx is a tuple (source, target dict). Should be idx[1].
-            min_val = min(ii for ii in myarray if ii > 0) # Find min length
-            for key,length in myarray.iteritems():
-                if length == min_val:
-                    my_key = np.append(my_key,key) # array of target nodes with min length for specific source node
-            my_count = len(my_key) # Find number of edges of that length
-            cpl_count = np.append(cpl_count,my_count)
-            my_key = []
-            cpl_avg = np.mean(cpl_count) # Find average of those edges
-        return cpl_avg
\ No newline at end of file
+        return ax
+
+    def ex_in_density(self,rows,cols,connect_W,N,n_bins=512,ax=None):
+        '''
+        Structural connections of large networks as an (n_bins x n_bins) image of connection density between
+        blocks of presynaptic and postsynaptic neurons, excitatory in red and inhibitory in blue.
+        Cost grows with the number of synapses only through one bincount, so 1e5 neuron networks render quickly
+        Returns excit, inhib: (n_bins x n_bins) arrays of connection counts
+        '''
+        excit,inhib = connectivity_density(rows,cols,connect_W,N,n_bins)
+        ax = legend_axes(ax)
+        ax.imshow(density_image(excit,inhib),extent=[0,N,N,0],interpolation='nearest',aspect='equal')
+        ax.set_xlabel('Postsynaptic neuron')
+        ax.set_ylabel('Presynaptic neuron')
+        return excit,inhib
+
+    def char_path_len(self,G,n_sources=None,seed=None):
+        '''
+        Average shortest path length between all pairs of connected nodes. For large graphs pass n_sources to
+        estimate it from that many random source nodes, characteristic_path_length also returns the error bounds
+        '''
+        cpl_avg, _ = characteristic_path_length(G,n_sources,seed)
+        return cpl_avg
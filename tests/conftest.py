@@ -0,0 +1,5 @@
+import os
+import sys
+
+os.environ.setdefault('MPLBACKEND', 'Agg') # Headless figures
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__)))) # lib and benchmarks packages
@@ -0,0 +1,53 @@
+import numpy as np
+import pytest
+
+from lib.AdjacencyMatrix import AdjacencyMatrix
+
+@pytest.mark.parametrize('n', [20, 200])
+def test_sparse_and_dense_adj_synapse_type_agree(n):
+    am = AdjacencyMatrix(n)
+    A, _ = am.small_world_sparse(n,6,0.3,seed=1)
+    excit = int(0.8*n)
+    dense = am.adj_synapse_type(A,excit)
+    sparse = am.adj_synapse_type(A,excit,sparse=True)
+    edges = []
+    for connect_A, new_coord, new_rows, new_cols in [dense, sparse]:
+        assert np.array_equal(np.asarray(new_coord), np.column_stack((new_rows, new_cols)))
+        assert np.all(new_rows <= new_cols) # One ordered pair per undirected connection
+        assert np.array_equal(np.asarray(connect_A).ravel(), np.where(new_rows >= excit, -1, 1))
+        edges.append(set(zip(new_rows.tolist(), new_cols.tolist())))
+    assert edges[0] == edges[1]
+    assert len(edges[0]) == A.nnz // 2
+
+def check_simple_graph(A):
+    # Symmetric 0/1 adjacency without self-loops or duplicate entries
+    A = A.tocsr()
+    assert np.all(A.diagonal() == 0)
+    assert A.has_canonical_format and np.all(A.data == 1)
+    assert (A != A.T).nnz == 0
+
+def test_random_sparse():
+    n, p = 2000, 0.01
+    am = AdjacencyMatrix.__new__(AdjacencyMatrix)
+    A, G = am.random_sparse(n,p,seed=0)
+    check_simple_graph(A)
+    assert G.number_of_nodes() == n
+    expected = p*n*(n-1)/2
+    assert abs(A.nnz//2 - expected) < 5*np.sqrt(expected*(1-p)) # Binomial number of edges
+    assert (am.random_sparse(n,p,seed=0)[0] != A).nnz == 0
+    assert (am.random_sparse(n,p,seed=1)[0] != A).nnz > 0
+
+def test_small_world_sparse():
+    n, k, p = 1000, 6, 0.2
+    am = AdjacencyMatrix.__new__(AdjacencyMatrix)
+    A, G = am.small_world_sparse(n,k,p,seed=0)
+    check_simple_graph(A)
+    assert G.number_of_nodes() == n
+    # Every ring lattice edge, plus about p shortcuts per ring edge (a few merge with existing edges)
+    for offset in range(1, k//2 + 1):
+        assert np.all(A[np.arange(n), (np.arange(n) + offset) % n] == 1)
+    ring = n*k//2
+    shortcuts = A.nnz//2 - ring
+    assert abs(shortcuts - p*ring) < 5*np.sqrt(p*(1-p)*ring)
+    assert (am.small_world_sparse(n,k,p,seed=0)[0] != A).nnz == 0
+    assert (am.small_world_sparse(n,k,p,seed=1)[0] != A).nnz > 0
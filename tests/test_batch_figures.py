@@ -0,0 +1,53 @@
+import os
+import subprocess
+import sys
+import numpy as np
+
+from benchmarks.fixtures import spike_fixture
+from lib.BatchFigures import BatchFigures, raster_counts, psth
+
+def entry(seed):
+    # datastream entry (SN_1t,SN_1i,SN_2t,SN_2i,SN_indvt) with times in ms
+    S1 = spike_fixture(50,30,300,seed=seed)
+    S2 = spike_fixture(50,30,300,seed=seed+1)
+    S0 = spike_fixture(50,30,300,seed=seed+2)
+    t1, i1 = S1.by_time()
+    t2, i2 = S2.by_time()
+    return t1, i1, t2, i2, S0.by_time()[0]
+
+def test_binned_images_keep_every_spike():
+    t1, i1, _, _, _ = entry(0)
+    counts = raster_counts(t1,i1,50,0,300,time_bins=100)
+    assert counts.shape == (50, 100) and counts.sum() == len(t1)
+    assert np.array_equal(counts.sum(axis=1), np.bincount(i1, minlength=50))
+    edges, hist = psth(t1,0,300,bin_size=2)
+    assert len(edges) == 151 and hist.sum() == len(t1)
+    assert np.array_equal(hist, np.histogram(t1, edges)[0])
+
+def test_export_writes_one_png_per_entry(tmp_path):
+    datastream = [entry(0), entry(10)]
+    figures = BatchFigures(50,300,phases=[100,200])
+    names = figures.export(datastream,str(tmp_path / 'serial'),[(1.0, 0.5), (2.0, 0.25)],w_couple=2.0,n_workers=1)
+    assert [os.path.basename(name) for name in names] == ['batch_p0.500_cf0.500.png', 'batch_p0.250_cf1.000.png']
+    pool = figures.export(datastream,str(tmp_path / 'pool'),n_workers=2)
+    assert [os.path.basename(name) for name in pool] == ['batch_000.png', 'batch_001.png']
+    for name in names + pool:
+        with open(name, 'rb') as f:
+            assert f.read(8) == b'\x89PNG\r\n\x1a\n'
+
+def test_export_is_headless(tmp_path):
+    # No display and no pyplot: figures are drawn on the Agg canvas directly
+    script = '''
+import sys
+import numpy as np
+from lib.BatchFigures import BatchFigures
+t = np.linspace(0, 99, 200)
+i = np.arange(200) % 10
+BatchFigures(10,100).export([(t, i, t, i, t)], sys.argv[1], n_workers=1)
+assert 'matplotlib.pyplot' not in sys.modules
+'''
+    env = dict(os.environ, PYTHONPATH=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    env.pop('DISPLAY', None)
+    env.pop('MPLBACKEND', None)
+    subprocess.run([sys.executable, '-c', script, str(tmp_path)], env=env, check=True)
+    assert os.listdir(str(tmp_path)) == ['batch_000.png']
@@ -0,0 +1,25 @@
+import numpy as np
+import pytest
+
+brian2 = pytest.importorskip('brian2')
+from brian2 import mV
+
+from benchmarks.fixtures import sweep_config
+from lib.BatchSweep import BatchSweep, run_point, point_seed, coupling_seed
+
+def test_pool_matches_serial_sweep():
+    # Every point has its own seed, so a process pool returns the serial results whatever order points finish in
+    config = sweep_config(30,t1=20,t2=40)
+    w_couple_vec = [0.5*mV, 2*mV]
+    p_couple_vec = [0.0, 0.5]
+    record_param = [(2*mV, 0.5)]
+    serial = BatchSweep(config,n_workers=1,seed=5).run(w_couple_vec,p_couple_vec,record_param)
+    pool = BatchSweep(config,n_workers=2,seed=5).run(w_couple_vec,p_couple_vec,record_param)
+    assert serial[0].shape == (2, 2)
+    assert np.array_equal(serial[0], pool[0], equal_nan=True)
+    for a, b in zip(serial[1][0] + serial[2][0] + serial[3][0], pool[1][0] + pool[2][0] + pool[3][0]):
+        assert np.array_equal(np.asarray(a), np.asarray(b))
+    # Grid point (w_couple,p_couple) is run_point with its own seeds
+    cc, spikes, _ = run_point(config,2*mV,0.5,point_seed(5,2*mV,0.5),False,coupling_seed(5,0.5))
+    assert np.isclose(pool[0][1,1], cc)
+    assert np.array_equal(np.asarray(spikes[0]), np.asarray(pool[1][0][0]))
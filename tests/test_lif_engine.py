@@ -0,0 +1,37 @@
+'''
+Validation of the NumPy LIFEngine (run_lif_point) against Brian2 (run_point) on the batch program model.
+Without Poisson input both are deterministic and must produce the same spikes and monitor traces. With Poisson
+input the noise streams differ, so total spike counts of Networks 1 and 2 must agree within SPIKE_COUNT_TOLERANCE
+'''
+import numpy as np
+import pytest
+
+brian2 = pytest.importorskip('brian2')
+from brian2 import mV
+
+from benchmarks.fixtures import sweep_config
+from lib.BatchSweep import run_point, run_lif_point
+
+SPIKE_COUNT_TOLERANCE = 0.1 # Relative difference of spike counts with Poisson input
+
+def points(PInput,w_couple):
+    config = sweep_config(100,t1=50,t2=100)
+    config['PInput'] = [PInput]*3
+    return run_point(config,w_couple,0.5,1,True), run_lif_point(config,w_couple,0.5,1,True)
+
+def test_lif_matches_brian2_without_noise():
+    # w_couple = 0 keeps the randomly drawn coupling weights out of the comparison
+    (cc_b, spikes_b, monitors_b), (cc_n, spikes_n, monitors_n) = points(0*mV,0*mV)
+    assert len(spikes_b[0]) > 0
+    for brian, numpy in zip(spikes_b, spikes_n):
+        assert np.allclose(np.asarray(brian), np.asarray(numpy))
+    assert np.isclose(cc_b, cc_n)
+    for brian, numpy in zip(monitors_b[0] + monitors_b[1], monitors_n[0] + monitors_n[1]):
+        assert np.shape(brian) == np.shape(numpy) # Same 10 us monitor clock
+        assert np.allclose(np.asarray(brian), np.asarray(numpy), rtol=1e-6, atol=1e-12)
+
+def test_lif_spike_counts_with_noise():
+    (_, spikes_b, _), (_, spikes_n, _) = points(0.1*mV,2*mV)
+    count_b = len(spikes_b[0]) + len(spikes_b[2])
+    count_n = len(spikes_n[0]) + len(spikes_n[2])
+    assert abs(count_n - count_b) <= SPIKE_COUNT_TOLERANCE*count_b
@@ -0,0 +1,40 @@
+import numpy as np
+
+from lib.OnlineSpikeStats import OnlineSpikeStats
+from lib.Spike_Stats import Spike_Stats
+
+def stream(N=50,steps=3000,dt=0.1,seed=0):
+    # Two populations driven by a shared rate modulation, fed step by step with flush() at 100 and 200 ms
+    rng = np.random.default_rng(seed)
+    rate = 0.02*(1 + np.sin(np.arange(steps)*dt/7.0))
+    spikes = [[np.flatnonzero(rng.random(N) < rate[k]) for k in range(steps)] for _ in range(2)]
+    online = OnlineSpikeStats([N, N],bin_size=1,dt=dt)
+    for k in range(steps):
+        t = k*dt # Unrounded float times, like Brian2's t/ms
+        if k in (1000, 2000):
+            online.flush()
+            if k == 1000:
+                online.reset_correlation()
+            else:
+                cc = online.correlation()
+                rates = online.rates()[:, -100:]
+        online.update(t,[spikes[0][k], spikes[1][k]])
+    times = [np.concatenate([np.full(len(s), round(k*dt, 1)) for k, s in enumerate(net)]) for net in spikes]
+    return cc, rates, times
+
+def test_streamed_cc_is_exact_on_its_own_bins():
+    cc, rates, _ = stream()
+    assert np.isclose(cc, np.corrcoef(rates)[0, 1])
+
+def test_streamed_cc_close_to_batch_cc():
+    # Bin conventions differ at the window edges (see the OnlineSpikeStats docstring)
+    cc, _, times = stream()
+    assert abs(cc - Spike_Stats().batch_cc(times[0],times[1],100,200,1)) < 0.02
+
+def test_float_times_fall_in_their_time_step_bin():
+    # Step 70 can arrive as 6.999999999999999 (0.7/0.1), t // bin_size would put it in bin 6
+    online = OnlineSpikeStats([1],bin_size=1,dt=0.1)
+    for k in range(100):
+        online.update(k*0.1 if k != 70 else 0.7/0.1,[[0]] if k in (69, 70) else [[]])
+    online.flush()
+    assert list(online.rates()[0, 6:8]) == [1, 1]
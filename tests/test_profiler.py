@@ -0,0 +1,59 @@
+import json
+import pytest
+
+import lib.Profiler as ProfilerModule
+from lib.Profiler import Profiler, span, profiled
+
+@profiled()
+def work(n):
+    return sum(range(n))
+
+def test_spans_nest_into_records():
+    with Profiler(brian_profile=False) as prof:
+        assert ProfilerModule.active is prof
+        with span('outer'):
+            with span('inner', size=3):
+                work(1000)
+        with prof.point(w_couple=1.0):
+            with span('phase1'):
+                pass
+    assert ProfilerModule.active is None
+    session, point = prof.records
+    assert session['name'] == 'session' and point['name'] == 'point' and point['labels'] == {'w_couple': 1.0}
+    spans = dict((entry['path'], entry) for entry in session['spans'])
+    assert sorted(spans) == ['outer', 'outer/inner', 'outer/inner/work']
+    assert [spans[path]['depth'] for path in ['outer', 'outer/inner', 'outer/inner/work']] == [0, 1, 2]
+    assert spans['outer/inner']['size'] == 3
+    # Children start after and end before their parents
+    for parent, child in [('outer', 'outer/inner'), ('outer/inner', 'outer/inner/work')]:
+        assert spans[parent]['start'] <= spans[child]['start']
+        assert spans[child]['start'] + spans[child]['duration'] <= spans[parent]['start'] + spans[parent]['duration']
+    assert [entry['path'] for entry in point['spans']] == ['phase1']
+    assert prof.summary()['spans']['work']['calls'] == 1
+
+def test_profiling_off_records_nothing():
+    assert ProfilerModule.active is None
+    with span('outer'):
+        assert work(10) == 45
+    prof = Profiler()
+    assert prof.records == [] and prof.summary()['records'] == 0
+
+def test_sweep_profile(tmp_path):
+    brian2 = pytest.importorskip('brian2')
+    from benchmarks.fixtures import sweep_config
+    from lib.BatchSweep import BatchSweep
+    sweep = BatchSweep(sweep_config(20,t1=10,t2=20),n_workers=1,profile=True)
+    sweep.run([1*brian2.mV],[0.0, 0.5])
+    records = sweep.profiler.records
+    assert [record['labels']['p_couple'] for record in records] == [0.0, 0.5]
+    for record in records:
+        paths = [entry['path'] for entry in record['spans']]
+        for phase in ['network_construction', 'phase1', 'phase2', 'phase3', 'get_states']:
+            assert phase in paths
+        assert record['brian2'] and record['codegen'] >= 0
+        assert sum(entry['duration'] for entry in record['spans'] if entry['depth'] == 0) <= record['total']
+    summary = sweep.profiler.summary()
+    assert summary['spans']['phase2']['calls'] == 2
+    assert 'phase2' in sweep.profiler.report()
+    with open(sweep.profiler.save(str(tmp_path / 'profile.json'))) as f:
+        assert len(json.load(f)['records']) == 2
@@ -0,0 +1,33 @@
+import numpy as np
+import pytest
+
+brian2 = pytest.importorskip('brian2')
+from brian2 import mV, pamp
+
+from benchmarks.fixtures import sweep_config
+from lib.BatchSweep import ReplicaSweep, run_point, coupling_seed
+
+def test_replicas_match_serial_points():
+    # Without Poisson input and with zero coupling weights both runs are deterministic, so every replica must
+    # reproduce run_point of its own grid point. Per point input currents tell the replicas apart
+    config = sweep_config(30,t1=20,t2=40)
+    config['PInput'] = [0*mV]*3
+    def replica_states(w_couple,p_couple,rng):
+        return [{'I': rng.normal(10,1,30)*pamp}, {'I': rng.normal(12,1,30)*pamp}]
+    w_couple_vec = [0*mV]
+    p_couple_vec = [0.1, 0.3, 0.5, 0.7, 0.9]
+    record_param = [(0*mV, p_couple) for p_couple in p_couple_vec]
+    sweep = ReplicaSweep(config,n_workers=1,seed=3,replicas=2,replica_states=replica_states) # Last batch is partial
+    coeff, datastream, voltage_monitor, conductance_monitor, states = sweep.run(w_couple_vec,p_couple_vec,
+                                                                                 record_param)
+    assert not np.array_equal(np.asarray(datastream[0][0]), np.asarray(datastream[1][0])) # Replicas differ
+    for prob, p_couple in enumerate(p_couple_vec): # record_param follows p_couple_vec
+        net1, net2 = states[prob][0]
+        point = dict(config, states=[net1, net2, config['states'][2]])
+        cc, spikes, monitors = run_point(point,0*mV,p_couple,0,True,coupling_seed(3,p_couple))
+        assert np.isclose(coeff[prob,0], cc)
+        assert len(spikes[0]) > 0 and len(spikes[2]) > 0
+        for serial, replica in zip(spikes, datastream[prob]):
+            assert np.array_equal(np.asarray(serial), np.asarray(replica))
+        for serial, replica in zip(monitors[0] + monitors[1], voltage_monitor[prob] + conductance_monitor[prob]):
+            assert np.allclose(np.asarray(serial), np.asarray(replica))
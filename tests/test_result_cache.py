@@ -0,0 +1,86 @@
+import os
+import numpy as np
+import pytest
+
+from lib.ResultCache import ResultCache
+
+brian2 = pytest.importorskip('brian2')
+from brian2 import mV, ms
+
+from benchmarks.fixtures import sweep_config
+from lib.BatchSweep import BatchSweep
+
+def test_key_changes_with_every_input(tmp_path):
+    cache = ResultCache(str(tmp_path))
+    config = sweep_config(20)
+    base = BatchSweep(config,n_workers=1,cache=cache).point_key(1*mV,0.5)
+
+    def changed(name,value):
+        other = dict(config)
+        other[name] = value
+        return BatchSweep(other,n_workers=1,cache=cache).point_key(1*mV,0.5)
+
+    rows, cols, connect_W = config['topology'][0]
+    cols = cols.copy()
+    cols[0] = (cols[0] + 1) % config['N']
+    states = [dict(s) for s in config['states']]
+    states[2]['I'] = states[2]['I']*1.01
+    namespace = dict(config['namespace'], tau_ge=3*ms)
+    keys = [BatchSweep(config,n_workers=1,cache=cache,seed=1).point_key(1*mV,0.5),
+            BatchSweep(config,n_workers=1,cache=cache,template=True).point_key(1*mV,0.5),
+            BatchSweep(config,n_workers=1,cache=cache,engine='numpy').point_key(1*mV,0.5),
+            BatchSweep(config,n_workers=1,cache=cache).point_key(2*mV,0.5),
+            BatchSweep(config,n_workers=1,cache=cache).point_key(1*mV,0.25),
+            changed('topology',[(rows,cols,connect_W)] + config['topology'][1:]),
+            changed('states',states),
+            changed('namespace',namespace),
+            changed('PInput',[0.2*mV]*3),
+            changed('t1',config['t1'] + 1),
+            changed('t2',config['t2'] + 1),
+            changed('integ_method','euler'),
+            changed('connect_type','ii'),
+            changed('pattern','probabilistic'),
+            changed('v_c',-71*mV)]
+    assert base not in keys
+    assert len(set(keys)) == len(keys)
+    # Code generation target does not change results
+    assert changed('codegen_target','cython') == base
+    assert len({cache.key(1), cache.key('1'), cache.key(np.array([1])), cache.key(1*mV)}) == 4
+
+def test_put_is_atomic(tmp_path, monkeypatch):
+    cache = ResultCache(str(tmp_path))
+    key = cache.key('point')
+    cache.put(key,{'cc': np.array(0.5)})
+
+    def interrupted(f,**point):
+        f.write(b'PK\x03\x04partial') # Starts writing, then the process is interrupted
+        raise KeyboardInterrupt
+    monkeypatch.setattr(np, 'savez', interrupted)
+    with pytest.raises(KeyboardInterrupt):
+        cache.put(key,{'cc': np.array(0.9)})
+    with pytest.raises(KeyboardInterrupt):
+        cache.put(cache.key('other'),{'cc': np.array(0.9)})
+    monkeypatch.undo()
+
+    assert sorted(os.listdir(str(tmp_path))) == [key + '.npz'] # No temporary or half-written files
+    assert cache.get(key)['cc'] == 0.5
+    assert cache.get(cache.key('other')) is None
+
+def test_cached_rerun_returns_same_arrays(tmp_path, monkeypatch):
+    config = sweep_config(30,t1=20,t2=40)
+    w_couple_vec = [0*mV, 2*mV]
+    p_couple_vec = [0.0, 0.5]
+    record_param = [(2*mV, 0.5)]
+    first = BatchSweep(config,n_workers=1,cache=ResultCache(str(tmp_path)),engine='numpy').run(
+        w_couple_vec,p_couple_vec,record_param)
+
+    def no_simulation(points,*args):
+        assert points == [] # Every point comes from the cache
+    sweep = BatchSweep(config,n_workers=1,cache=ResultCache(str(tmp_path)),engine='numpy')
+    monkeypatch.setattr(sweep, 'run_points', no_simulation)
+    again = sweep.run(w_couple_vec,p_couple_vec,record_param)
+
+    assert np.array_equal(first[0], again[0], equal_nan=True)
+    for entry, cached in zip(first[1][0] + first[2][0] + first[3][0], again[1][0] + again[2][0] + again[3][0]):
+        assert np.array_equal(np.asarray(entry), np.asarray(cached))
+        assert brian2.get_dimensions(entry) == brian2.get_dimensions(cached)
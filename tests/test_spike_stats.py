@@ -0,0 +1,57 @@
+import numpy as np
+import scipy.sparse as sp
+
+from benchmarks.fixtures import spike_fixture
+from lib.Spike_Stats import Spike_Stats
+
+def test_batch_cc_old_matches_batch_cc():
+    stats = Spike_Stats()
+    S1 = spike_fixture(50,20,300,seed=0)
+    S2 = spike_fixture(50,20,300,seed=1)
+    assert np.isclose(stats.batch_cc_old(S1,S1,100,200,300), 1.0)
+    for bin_size in [1, 5]:
+        assert np.isclose(stats.batch_cc_old(S1,S2,100,200,300,bin_size), stats.batch_cc(S1.t,S2.t,100,200,bin_size))
+
+def test_spike_cc_matches_corrcoef():
+    stats = Spike_Stats()
+    X, _ = stats.spikebin_matrix(spike_fixture(30,20,200,seed=2),0,200,5)
+    Y, _ = stats.spikebin_matrix(spike_fixture(40,20,200,seed=3),0,200,5)
+    X = X.toarray().astype(np.float64)
+    Y = Y.toarray().astype(np.float64)
+    expected = np.corrcoef(X,Y)[:30,30:]
+    assert np.allclose(stats.spike_cc(X,Y), expected, equal_nan=True)
+    assert np.allclose(stats.spike_cc(sp.csr_matrix(X),sp.csr_matrix(Y)), expected, equal_nan=True)
+
+def test_spike_cc_zero_variance_pairs():
+    stats = Spike_Stats()
+    X = np.array([[0, 0, 0, 0], [1, 1, 1, 1], [1, 0, 1, 0]], dtype=np.float64)
+    for A in [X, sp.csr_matrix(X)]:
+        corr = stats.spike_cc(A,A)
+        assert np.isnan(corr[0,0]) # two silent neurons are not perfectly correlated
+        assert corr[1,1] == 1 # spikes in every bin
+        assert np.isnan(corr[0,1]) and np.isnan(corr[1,2]) and np.isnan(corr[2,0])
+        assert np.isclose(corr[2,2], 1)
+
+def test_spike_tcc_constant_trains():
+    stats = Spike_Stats()
+    assert stats.spike_tcc(np.ones(5),np.ones(5)) == 1
+    # Both networks fire in every 1 ms bin of the window, including the bin of spikes at tend
+    t = np.append(np.arange(100.5, 200, 1.0), 200.0)
+    assert stats.batch_cc(t,t,100,200,1) == 1
+
+def test_ISI_arrays_match_ISI_stats():
+    stats = Spike_Stats()
+    spikes = spike_fixture(40,20,1000,seed=4)
+    mean, var, cv, lv, count = stats.ISI_arrays(spikes)
+    ISI, ISI_mean, ISI_var, ISI_cv = stats.ISI_stats(spikes)
+    for i, isi in ISI.items():
+        assert count[i] == len(isi)
+        assert np.isclose(ISI_mean[i], np.mean(isi)) and np.isclose(mean[i], np.mean(isi))
+        assert np.isclose(ISI_var[i], np.var(isi)) and np.isclose(var[i], np.var(isi))
+        assert np.isclose(ISI_cv[i], np.std(isi)/np.mean(isi)) and np.isclose(cv[i], ISI_cv[i])
+        assert np.isclose(lv[i], np.mean(3*((isi[:-1] - isi[1:])/(isi[:-1] + isi[1:]))**2))
+    # Poisson spikes have a CV and LV close to 1, a regular train 0
+    _, _, cv, lv, _ = stats.ISI_arrays(spike_fixture(40,500,50000,seed=5))
+    assert abs(np.mean(cv) - 1) < 0.05 and abs(np.mean(lv) - 1) < 0.05
+    regular = stats.ISI_arrays({0: np.arange(0, 100, 5.0)}, N=2)
+    assert np.allclose([regular[2][0], regular[3][0]], 0) and np.isnan(regular[2][1])
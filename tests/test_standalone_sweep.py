@@ -0,0 +1,47 @@
+import shutil
+import numpy as np
+import pytest
+
+brian2 = pytest.importorskip('brian2')
+from brian2 import mV
+
+from benchmarks.fixtures import sweep_config
+from lib.BatchSweep import run_point, coupling_seed
+from lib.StandaloneSweep import StandaloneSweep
+
+pytestmark = pytest.mark.skipif(shutil.which('g++') is None, reason='C++ standalone needs a compiler')
+
+def run(config,directory,w_couple_vec,p_couple_vec,record_param):
+    sweep = StandaloneSweep(config,str(directory),n_workers=2,seed=7)
+    try:
+        return sweep.run(w_couple_vec,p_couple_vec,record_param)
+    finally:
+        sweep.close()
+
+def test_standalone_matches_runtime_without_noise(tmp_path):
+    # Deterministic model, so one run of the compiled binary reproduces run_point of the runtime device
+    config = sweep_config(30,t1=20,t2=40)
+    config['PInput'] = [0*mV]*3
+    coeff, datastream, voltage_monitor, _ = run(config,tmp_path,[0*mV, 2*mV],[0.5],[(0*mV, 0.5)])
+    cc, spikes, monitors = run_point(config,0*mV,0.5,0,True,coupling_seed(7,0.5))
+    assert len(spikes[0]) > 0
+    assert np.isclose(coeff[0,0], cc)
+    for runtime, standalone in zip(spikes, datastream[0]):
+        assert np.allclose(np.asarray(runtime), np.asarray(standalone))
+    assert np.allclose(np.asarray(monitors[0][1]), np.asarray(voltage_monitor[0][1]))
+
+def test_coupling_only_acts_in_the_coupled_phase(tmp_path):
+    # Noise is drawn once at build time, so points differ only through their coupling weights
+    config = sweep_config(30,t1=20,t2=40)
+    _, datastream, _, _ = run(config,tmp_path,[0*mV, 5*mV],[0.0, 0.5],
+                              [(0*mV, 0.0), (0*mV, 0.5), (5*mV, 0.0), (5*mV, 0.5)])
+    t2 = [np.asarray(entry[2]) for entry in datastream]
+    assert all(np.array_equal(t2[0], t) for t in t2[:3]) # No coupling synapses or zero weights
+    assert not np.array_equal(t2[0], t2[3])
+    t1 = 0.020 # s, end of the first uncoupled phase
+    assert np.array_equal(t2[0][t2[0] < t1], t2[3][t2[3] < t1])
+
+def test_uncoupled_grid_builds_without_coupling_synapses(tmp_path):
+    config = sweep_config(30,t1=20,t2=40)
+    coeff, _, _, _ = run(config,tmp_path,[1*mV],[0.0],())
+    assert coeff.shape == (1, 1) and np.isfinite(coeff[0,0])
@@ -0,0 +1,51 @@
+import numpy as np
+import pytest
+import scipy.sparse as sp
+
+from benchmarks.fixtures import spike_fixture
+from lib.SynchronicityCalculation import SynchronicityCalculation, cross_correlogram
+
+def correlate(x,y,max_lag):
+    # Direct counts[lag] = sum_t x[t]*y[t+lag], np.correlate(y,x) has lag 0 at index len(x)-1
+    full = np.correlate(y, x, 'full')
+    return full[len(x)-1-max_lag:len(x)+max_lag]
+
+def test_cross_correlogram_matches_np_correlate():
+    rng = np.random.default_rng(0)
+    x = rng.poisson(0.3, 500).astype(np.float64)
+    y = np.roll(x, 7) + rng.poisson(0.1, 500) # y follows x by 7 bins
+    z = np.roll(x, -12) # z leads x by 12 bins
+    lags, counts, _ = cross_correlogram(x,y,20)
+    assert np.array_equal(lags, np.arange(-20, 21))
+    assert np.allclose(counts, correlate(x,y,20))
+    assert lags[np.argmax(counts)] == 7
+    _, counts, _ = cross_correlogram(x,z,20)
+    assert np.allclose(counts, correlate(x,z,20))
+    assert lags[np.argmax(counts)] == -12
+    # Shuffle predictor: mean over every circular shift of y, counted over the bins that overlap at each lag
+    shifted = np.array([correlate(x,np.roll(y,s),20) for s in range(len(y))])
+    _, _, baseline = cross_correlogram(x,y,20)
+    assert np.allclose(baseline, shifted.mean(axis=0))
+
+def test_pairs_match_single_trains():
+    rng = np.random.default_rng(1)
+    X = rng.poisson(0.2, (6, 300)).astype(np.float64)
+    Y = rng.poisson(0.2, (4, 300)).astype(np.float64)
+    pairs = (np.array([0, 5, 5, 2]), np.array([3, 0, 3, 3]))
+    lags, counts, _ = cross_correlogram(sp.csr_matrix(X),sp.csr_matrix(Y),50,pairs,block_size=3)
+    for k, (i, j) in enumerate(zip(*pairs)):
+        assert np.allclose(counts[k], correlate(X[i],Y[j],50))
+
+def test_trains_of_unequal_length():
+    # Network 2 stops firing early, both trains are binned up to the last spike of either network
+    S1 = spike_fixture(20,20,400,seed=2)
+    S2 = spike_fixture(20,20,250,seed=3)
+    sync = SynchronicityCalculation()
+    lags, cross, _, auto = sync.CrossCorrelation(S1,S2,0,None,bin_size=2,max_lag=40)
+    x1 = sync.binned_total(S1,0,S1.by_time()[0].max(),2)
+    x2 = sync.binned_total(S2,0,S1.by_time()[0].max(),2)
+    assert np.array_equal(lags, np.arange(-40, 41, 2))
+    assert np.allclose(cross, correlate(x1,x2,20))
+    assert np.allclose(auto, correlate(x1,x1,20))
+    with pytest.raises(ValueError):
+        cross_correlogram(x1,x2[:-1],20)
@@ -0,0 +1,24 @@
+import numpy as np
+import pytest
+
+from benchmarks.fixtures import spike_fixture
+from lib.SynchronicityCalculation import SpikeTrain, isi_distance, spike_distance, spike_sync
+from lib.SynchronyMatrix import SynchronyMatrix
+
+PAIRWISE = {'isi': isi_distance, 'spike': spike_distance, 'sync': spike_sync}
+
+def pairwise(spikes1,spikes2,measure,tstart,tend):
+    trains1 = [SpikeTrain(spikes1.train(k), (tstart, tend)) for k in range(spikes1.N)]
+    trains2 = [SpikeTrain(spikes2.train(k), (tstart, tend)) for k in range(spikes2.N)]
+    return np.array([[PAIRWISE[measure](st1, st2) for st2 in trains2] for st1 in trains1])
+
+@pytest.mark.parametrize('measure', ['isi', 'spike', 'sync'])
+@pytest.mark.parametrize('n_workers', [1, 2])
+def test_synchrony_matrix_matches_pairwise(measure,n_workers):
+    spikes1 = spike_fixture(7,5,100,seed=4)
+    spikes2 = spike_fixture(9,5,100,seed=5)
+    matrices = SynchronyMatrix(measure,tile_size=3,n_workers=n_workers)
+    between = matrices.compute(spikes1,spikes2,0,100)
+    within = matrices.compute(spikes1,None,0,100)
+    assert np.allclose(between, pairwise(spikes1,spikes2,measure,0,100))
+    assert np.allclose(within, pairwise(spikes1,spikes1,measure,0,100))
@@ -0,0 +1,19 @@
+import numpy as np
+import pytest
+
+brian2 = pytest.importorskip('brian2')
+
+from benchmarks.fixtures import sweep_config
+from lib.BrianVisualization import BrianVisualization
+
+def test_template_control_cached_per_seed():
+    brian2.start_scope()
+    config = sweep_config(40,t1=20,t2=40)
+    config['PInput'] = [2*brian2.mV]*3 # Noise dominated, so the seed changes the spikes
+    BrianVis = BrianVisualization()
+    template = BrianVis.network_template(config,[0.0])
+    first = BrianVis.template_control(template,80,rand_seed=1)
+    other = BrianVis.template_control(template,80,rand_seed=2)
+    again = BrianVis.template_control(template,80,rand_seed=1)
+    assert not np.array_equal(np.asarray(first), np.asarray(other))
+    assert np.array_equal(np.asarray(first), np.asarray(again))
@@ -0,0 +1,42 @@
+import os
+import pickle
+import numpy as np
+import pytest
+
+import lib.TopologyStore as TopologyStoreModule
+from lib.TopologyStore import TopologyStore, ARRAYS
+
+def arrays(topology):
+    return [np.array(getattr(topology, name)) for name in ARRAYS]
+
+def test_reload_gives_the_same_topology(tmp_path, monkeypatch):
+    store = TopologyStore(str(tmp_path / 'a'))
+    first = arrays(store.get('small_world',300,6,0.2,seed=4))
+    # Fresh process view of the files: nothing mapped yet, the stored topology is read back instead of generated
+    monkeypatch.setattr(TopologyStoreModule, 'opened', {})
+    monkeypatch.setattr(TopologyStore, 'generate', lambda *args: pytest.fail('stored topology generated again'))
+    reloaded = TopologyStore(str(tmp_path / 'a')).get('small_world',300,6,0.2,seed=4)
+    assert all(isinstance(getattr(reloaded, name), np.memmap) for name in ARRAYS)
+    for stored, mapped in zip(first, arrays(reloaded)):
+        assert np.array_equal(stored, mapped)
+    # Workers unpickle the same mapped files
+    assert pickle.loads(pickle.dumps(reloaded)) is reloaded
+    pytest.importorskip('brian2') # connect_W of the BatchSweep topology entry is a Brian2 quantity
+    _, _, connect_W = reloaded
+    assert np.array_equal(np.asarray(connect_W), first[3])
+
+def test_topology_depends_only_on_seed(tmp_path):
+    # Two stores generate the same arrays for the same seed, a different seed gives a different topology
+    a = TopologyStore(str(tmp_path / 'a'))
+    b = TopologyStore(str(tmp_path / 'b'))
+    for generator, k, p in [('small_world', 6, 0.2), ('random', None, 0.05)]:
+        same = arrays(a.get(generator,200,k,p,seed=1))
+        assert all(np.array_equal(x, y) for x, y in zip(same, arrays(b.get(generator,200,k,p,seed=1))))
+        other = arrays(a.get(generator,200,k,p,seed=2))
+        edges = set(zip(same[0].tolist(), same[1].tolist()))
+        assert edges != set(zip(other[0].tolist(), other[1].tolist()))
+        assert not np.array_equal(same[3][:100], other[3][:100])
+        # connect_W is connect_A scaled by uniform(0,1) mV, inhibitory neurons are the last 20%
+        assert np.all(np.abs(same[3]) <= 1e-3) and np.all(np.sign(same[3]) == same[2])
+        assert np.array_equal(same[2] < 0, same[0] >= int(0.8*200))
+    assert len(a.keys()) == 4 and not [name for name in os.listdir(str(tmp_path / 'a')) if name.startswith('.tmp-')]
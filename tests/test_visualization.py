@@ -0,0 +1,41 @@
+import numpy as np
+import pytest
+
+from lib.AdjacencyMatrix import AdjacencyMatrix
+from lib.Visualization import Visualization
+
+@pytest.mark.parametrize('n', [50, 300]) # node by node drawing and density image
+@pytest.mark.parametrize('sparse', [False, True])
+def test_ex_in_connec(n,sparse):
+    am = AdjacencyMatrix(n)
+    A, G = am.small_world(n,4,0.2)
+    connect_A, new_coord, new_rows, new_cols = am.adj_synapse_type(A,int(0.8*n),sparse=sparse)
+    connect_W = connect_A*np.random.default_rng(0).uniform(0,1,len(connect_A))
+    vis = Visualization()
+    ax = vis.ex_in_connec(G,connect_W,new_coord)
+    assert ax.get_title() == 'Structural Connections'
+    if n > 200:
+        assert len(ax.images) == 1 # Density image
+        excit, inhib = vis.ex_in_density(new_rows,new_cols,connect_W,n)
+        assert excit.sum() + inhib.sum() == len(new_rows)
+        assert inhib.sum() == np.count_nonzero(connect_W < 0)
+    # Also accepts the coordinate pairs as an iterable of tuples
+    vis.ex_in_connec(G,connect_W,zip(new_rows,new_cols))
+
+def test_ex_in_density():
+    rows = np.array([0, 1, 3, 9])
+    cols = np.array([5, 2, 8, 9])
+    connect_W = np.array([0.5, -0.2, 0.1, -1.0])
+    excit, inhib = Visualization().ex_in_density(rows,cols,connect_W,10,n_bins=5)
+    assert excit.shape == (5, 5)
+    assert excit.sum() == 2 and inhib.sum() == 2
+    assert excit[0,2] == 1 and inhib[4,4] == 1
+
+def test_clustering_matches_networkx():
+    nx = pytest.importorskip('networkx')
+    from lib.Visualization import clustering
+    G = nx.newman_watts_strogatz_graph(300,6,0.3,seed=2)
+    expected = nx.clustering(G)
+    assert np.allclose(clustering(G), [expected[k] for k in G.nodes()])
+    A, SG = AdjacencyMatrix.__new__(AdjacencyMatrix).small_world_sparse(300,6,0.3,seed=2)
+    assert np.allclose(clustering(SG), list(nx.clustering(SG.to_networkx()).values()))